@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from iraklis7_scg.cache import ResultCache
+import iraklis7_scg.config as config
+from iraklis7_scg.cpw import CPW
+from iraklis7_scg.docstore import DocumentStore
+from iraklis7_scg.events import EventDispatcher, LogSink, StdoutSink
+from iraklis7_scg.jobs import Job
+from iraklis7_scg.metrics import MetricsSink
+from iraklis7_scg.replay import ReplayClient, load_recordings, synthetic_recording
+from iraklis7_scg.reports import ReportStore
+from iraklis7_scg.rtl import RtlIndexStore
+from iraklis7_scg.scg import SCG
+
+# Offline benchmarks of our own overhead: every session is replayed from
+# recordings (synthetic ones unless --recordings is given), nothing reaches
+# the Copilot service.
+#
+#   python benchmarks/bench_scg.py --latency 0.2 --token-rate 200 --json bench.json
+
+PREVIOUS_SPEC = config.PROJ_ROOT / "ip/uart16550/doc/UART_spec.pdf"
+ACTIONS = {
+    "create_report": lambda: [
+        {"type": "file", "path": str(config.LATEST_SPEC)},
+        {"type": "file", "path": str(PREVIOUS_SPEC)},
+    ],
+    "build_uvm_tb": lambda: [{"type": "file", "path": str(config.LATEST_SPEC)}],
+}
+
+
+def summarise(samples) -> dict:
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        "max": samples[-1],
+    }
+
+
+class Bench(object):
+    def __init__(self, recordings, work_dir, latency, token_rate, model):
+        self.__recordings = recordings
+        self.__dir = Path(work_dir)
+        self.__latency = latency
+        self.__token_rate = token_rate
+        self.__model = model
+        self.__devnull = open(os.devnull, "w")
+        # Replayed messages are logged in full, keep them off the terminal
+        config.stdout_handler.setLevel(logging.WARNING)
+        # Outputs of the runs stay in the scratch directory
+        config.configure(report_dir=self.__dir / "reports", uvm_tb_dir=self.__dir / "uvm_tb")
+
+    def make_client(self, latency=None) -> ReplayClient:
+        return ReplayClient(
+            self.__recordings,
+            latency=self.__latency if latency is None else latency,
+            token_rate=self.__token_rate,
+        )
+
+    def make_scg(self, client=None) -> SCG:
+        return SCG(
+            cache=ResultCache(self.__dir / "cache"),
+            docs=DocumentStore(self.__dir / "docs"),
+            events=EventDispatcher([StdoutSink(self.__devnull), LogSink()]),
+            metrics=MetricsSink(self.__dir / "metrics"),
+            client=client or self.make_client(),
+            rtl=RtlIndexStore(self.__dir / "rtl_index"),
+            reports=ReportStore(self.__dir / "reports.db"),
+        )
+
+    async def end_to_end(self, action, iterations, streaming) -> dict:
+        # Wall time of whole runs, local prepasses and triage included
+        scg = self.make_scg()
+        await scg.client_start()
+        method = getattr(scg, action)
+        samples = []
+        tracemalloc.start()
+        try:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                await method(
+                    model=self.__model,
+                    streaming=streaming,
+                    attachments=ACTIONS[action](),
+                    use_cache=False,
+                )
+                samples.append(time.perf_counter() - started)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            await scg.client_stop()
+        return {
+            "action": action,
+            "streaming": streaming,
+            "latency": summarise(samples),
+            "peak_memory_bytes": peak,
+            # Per prompt, e.g. scg_delta_report_diff when the prepass succeeded
+            "metrics": scg.metrics_summary(),
+        }
+
+    async def handler_overhead(self, events) -> dict:
+        # Time spent in CPW's callback and the dispatcher per event, measured
+        # against replaying the same stream to a session nobody listens to
+        text = "x" * events
+        recording = [synthetic_recording(self.__model, text=text, chunk_chars=1, tools=0)]
+
+        bare = ReplayClient(recording)
+        session = await bare.create_session({"model": self.__model, "streaming": True})
+        started = time.perf_counter()
+        await session.send_and_wait({"prompt": ""}, timeout=None)
+        baseline = time.perf_counter() - started
+
+        cpw = CPW(
+            client=ReplayClient(recording),
+            events=EventDispatcher([StdoutSink(self.__devnull), LogSink()]),
+        )
+        await cpw.client_start()
+        context = await cpw.create_session({"model": self.__model, "streaming": True})
+        started = time.perf_counter()
+        await cpw.client_send(True, {"prompt": ""}, None, context)
+        await cpw.get_events().drain()
+        handled = time.perf_counter() - started
+        stats = cpw.get_events().get_stats()
+        await cpw.client_stop()
+        return {
+            "events": events,
+            "baseline_s": baseline,
+            "handled_s": handled,
+            "overhead_us_per_event": (handled - baseline) / events * 1e6,
+            "events_per_s": events / handled,
+            "dispatcher": stats,
+        }
+
+    async def concurrency(self, levels, latency) -> list:
+        # Sessions are latency bound, so wall time should stay flat as jobs
+        # are added until our own overhead or the pool starts to serialise them
+        results = []
+        for level in levels:
+            scg = self.make_scg(self.make_client(latency))
+            await scg.client_start()
+            jobs = [
+                Job("build_uvm_tb", self.__model, ACTIONS["build_uvm_tb"](), True, f"tb{i}")
+                for i in range(level)
+            ]
+            for job in jobs:
+                job.options["use_cache"] = False
+            started = time.perf_counter()
+            await scg.run_jobs(jobs, concurrency=level)
+            wall = time.perf_counter() - started
+            await scg.client_stop()
+            results.append(
+                {
+                    "jobs": level,
+                    "wall_s": wall,
+                    "efficiency": latency / wall if wall else 0.0,
+                }
+            )
+        return results
+
+
+async def main(args):
+    if args.recordings:
+        recordings = load_recordings(args.recordings)
+    else:
+        recordings = [synthetic_recording(args.model, tools=4)]
+    with tempfile.TemporaryDirectory() as work_dir:
+        bench = Bench(recordings, work_dir, args.latency, args.token_rate, args.model)
+        results = {"end_to_end": [], "concurrency": None, "handler": None}
+        for action in ACTIONS:
+            for streaming in (False, True):
+                result = await bench.end_to_end(action, args.iterations, streaming)
+                results["end_to_end"].append(result)
+                print(
+                    f"{action:14} streaming={streaming!s:5} "
+                    f"p50={result['latency']['p50'] * 1e3:8.1f} ms "
+                    f"p95={result['latency']['p95'] * 1e3:8.1f} ms "
+                    f"peak={result['peak_memory_bytes'] / 2**20:6.1f} MiB"
+                )
+        results["handler"] = await bench.handler_overhead(args.events)
+        print(
+            f"handler        {results['handler']['overhead_us_per_event']:8.2f} us/event, "
+            f"{results['handler']['events_per_s']:10.0f} events/s"
+        )
+        levels = [int(level) for level in args.jobs.split(",")]
+        results["concurrency"] = await bench.concurrency(levels, max(args.latency, 0.1))
+        for result in results["concurrency"]:
+            print(
+                f"concurrency    jobs={result['jobs']:3} wall={result['wall_s'] * 1e3:8.1f} ms "
+                f"efficiency={result['efficiency']:.2f}"
+            )
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the SCG client stack")
+    parser.add_argument("--recordings", help="directory of recorded sessions (SCG_RECORD_DIR)")
+    parser.add_argument("--model", default="replay")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to first event")
+    parser.add_argument("--token-rate", type=float, default=None, help="replayed tokens/s")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--jobs", default="1,2,4,8")
+    parser.add_argument("--json", help="write the results to this file")
+    sys.exit(asyncio.run(main(parser.parse_args())))
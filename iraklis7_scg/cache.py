@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Optional
+
+import iraklis7_scg.config as config
+
+# Bump whenever the key layout changes, so stale entries are never matched
+CACHE_FORMAT = 1
+
+
+def hash_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_dir(directory) -> dict:
+    # Map of relative path -> (mtime_ns, size), used to find files written by a session
+    result = {}
+    if directory is None or not Path(directory).is_dir():
+        return result
+    directory = Path(directory)
+    for path in directory.rglob("*"):
+        if path.is_file():
+            stat = path.stat()
+            result[path.relative_to(directory).as_posix()] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+
+def changed_files(before, after) -> list:
+    return sorted(rel for rel, sig in after.items() if before.get(rel) != sig)
+
+
+def _write_json(path, data):
+    # Readers see the old file or the new one, never a partial write
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+class ResultCache(object):
+    def __init__(self, cache_dir=None, max_bytes=None, max_age=None):
+        self.__dir = Path(cache_dir) if cache_dir else config.CACHE_DIR
+        self.__max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.__max_age = config.CACHE_MAX_AGE if max_age is None else max_age
+        # (path, mtime_ns, size) -> sha256, so unchanged attachments are hashed once
+        self.__hashes = {}
+
+    def get_dir(self) -> Path:
+        return self.__dir
+
+    def hash_attachment(self, attachment) -> str:
+        kind = attachment.get("type")
+        if kind == "file":
+            return self.__hash_path(Path(attachment["path"]))
+        if kind == "directory":
+            root = Path(attachment["path"])
+            digest = hashlib.sha256()
+            for path in sorted(p for p in root.rglob("*") if p.is_file()):
+                digest.update(path.relative_to(root).as_posix().encode())
+                digest.update(self.__hash_path(path).encode())
+            return digest.hexdigest()
+        if kind == "selection":
+            return hashlib.sha256(attachment.get("text", "").encode()).hexdigest()
+        raise ValueError(f"Unsupported attachment type: {kind}")
+
+    def make_key(self, action, model, user, prompt, attachments):
+        # Returns None when an attachment cannot be hashed, which bypasses the cache
+        try:
+            material = {
+                "format": CACHE_FORMAT,
+                "action": action,
+                "model": model,
+                "user": user,
+                "prompt": prompt,
+                "attachments": [self.hash_attachment(a) for a in attachments],
+            }
+        except (OSError, KeyError, ValueError) as e:
+            config.logger.warning(f"Result cache bypassed: {e}")
+            return None
+        blob = json.dumps(material, sort_keys=True).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def get(self, key):
+        entry_dir = self.__entry_dir(key)
+        meta_path = entry_dir / "entry.json"
+        if not meta_path.is_file():
+            config.logger.debug(f"Cache miss: {key}")
+            return None
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        if self.__is_expired(meta):
+            config.logger.debug(f"Cache entry expired: {key}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        meta["accessed"] = time.time()
+        _write_json(meta_path, meta)
+        config.logger.info(f"Cache hit: {key} ({meta['action']}, {meta['model']})")
+        return meta
+
+    def put(self, key, action, model, response, source_dir, files) -> Optional[dict]:
+        # A run that failed or was cut short replies with nothing, which must
+        # not be served again. None means the response was empty and nothing
+        # was cached; otherwise the stored entry's metadata is returned.
+        if not (response or "").strip():
+            config.logger.debug(f"Not caching {action}: empty response")
+            return None
+        entry_dir = self.__entry_dir(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        files_dir = entry_dir / "files"
+        files_dir.mkdir(parents=True)
+        size = 0
+        for rel in files:
+            target = files_dir / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(Path(source_dir) / rel, target)
+            size += target.stat().st_size
+        now = time.time()
+        meta = {
+            "key": key,
+            "action": action,
+            "model": model,
+            "created": now,
+            "accessed": now,
+            "size": size + len(response or ""),
+            "response": response,
+            "files": list(files),
+        }
+        # Written last, so an entry is only visible once its files are in place
+        _write_json(entry_dir / "entry.json", meta)
+        config.logger.info(f"Cached {len(files)} file(s) for {action} under {key}")
+        self.evict()
+        return meta
+
+    def restore(self, meta, dest_dir) -> list:
+        files_dir = self.__entry_dir(meta["key"]) / "files"
+        restored = []
+        for rel in meta["files"]:
+            target = Path(dest_dir) / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(files_dir / rel, target)
+            restored.append(target)
+        config.logger.info(f"Restored {len(restored)} cached file(s) into {dest_dir}")
+        return restored
+
+    def list_entries(self) -> list:
+        entries = []
+        for meta_path in self.__dir.glob("*/*/entry.json"):
+            try:
+                entries.append(json.loads(meta_path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda m: m["accessed"], reverse=True)
+
+    def evict(self) -> int:
+        removed = 0
+        live = []
+        for meta in self.list_entries():
+            if self.__is_expired(meta):
+                shutil.rmtree(self.__entry_dir(meta["key"]), ignore_errors=True)
+                removed += 1
+            else:
+                live.append(meta)
+        # Least recently used entries go first once the size budget is exceeded
+        total = sum(m["size"] for m in live)
+        while live and total > self.__max_bytes:
+            meta = live.pop()
+            shutil.rmtree(self.__entry_dir(meta["key"]), ignore_errors=True)
+            total -= meta["size"]
+            removed += 1
+        if removed:
+            config.logger.debug(f"Evicted {removed} cache entries")
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.__dir, ignore_errors=True)
+
+    def __is_expired(self, meta) -> bool:
+        return self.__max_age is not None and time.time() - meta["created"] > self.__max_age
+
+    def __entry_dir(self, key) -> Path:
+        return self.__dir / key[:2] / key
+
+    def __hash_path(self, path) -> str:
+        stat = os.stat(path)
+        memo = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+        if memo not in self.__hashes:
+            self.__hashes[memo] = hash_file(path)
+        return self.__hashes[memo]
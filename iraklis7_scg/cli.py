@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import json
+from pathlib import Path
+import sys
+import time
+
+import iraklis7_scg.config as config
+
+# The scg command. Commands that only read local state (config, cache, rtl,
+# reports, validate) neither import the Copilot SDK nor open the log file, so they
+# start in milliseconds; report, build and daemon load the client on demand.
+
+PDF_MAGIC = b"%PDF-"
+# Settings that can be given on the command line as well as in SCG_* variables
+OVERRIDES = (
+    "report_dir",
+    "uvm_tb_dir",
+    "cache_dir",
+    "docstore_dir",
+    "report_index_file",
+    "log_file",
+)
+
+
+def cmd_config(args) -> int:
+    print(json.dumps(config.get_settings().to_dict(), indent=2))
+    return 0
+
+
+def cmd_cache(args) -> int:
+    from iraklis7_scg.cache import ResultCache
+
+    cache = ResultCache()
+    if args.cache_command == "clear":
+        cache.clear()
+        print(f"Cleared {cache.get_dir()}")
+    elif args.cache_command == "evict":
+        print(f"Evicted {cache.evict()} entries")
+    else:
+        now = time.time()
+        for meta in cache.list_entries():
+            age = (now - meta["created"]) / 3600.0
+            files = ", ".join(meta.get("files", [])) or "-"
+            print(
+                f"{meta['key'][:12]}  {meta['action']:22} {meta['model']:20} "
+                f"{meta['size']:>10} B  {age:7.1f} h  {files}"
+            )
+    return 0
+
+
+def cmd_rtl(args) -> int:
+    from iraklis7_scg.rtl import RtlIndexStore
+
+    store = RtlIndexStore()
+    if args.rtl_command == "diff":
+        result = store.diff(args.dirs[0], args.dirs[1] if len(args.dirs) > 1 else config.RTL_DIR)
+    else:
+        result = store.get(args.dirs[0] if args.dirs else config.RTL_DIR)
+    print(json.dumps(result.to_dict(), indent=2) if args.json else result.to_markdown(), end="")
+    return 0
+
+
+def cmd_reports(args) -> int:
+    from iraklis7_scg.reports import ReportStore
+
+    # The index follows the report directory, new and changed reports are
+    # parsed here and everything else is answered from the index
+    store = ReportStore()
+    stats = store.ingest(args.dir)
+    if args.reports_command == "ingest":
+        print(json.dumps(stats) if args.json else ", ".join(f"{v} {k}" for k, v in stats.items()))
+        return 0
+    if args.reports_command == "search":
+        if not args.query:
+            print("reports search needs a query", file=sys.stderr)
+            return 1
+        results = store.search(args.query, args.spec, args.effort, args.limit)
+    elif args.reports_command == "features":
+        results = store.features(args.spec, args.effort, args.section)
+    else:
+        results = store.reports(args.spec)
+    if args.json:
+        print(json.dumps([r.to_dict() for r in results], indent=2))
+        return 0
+    for r in results:
+        versions = f"{r.spec} {r.latest} vs {r.previous}"
+        if args.reports_command == "list":
+            titles = "; ".join(f"{f['title']} ({f['effort'] or '-'})" for f in r.features)
+            print(f"{versions:24} {r.effort or '-':6} {titles or '-'}")
+        else:
+            print(f"{versions:24} {r.part:10} {r.effort or '-':6} {r.title}")
+            if r.snippet:
+                print(f"    {' '.join(r.snippet.split())}")
+            elif r.references:
+                print(f"    {', '.join(r.references)}")
+    return 0
+
+
+def cmd_validate(args) -> int:
+    # Checks report inputs before any session is opened
+    problems = []
+    for path in args.specs:
+        path = Path(path)
+        if not path.is_file():
+            problems.append(f"{path}: not found")
+            continue
+        with open(path, "rb") as f:
+            if f.read(len(PDF_MAGIC)) != PDF_MAGIC:
+                problems.append(f"{path}: not a PDF")
+    if not problems and len(args.specs) == 2:
+        from iraklis7_scg.triage import triage_pair
+
+        result = triage_pair(*args.specs)
+        print(f"{result.status}: {result.reason}")
+        if result.rejected:
+            return 1
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+def cmd_report(args) -> int:
+    attachments = [_file(args.latest), _file(args.previous)]
+    options = {
+        "use_cache": not args.no_cache,
+        "prepass": not args.no_prepass,
+        "mapreduce": args.mapreduce or None,
+        "rtl": args.rtl,
+        "rtl_baseline": args.rtl_baseline,
+    }
+    return asyncio.run(_run("create_report", args.model, args.streaming, attachments, options))
+
+
+def cmd_build(args) -> int:
+    options = {
+        "use_cache": not args.no_cache,
+        "mapreduce": args.mapreduce or None,
+        "incremental": args.incremental,
+        "rtl": args.rtl,
+    }
+    return asyncio.run(
+        _run("build_uvm_tb", args.model, args.streaming, [_file(args.spec)], options)
+    )
+
+
+def cmd_daemon(args) -> int:
+    from iraklis7_scg.daemon import main as daemon_main
+
+    return daemon_main(args.daemon_args, prog="scg daemon")
+
+
+async def _run(action, model, streaming, attachments, options) -> int:
+    from iraklis7_scg.scg import SCG
+
+    scg = SCG()
+    try:
+        await scg.client_start()
+        await getattr(scg, action)(
+            model=model, streaming=streaming, attachments=attachments, **options
+        )
+        config.logger.info(f"{action} completed")
+        return 0
+    except Exception as e:
+        config.logger.error(f"Error: {e}")
+        return 1
+    finally:
+        await scg.client_stop()
+
+
+def _file(path) -> dict:
+    return {"type": "file", "path": str(Path(path).resolve())}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="scg", description="Specification Compliance Generator")
+    for name in OVERRIDES:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, default=None)
+    parser.add_argument("--log-level", dest="log_level", default=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("config", help="show the effective settings").set_defaults(
+        func=cmd_config, light=True
+    )
+
+    cache = commands.add_parser("cache", help="inspect the result cache")
+    cache.add_argument(
+        "cache_command", nargs="?", default="list", choices=("list", "evict", "clear")
+    )
+    cache.set_defaults(func=cmd_cache, light=True)
+
+    rtl = commands.add_parser("rtl", help="index RTL sources, or diff two copies of them")
+    rtl.add_argument("rtl_command", choices=("index", "diff"))
+    rtl.add_argument("dirs", nargs="*", help="RTL directory (SCG_RTL_DIR), or OLD [NEW] to diff")
+    rtl.add_argument("--json", action="store_true")
+    rtl.set_defaults(func=cmd_rtl, light=True)
+
+    reports = commands.add_parser("reports", help="index and query generated delta reports")
+    reports.add_argument(
+        "reports_command",
+        nargs="?",
+        default="list",
+        choices=("list", "search", "features", "ingest"),
+    )
+    reports.add_argument("query", nargs="?", help="words to search for, or an FTS5 query")
+    reports.add_argument("--dir", default=None, help="report directory (SCG_REPORT_DIR)")
+    reports.add_argument("--spec", help="only reports of this specification, e.g. UART")
+    reports.add_argument("--effort", choices=("minor", "major"), type=str.lower)
+    reports.add_argument("--section", help="only features referencing this section, e.g. 4.6")
+    reports.add_argument("--limit", type=int, default=20)
+    reports.add_argument("--json", action="store_true")
+    reports.set_defaults(func=cmd_reports, light=True)
+
+    validate = commands.add_parser(
+        "validate", help="check spec PDFs, triage a latest/previous pair"
+    )
+    validate.add_argument("specs", nargs="+")
+    validate.set_defaults(func=cmd_validate, light=True)
+
+    report = commands.add_parser("report", help="create a delta report")
+    report.add_argument("latest")
+    report.add_argument("previous")
+    build = commands.add_parser("build", help="build a UVM testbench")
+    build.add_argument("spec")
+    for command, func in ((report, cmd_report), (build, cmd_build)):
+        command.add_argument("--model", required=True)
+        command.add_argument("--streaming", action="store_true")
+        command.add_argument("--no-cache", action="store_true")
+        command.add_argument("--mapreduce", action="store_true", help="analyse page windows")
+        command.add_argument(
+            "--rtl", nargs="?", const=True, default=None, help="attach an index of the RTL"
+        )
+        command.set_defaults(func=func, light=False)
+    report.add_argument("--no-prepass", action="store_true", help="send the full PDFs")
+    report.add_argument("--rtl-baseline", help="attach the RTL changes since this copy")
+    build.add_argument(
+        "--incremental", action="store_true", help="regenerate only files of changed sections"
+    )
+
+    daemon = commands.add_parser("daemon", help="run or talk to the worker daemon")
+    daemon.add_argument("daemon_args", nargs=argparse.REMAINDER)
+    daemon.set_defaults(func=cmd_daemon, light=False)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    config.configure(**{name: getattr(args, name) for name in OVERRIDES + ("log_level",)})
+    if args.light:
+        # Local commands only report problems and leave the log file alone
+        config.setup_logging(log_file="", level=args.log_level or "WARNING")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
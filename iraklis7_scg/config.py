@@ -1,36 +1,203 @@
+import atexit
+from dataclasses import asdict, dataclass, fields
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
 from pathlib import Path
+import queue
 import sys
 
-from dotenv import load_dotenv
+# Importing this module has no side effects. The .env file is read and the
+# settings are resolved on first use, logging is configured the first time
+# config.logger is used. Command line tools call configure() and
+# setup_logging() first to override either.
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+# Setup PROJ_ROOT
+PROJ_ROOT = Path(__file__).resolve().parents[1]
 
-# Setup logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.setLevel(logging.INFO)
-stdout_handler.setFormatter(formatter)
-file_handler = logging.FileHandler("iraklis7_scg.log")
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(formatter)
+@dataclass(frozen=True)
+class Settings:
+    # Setup directories
+    specs_dir: Path
+    ip_dir: Path
+    uart_dir: Path
+    uart_docs_dir: Path
+    current_spec: Path
+    latest_spec: Path
+    report_dir: Path
+    uvm_tb_dir: Path
+    # Result cache, keyed by attachment contents, model and prompt text
+    cache_dir: Path
+    cache_max_bytes: int
+    cache_max_age: float
+    # Extracted text of spec PDFs, keyed by PDF contents
+    docstore_dir: Path
+    # Partial output of streamed runs, kept until the run completes, see streaming.py
+    stream_dir: Path
+    # Per event type verbosity overrides, e.g.
+    # "tool.execution_complete=full,assistant.reasoning=quiet"
+    event_verbosity: str
+    # Per session usage metrics, as JSON lines and a Prometheus textfile
+    metrics_dir: Path
+    # Chrome trace of client, session and tool spans, written when the client stops if set
+    trace_file: str
+    trace_max_events: int
+    # Record every session's events to SCG_RECORD_DIR, or replay the recordings in
+    # SCG_REPLAY_DIR instead of talking to the Copilot service
+    record_dir: str
+    replay_dir: str
+    # Unix socket of the worker daemon, see daemon.py
+    daemon_socket: Path
+    # Verilog sources indexed for sessions and parsed files keyed by contents, see rtl.py
+    rtl_dir: Path
+    rtl_index_dir: Path
+    # SQLite full-text index of the reports in report_dir, see reports.py
+    report_index_file: Path
+    # Request policy, see policy.py: seconds without session events before a run
+    # is aborted (0 to disable), further attempts after a failure, and the
+    # latency percentile after which a second session is raced (unset to disable)
+    stall_timeout: float
+    request_retries: int
+    hedge_percentile: float
+    hedge_model: str
+    # Log file, relative to the working directory, empty to log to stdout only
+    log_file: str
+    # Level of the stdout log, the file always gets everything
+    log_level: str
 
-logger.addHandler(file_handler)
-logger.addHandler(stdout_handler)
+    @classmethod
+    def from_env(cls, env=None, **overrides) -> "Settings":
+        env = os.environ if env is None else env
+        names = {f.name for f in fields(cls)}
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(
+                f"Unknown settings {sorted(unknown)}, expected some of {sorted(names)}"
+            )
+        overrides = {name: value for name, value in overrides.items() if value is not None}
 
-# Setup PROJ_ROOT
-PROJ_ROOT = Path(__file__).resolve().parents[1]
-logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
-
-# Setup directories
-SPECS_DIR = PROJ_ROOT / "specs"
-IP_DIR = PROJ_ROOT / "ip"
-UART_DIR = PROJ_ROOT / "uart16550"
-UART_DOCS_DIR = UART_DIR / "doc"
-CURRENT_SPEC = UART_DOCS_DIR / "UART_spec.pdf"
-LATEST_SPEC = SPECS_DIR / "UART_v0.7.pdf"
-REPORT_DIR = PROJ_ROOT / "reports"
+        def get(name, default, kind=str):
+            if name in overrides:
+                return kind(overrides[name])
+            value = env.get(f"SCG_{name.upper()}")
+            return kind(value) if value is not None else default
+
+        uart_dir = get("uart_dir", PROJ_ROOT / "uart16550", Path)
+        return cls(
+            specs_dir=get("specs_dir", PROJ_ROOT / "specs", Path),
+            ip_dir=get("ip_dir", PROJ_ROOT / "ip", Path),
+            uart_dir=uart_dir,
+            uart_docs_dir=uart_dir / "doc",
+            current_spec=get("current_spec", uart_dir / "doc" / "UART_spec.pdf", Path),
+            latest_spec=get("latest_spec", PROJ_ROOT / "specs" / "UART_v0.7.pdf", Path),
+            report_dir=get("report_dir", PROJ_ROOT / "reports", Path),
+            uvm_tb_dir=get("uvm_tb_dir", PROJ_ROOT / "uvm_tb", Path),
+            cache_dir=get("cache_dir", PROJ_ROOT / ".scg_cache", Path),
+            cache_max_bytes=get("cache_max_bytes", 256 * 1024 * 1024, int),
+            cache_max_age=get("cache_max_age", 30 * 24 * 3600.0, float),
+            docstore_dir=get("docstore_dir", PROJ_ROOT / ".scg_docs", Path),
+            stream_dir=get("stream_dir", PROJ_ROOT / ".scg_streams", Path),
+            event_verbosity=get("event_verbosity", ""),
+            metrics_dir=get("metrics_dir", PROJ_ROOT / "metrics", Path),
+            trace_file=get("trace_file", None),
+            trace_max_events=get("trace_max_events", 100000, int),
+            record_dir=get("record_dir", None),
+            replay_dir=get("replay_dir", None),
+            daemon_socket=get("daemon_socket", PROJ_ROOT / ".scg_daemon.sock", Path),
+            rtl_dir=get("rtl_dir", PROJ_ROOT / "ip" / "uart16550" / "rtl" / "verilog", Path),
+            rtl_index_dir=get("rtl_index_dir", PROJ_ROOT / ".scg_rtl", Path),
+            report_index_file=get("report_index_file", PROJ_ROOT / ".scg_reports.db", Path),
+            stall_timeout=get("stall_timeout", 300.0, float),
+            request_retries=get("request_retries", 2, int),
+            hedge_percentile=get("hedge_percentile", None, float),
+            hedge_model=get("hedge_model", None),
+            log_file=get("log_file", "iraklis7_scg.log"),
+            log_level=get("log_level", "INFO"),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            name: str(value) if value is not None else None for name, value in asdict(self).items()
+        }
+
+
+# Module attributes kept for existing callers, e.g. config.CACHE_DIR
+SETTINGS_NAMES = {f.name.upper(): f.name for f in fields(Settings)}
+
+_settings = None
+_dotenv_loaded = False
+
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _load_dotenv()
+        _settings = Settings.from_env()
+    return _settings
+
+
+def configure(**overrides) -> Settings:
+    # Settings from the environment with explicit (e.g. command line) overrides on top
+    global _settings
+    _load_dotenv()
+    _settings = Settings.from_env(**overrides)
+    return _settings
+
+
+def setup_logging(log_file=None, level=None) -> logging.Logger:
+    # Configures the root logger once; later calls return it unchanged.
+    # log_file and level default to the settings, log_file="" logs to stdout only.
+    if "logger" in globals():
+        return globals()["logger"]
+    settings = get_settings()
+    log_file = settings.log_file if log_file is None else log_file
+    level = (level or settings.log_level).upper()
+
+    # Setup logger
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+
+    stdout = logging.StreamHandler(sys.stdout)
+    stdout.setLevel(level)
+    stdout.setFormatter(formatter)
+    handlers = [stdout]
+    file = None
+    if log_file:
+        file = logging.FileHandler(log_file)
+        file.setLevel(logging.DEBUG)
+        file.setFormatter(formatter)
+        handlers.append(file)
+
+    # Records are handed to a listener thread, so logging never blocks the event loop
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    globals().update(logger=root, stdout_handler=stdout, file_handler=file, log_listener=listener)
+    root.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
+    return root
+
+
+def __getattr__(name):
+    if name == "logger":
+        return setup_logging()
+    if name in ("stdout_handler", "file_handler", "log_listener"):
+        setup_logging()
+        return globals()[name]
+    if name in SETTINGS_NAMES:
+        return getattr(get_settings(), SETTINGS_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _load_dotenv():
+    # Load environment variables from .env file if it exists
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
@@ -1,65 +1,69 @@
 import asyncio
 from datetime import datetime
+import time
 
-from copilot import CopilotClient, CopilotSession
+from copilot import CopilotSession
 from copilot.generated.session_events import SessionEventType
 
 import iraklis7_scg.config as config
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.policy import RequestStalled, RequestTimeout, SessionError
+from iraklis7_scg.pool import SessionPool
+from iraklis7_scg.replay import make_client
+from iraklis7_scg.tracing import Tracer, TraceSink
+
+
+class SessionContext(object):
+    # Per-session completion state, so several sessions can share one client
+    def __init__(self, session: CopilotSession):
+        self.session = session
+        self.done = asyncio.Event()
+        self.response = None
+        self.error = None
+        self.unsubscribe = None
+        self.pooled = None
+        # time.monotonic() of the latest event, for stall detection
+        self.last_event = time.monotonic()
 
 
 class CPW(object):
-    def __init__(self):
-        self.__client = CopilotClient()
-        self.__done = asyncio.Event()
-        self.__session: CopilotSession
+    def __init__(self, pool_options=None, events=None, tracer=None, client=None):
+        # client may be any stand-in for CopilotClient, e.g. a ReplayClient
+        self.__client = client if client is not None else make_client()
+        self.__tracer = tracer if tracer is not None else Tracer()
+        self.__pool = SessionPool(self.__client, tracer=self.__tracer, **(pool_options or {}))
+        self.__events = events if events is not None else EventDispatcher()
+        self.__events.add_sink(TraceSink(self.__tracer))
+        self.__updates = {
+            SessionEventType.ASSISTANT_MESSAGE: self.__on_message,
+            SessionEventType.SESSION_ERROR: self.__on_error,
+            SessionEventType.SESSION_IDLE: self.__on_idle,
+        }
+        self.__context: SessionContext = None
         self.__dict = self.__create_dict()
 
-    def __handler(self, event):
-        if event.type == SessionEventType.ASSISTANT_MESSAGE_DELTA:
-            # Incremental text chunk
-            print(event.data.delta_content, end="", flush=True)
-            # config.logger.info(event.data.delta_content)
-        elif event.type == SessionEventType.ASSISTANT_REASONING_DELTA:
-            # Incremental reasoning chunk (model-dependent)
-            print(event.data.delta_content, end="", flush=True)
-            # config.logger.info(event.data.delta_content)
-        else:
-            if event.type == SessionEventType.ASSISTANT_MESSAGE:
-                # Final complete message
-                if event.data.content != "":
-                    config.logger.info(event.data.content)
-            elif event.type == SessionEventType.ASSISTANT_REASONING:
-                # Final reasoning content
-                config.logger.debug("--- Reasoning ---")
-                config.logger.debug(event.data.content)
-            elif event.type == SessionEventType.SESSION_USAGE_INFO:
-                config.logger.debug(f"Current tokens: \
-                                    {event.data.current_tokens}")
-            elif event.type == SessionEventType.TOOL_EXECUTION_START:
-                config.logger.debug(
-                    f"Tool name: {event.data.tool_name} with id={event.data.tool_call_id}"
-                )
-            elif event.type == SessionEventType.TOOL_EXECUTION_COMPLETE:
-                if event.data.result:
-                    config.logger.debug(f"Content: {event.data.result.content}")
-                    config.logger.debug(f"Detailed Content: {event.data.result.detailed_content}")
-                if event.data.error:
-                    config.logger.debug(f"Message: {event.data.error.message}")
-                config.logger.debug(f"Success: {event.data.success}")
-            elif event.type == SessionEventType.ASSISTANT_USAGE:
-                config.logger.debug(f"Cache Read Tokens: {event.data.cache_read_tokens}")
-                config.logger.debug(f"Cache Write Tokens: {event.data.cache_write_tokens}")
-                config.logger.debug(f"Cost: {event.data.cost}")
-                config.logger.debug(f"Duration: {event.data.duration}")
-                config.logger.debug(f"Input Tokens: {event.data.input_tokens}")
-                config.logger.debug(f"Output Tokens: {event.data.output_tokens}")
-            elif event.type == SessionEventType.SESSION_ERROR:
-                config.logger.error(f"Error: {event.data.message}")
-                raise Exception(f"Session Error: {event.data.message}")
-            elif event.type == SessionEventType.SESSION_IDLE:
-                self.__done.set()
-            else:
-                config.logger.debug(f"Unhandled event type: {event.type}")
+    def __handler(self, context, event):
+        # Runs inside the SDK callback: only completion state is updated here,
+        # printing and logging happen on the dispatcher task
+        context.last_event = time.monotonic()
+        update = self.__updates.get(event.type)
+        if update:
+            update(context, event)
+        self.__events.submit(context, event)
+
+    def __on_message(self, context, event):
+        # Final complete message
+        if event.data.content != "":
+            context.response = event.data.content
+
+    def __on_error(self, context, event):
+        # Raising here would be swallowed by the SDK dispatcher, so hand
+        # the error to the waiting sender instead
+        context.error = SessionError(f"Session Error: {event.data.message}")
+        context.done.set()
+
+    def __on_idle(self, context, event):
+        context.done.set()
 
     # Create client
     # XXX async with CopilotClient() as client:
@@ -69,7 +73,8 @@ class CPW(object):
     async def client_start(self):
         try:
             # Start client and ping to check connectivity
-            await self.__client.start()
+            with self.__tracer.span("client start", "client"):
+                await self.__client.start()
             config.logger.info("Client started")
         except Exception as e:
             config.logger.error(f"Error: {e}")
@@ -103,34 +108,138 @@ class CPW(object):
             config.logger.error(f"Error: {e}")
             raise
 
-    async def create_session(self, config):
+    async def create_session(self, session_config) -> SessionContext:
         # Same problem as above
         # async with await client.create_session({"model": model}) as session:
         try:
-            self.__session = await self.__client.create_session(config)
-            self.__session.on(self.__handler)
+            started = time.perf_counter()
+            session = await self.__client.create_session(session_config)
+            model = session_config.get("model")
+            self.__tracer.complete(
+                "session create",
+                "session",
+                started,
+                time.perf_counter(),
+                session,
+                {"model": model},
+            )
+            self.__tracer.lane(session, f"session {model}")
+            context = SessionContext(session)
+            context.unsubscribe = session.on(lambda event: self.__handler(context, event))
+            # The most recent session stays the default for callers that pass no context
+            self.__context = context
+            return context
+        except Exception as e:
+            config.logger.error(f"Error: {e}")
+            raise
+
+    async def session_prewarm(self, session_config, count=1):
+        try:
+            await self.__pool.prewarm(session_config, count)
+        except Exception as e:
+            config.logger.error(f"Error: {e}")
+            raise
+
+    async def session_lease(self, session_config) -> SessionContext:
+        # Like create_session, but served from the warm session pool
+        try:
+            pooled = await self.__pool.acquire(session_config)
+            context = SessionContext(pooled.session)
+            context.pooled = pooled
+            context.unsubscribe = pooled.session.on(lambda event: self.__handler(context, event))
+            return context
         except Exception as e:
             config.logger.error(f"Error: {e}")
             raise
 
-    async def client_send(self, streaming, options, timeout):  # -> Optional[SessionEvent]:
-        # Create a session and send the prompt and specifications
+    async def session_release(self, context, healthy=True):
         try:
-            if streaming:
-                result = await self.__session.send(options)
-                await self.__done.wait()
-            else:
-                response = await self.__session.send_and_wait(options, timeout=timeout)
-                if response:
-                    return response.data.content
+            context.unsubscribe()
+            await self.__pool.release(context.pooled, healthy)
         except Exception as e:
             config.logger.error(f"Error: {e}")
             raise
 
-    async def session_destroy(self):
+    async def client_send(self, streaming, options, timeout, context=None, stall_timeout=None):
+        # Send the prompt and specifications and wait for the reply, for at most
+        # timeout seconds and, with stall_timeout, as long as the session keeps
+        # sending events. Either limit, or cancelling the caller, aborts the
+        # session's work before the error is raised.
+        context = context or self.__context
+        try:
+            with self.__tracer.span("send", "session", context.session, streaming=streaming):
+                deadline = time.monotonic() + timeout if timeout else None
+                context.last_event = time.monotonic()
+                if streaming:
+                    context.done.clear()
+                    context.response = None
+                    context.error = None
+                    await context.session.send(options)
+                    await self.__watch(context, context.done.wait(), deadline, stall_timeout)
+                    if context.error:
+                        raise context.error
+                    return context.response
+                else:
+                    response = await self.__watch(
+                        context,
+                        context.session.send_and_wait(options, timeout=timeout),
+                        deadline,
+                        stall_timeout,
+                    )
+                    if response:
+                        return response.data.content
+        except asyncio.CancelledError:
+            # E.g. the slower of two hedged runs
+            await self.__abort(context)
+            raise
+        except Exception as e:
+            config.logger.error(f"Error: {e}")
+            raise
+
+    async def __watch(self, context, awaitable, deadline, stall_timeout):
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                now = time.monotonic()
+                limits = [deadline - now] if deadline else []
+                if stall_timeout:
+                    limits.append(context.last_event + stall_timeout - now)
+                timeout = max(0.0, min(limits)) if limits else None
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if done:
+                    return task.result()
+                now = time.monotonic()
+                if deadline and now >= deadline:
+                    error = RequestTimeout("No reply before the deadline")
+                    break
+                if stall_timeout and now - context.last_event >= stall_timeout:
+                    error = RequestStalled(f"No session events for {stall_timeout:g}s")
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        await self.__abort(context)
+        raise error
+
+    async def __abort(self, context):
+        # Stops whatever the session is still doing; the caller retires or destroys it
+        try:
+            await context.session.abort()
+        except Exception as e:
+            config.logger.debug(f"Session abort failed: {e}")
+
+    async def session_destroy(self, context=None):
+        context = context or self.__context
         try:
             config.logger.debug("Destroying session...")
-            await self.__session.destroy()
+            if context is None:
+                return
+            try:
+                with self.__tracer.span("session destroy", "session", context.session):
+                    await context.session.destroy()
+            finally:
+                self.__tracer.retire(context.session)
         except Exception as e:
             config.logger.error(f"Error: {e}")
             raise
@@ -138,17 +247,34 @@ class CPW(object):
     async def client_stop(self):
         try:
             config.logger.debug("Stopping client...")
+            await self.__pool.close()
             await self.__client.stop()
+            await self.__events.close()
+            if config.TRACE_FILE:
+                self.export_trace(config.TRACE_FILE)
         except Exception as e:
             config.logger.error(f"Error: {e}")
             raise
 
     def get_session(self):
-        return self.__session
+        return self.__context.session if self.__context else None
 
     def get_client(self):
         return self.__client
 
+    def get_events(self) -> EventDispatcher:
+        return self.__events
+
+    def get_tracer(self) -> Tracer:
+        return self.__tracer
+
+    def export_trace(self, path):
+        # Chrome/Perfetto trace JSON of everything recorded so far
+        self.__tracer.export(path)
+
+    def get_pool_stats(self) -> dict:
+        return self.__pool.get_stats()
+
     def get_params(self, dkey) -> dict:
         return self.__dict[dkey]
 
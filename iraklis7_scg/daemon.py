@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass, field
+import itertools
+import json
+import os
+from pathlib import Path
+import sys
+import time
+import uuid
+
+import iraklis7_scg.config as config
+from iraklis7_scg.jobs import ACTIONS, Job
+
+# Lower numbers run first
+DEFAULT_PRIORITY = 10
+# Longest request or reply line, attachments are sent as paths so this is generous
+LINE_LIMIT = 16 * 1024 * 1024
+# Replies that end a submit conversation
+TERMINAL = ("done", "error")
+
+
+@dataclass(order=True)
+class QueuedJob:
+    priority: int
+    seq: int
+    job: Job = field(compare=False)
+    id: str = field(compare=False, default="")
+    queued: float = field(compare=False, default=0.0)
+    replies: asyncio.Queue = field(compare=False, default=None)
+
+
+class SCGDaemon(object):
+    # Keeps one started SCG client warm and runs report and testbench jobs sent
+    # over a local Unix socket. Requests and replies are JSON lines; a submit
+    # gets "queued", "started", any number of "chunk" and finally "done" or
+    # "error". A watchdog pings the client and replaces it when it stops answering.
+    def __init__(
+        self,
+        socket_path=None,
+        concurrency=2,
+        ping_interval=30.0,
+        ping_timeout=10.0,
+        drain_timeout=300.0,
+        factory=None,
+    ):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.__path = Path(socket_path or config.DAEMON_SOCKET)
+        self.__concurrency = concurrency
+        self.__ping_interval = ping_interval
+        self.__ping_timeout = ping_timeout
+        self.__drain_timeout = drain_timeout
+        self.__factory = factory or self.__default_factory
+        self.__scg = None
+        self.__server = None
+        self.__queue = asyncio.PriorityQueue()
+        self.__seq = itertools.count()
+        self.__running = {}
+        self.__tasks = []
+        # Cleared while the client is being restarted, workers wait on it
+        self.__ready = asyncio.Event()
+        # Set while no job is running, a restart waits on it
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.__stopped = asyncio.Event()
+        self.__started = time.time()
+        self.__stats = {"submitted": 0, "succeeded": 0, "failed": 0, "restarts": 0, "pings": 0}
+
+    async def start(self):
+        await self.__start_client()
+        if self.__path.exists():
+            self.__path.unlink()
+        self.__server = await asyncio.start_unix_server(
+            self.__serve, path=str(self.__path), limit=LINE_LIMIT
+        )
+        # Only the owner may submit jobs
+        os.chmod(self.__path, 0o600)
+        self.__tasks = [asyncio.ensure_future(self.__worker()) for _ in range(self.__concurrency)]
+        self.__tasks.append(asyncio.ensure_future(self.__watchdog()))
+        config.logger.info(f"SCG daemon listening on {self.__path}")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.__stopped.wait()
+        finally:
+            await self.stop()
+
+    def request_stop(self):
+        self.__stopped.set()
+
+    async def stop(self):
+        # Workers first: every job they hold and every queued job gets an error
+        # reply, which ends its submit connection, so the server can then close
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks = []
+        while not self.__queue.empty():
+            _stopped(self.__queue.get_nowait())
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        if self.__scg is not None:
+            await self.__stop_client()
+        self.__path.unlink(missing_ok=True)
+        config.logger.info("SCG daemon stopped")
+
+    def submit(self, job, priority=DEFAULT_PRIORITY) -> QueuedJob:
+        if job.action not in ACTIONS:
+            raise ValueError(f"Unknown action {job.action}, expected one of {ACTIONS}")
+        item = QueuedJob(
+            priority, next(self.__seq), job, uuid.uuid4().hex[:12], time.time(), asyncio.Queue()
+        )
+        self.__queue.put_nowait(item)
+        self.__stats["submitted"] += 1
+        return item
+
+    def get_scg(self):
+        return self.__scg
+
+    def get_stats(self) -> dict:
+        stats = dict(self.__stats)
+        stats.update(
+            queued=self.__queue.qsize(),
+            running=[item.job.name or item.id for item in self.__running.values()],
+            ready=self.__ready.is_set(),
+            uptime=time.time() - self.__started,
+        )
+        if self.__scg is not None and hasattr(self.__scg, "metrics_summary"):
+            stats["metrics"] = self.__scg.metrics_summary()
+        return stats
+
+    async def __serve(self, reader, writer):
+        try:
+            while not reader.at_eof():
+                line = await reader.readline()
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    await self.__handle(request, writer)
+                except (ValueError, KeyError, TypeError) as e:
+                    await _send(writer, {"event": "error", "message": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The caller went away, its job keeps running and its result is cached
+            pass
+        finally:
+            writer.close()
+
+    async def __handle(self, request, writer):
+        op = request.get("op")
+        if op == "ping":
+            await _send(writer, {"event": "pong"})
+        elif op == "status":
+            await _send(writer, {"event": "status", "stats": self.get_stats()})
+        elif op == "shutdown":
+            await _send(writer, {"event": "stopping"})
+            self.request_stop()
+        elif op == "submit":
+            item = self.submit(Job(**request["job"]), request.get("priority", DEFAULT_PRIORITY))
+            await _send(
+                writer, {"event": "queued", "id": item.id, "position": self.__queue.qsize()}
+            )
+            while True:
+                reply = await item.replies.get()
+                await _send(writer, reply)
+                if reply["event"] in TERMINAL:
+                    break
+        else:
+            raise ValueError(f"Unknown op {op}")
+
+    async def __worker(self):
+        while True:
+            item = await self.__queue.get()
+            try:
+                await self.__ready.wait()
+            except asyncio.CancelledError:
+                _stopped(item)
+                raise
+            self.__running[item.id] = item
+            self.__idle.clear()
+            job = item.job
+            started = time.time()
+            item.replies.put_nowait(
+                {"event": "started", "id": item.id, "wait": started - item.queued}
+            )
+            try:
+                response = None
+                if job.streaming:
+                    async for chunk in self.__scg.stream_action(
+                        job.action, model=job.model, attachments=job.attachments, **job.options
+                    ):
+                        item.replies.put_nowait({"event": "chunk", "id": item.id, "text": chunk})
+                else:
+                    method = getattr(self.__scg, job.action)
+                    response = await method(
+                        model=job.model,
+                        streaming=False,
+                        attachments=job.attachments,
+                        **job.options,
+                    )
+                self.__stats["succeeded"] += 1
+                reply = {"event": "done", "id": item.id, "response": response}
+            except Exception as e:
+                self.__stats["failed"] += 1
+                config.logger.error(f"Job {job.name or item.id} failed: {e}")
+                reply = {"event": "error", "id": item.id, "message": str(e)}
+            except asyncio.CancelledError:
+                _stopped(item)
+                raise
+            finally:
+                del self.__running[item.id]
+                if not self.__running:
+                    self.__idle.set()
+            reply["duration"] = time.time() - started
+            item.replies.put_nowait(reply)
+
+    async def __watchdog(self):
+        while True:
+            await asyncio.sleep(self.__ping_interval)
+            try:
+                self.__stats["pings"] += 1
+                await asyncio.wait_for(self.__scg.client_ping(), self.__ping_timeout)
+                state = await self.__scg.client_check_connection()
+                if state != "connected":
+                    raise ConnectionError(f"client state is {state}")
+            except Exception as e:
+                config.logger.warning(f"Client health check failed, restarting: {e}")
+                await self.__restart()
+
+    async def __restart(self):
+        # No new jobs start, running ones get drain_timeout seconds to finish
+        # before their client is stopped under them
+        self.__ready.clear()
+        try:
+            await asyncio.wait_for(self.__idle.wait(), self.__drain_timeout)
+        except asyncio.TimeoutError:
+            config.logger.warning(
+                f"Restarting with {len(self.__running)} job(s) still running after "
+                f"{self.__drain_timeout}s"
+            )
+        await self.__stop_client()
+        try:
+            await self.__start_client()
+            self.__stats["restarts"] += 1
+        except Exception as e:
+            # The next health check tries again, queued jobs wait until then
+            config.logger.error(f"Client restart failed: {e}")
+
+    async def __start_client(self):
+        scg = self.__factory()
+        await scg.client_start()
+        self.__scg = scg
+        self.__ready.set()
+
+    async def __stop_client(self):
+        try:
+            await self.__scg.client_stop()
+        except Exception as e:
+            config.logger.debug(f"Error stopping client: {e}")
+
+    @staticmethod
+    def __default_factory():
+        from iraklis7_scg.scg import SCG
+
+        return SCG()
+
+
+async def submit(job, priority=DEFAULT_PRIORITY, socket_path=None):
+    # Sends one job to the daemon and yields its replies up to "done" or "error"
+    reader, writer = await asyncio.open_unix_connection(
+        str(socket_path or config.DAEMON_SOCKET), limit=LINE_LIMIT
+    )
+    try:
+        await _send(writer, {"op": "submit", "job": asdict(job), "priority": priority})
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Daemon closed the connection")
+            reply = json.loads(line)
+            yield reply
+            if reply["event"] in TERMINAL:
+                return
+    finally:
+        writer.close()
+
+
+async def request(op, socket_path=None) -> dict:
+    # "ping", "status" or "shutdown"
+    reader, writer = await asyncio.open_unix_connection(
+        str(socket_path or config.DAEMON_SOCKET), limit=LINE_LIMIT
+    )
+    try:
+        await _send(writer, {"op": op})
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+
+def _stopped(item):
+    item.replies.put_nowait({"event": "error", "id": item.id, "message": "Daemon stopped"})
+
+
+async def _send(writer, message):
+    writer.write(json.dumps(message, default=str).encode() + b"\n")
+    await writer.drain()
+
+
+async def _main(args) -> int:
+    if args.command == "serve":
+        daemon = SCGDaemon(args.socket, args.concurrency, args.ping_interval)
+        await daemon.serve_forever()
+        return 0
+    if args.command in ("status", "stop"):
+        reply = await request("status" if args.command == "status" else "shutdown", args.socket)
+        print(json.dumps(reply, indent=2))
+        return 0
+    job = Job(
+        args.action,
+        args.model,
+        [{"type": "file", "path": str(Path(path).resolve())} for path in args.attachments],
+        args.streaming,
+        args.name,
+    )
+    async for reply in submit(job, args.priority, args.socket):
+        if reply["event"] == "chunk":
+            sys.stdout.write(reply["text"])
+            sys.stdout.flush()
+        elif reply["event"] == "error":
+            config.logger.error(f"Job {reply.get('id')} failed: {reply['message']}")
+            return 1
+        elif reply["event"] == "done":
+            if reply.get("response"):
+                print(reply["response"])
+            config.logger.info(f"Job {reply['id']} done in {reply['duration']:.1f}s")
+        else:
+            config.logger.info(f"Job {reply['id']} {reply['event']}")
+    return 0
+
+
+def main(argv=None, prog=None) -> int:
+    parser = argparse.ArgumentParser(prog=prog, description="SCG worker daemon")
+    parser.add_argument("--socket", default=None, help="Unix socket (SCG_DAEMON_SOCKET)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the daemon")
+    serve.add_argument("--concurrency", type=int, default=2)
+    serve.add_argument("--ping-interval", type=float, default=30.0)
+    commands.add_parser("status", help="show queue and client state")
+    commands.add_parser("stop", help="stop the daemon")
+    job = commands.add_parser("submit", help="run a job on the daemon")
+    job.add_argument("action", choices=ACTIONS)
+    job.add_argument("model")
+    job.add_argument("attachments", nargs="+")
+    job.add_argument("--streaming", action="store_true")
+    job.add_argument("--priority", type=int, default=DEFAULT_PRIORITY)
+    job.add_argument("--name", default="")
+    return asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+from collections.abc import Sequence
+import json
+import mmap
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+
+from iraklis7_scg.cache import hash_file
+import iraklis7_scg.config as config
+from iraklis7_scg.spec import (
+    Section,
+    SpecDocument,
+    extract_pages,
+    join_pages,
+    split_sections,
+)
+
+# Bump whenever extraction or the on-disk layout changes, so documents are re-parsed
+STORE_FORMAT = 1
+
+
+def byte_offsets(text, offsets) -> list:
+    # Character offsets into text -> byte offsets into its UTF-8 encoding
+    result = []
+    done = 0
+    nbytes = 0
+    for offset in sorted(set(offsets)):
+        nbytes += len(text[done:offset].encode())
+        done = offset
+        result.append((offset, nbytes))
+    lookup = dict(result)
+    return [lookup[offset] for offset in offsets]
+
+
+class MappedPages(Sequence):
+    # Page texts of a StoredDocument, decoded from the mapping on access
+    def __init__(self, doc):
+        self.__doc = doc
+
+    def __len__(self) -> int:
+        return self.__doc.page_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        return self.__doc.page_text(index + 1)
+
+
+class MappedSection(Section):
+    # A section of a StoredDocument whose text is decoded from the mapping
+    # each time it is read, unless a text was assigned
+    def __init__(self, doc, section):
+        super().__init__(
+            section.number,
+            section.title,
+            section.first_page,
+            section.last_page,
+            start=section.start,
+            end=section.end,
+        )
+        self.__doc = doc
+
+    @property
+    def text(self) -> str:
+        if self.__text is None:
+            return self.__doc.section_text(self)
+        return self.__text
+
+    @text.setter
+    def text(self, value):
+        # Section.__init__ assigns the empty default
+        self.__text = value or None
+
+
+class StoredDocument(object):
+    # A parsed PDF: index.json holds page and section byte offsets into
+    # text.bin, which is memory-mapped so slices never load the whole text.
+    # Owned by its DocumentStore, valid until the store is closed.
+    def __init__(self, key, directory, index):
+        self.key = key
+        self.source = index["source"]
+        self.page_spans = [tuple(span) for span in index["pages"]]
+        self.sections = [Section(**s) for s in index["sections"]]
+        self.__file = open(Path(directory) / "text.bin", "rb")
+        size = os.fstat(self.__file.fileno()).st_size
+        # Zero-length files cannot be mapped
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_spans)
+
+    def view(self, start, end) -> memoryview:
+        # Zero-copy; release the view before close()
+        return memoryview(self.__map)[start:end]
+
+    def page_text(self, first, last=None) -> str:
+        # Pages are numbered from 1, as in the section index
+        self.__check_open()
+        last = first if last is None else last
+        if not 1 <= first <= last <= self.page_count:
+            raise ValueError(f"Page range {first}-{last} outside 1-{self.page_count}")
+        start = self.page_spans[first - 1][0]
+        end = self.page_spans[last - 1][1]
+        return self.__map[start:end].decode()
+
+    def section_text(self, section) -> str:
+        self.__check_open()
+        return self.__map[section.start : section.end].decode().strip()
+
+    def find_section(self, heading):
+        # Match on section number ("4.6") or title, case-insensitively
+        wanted = " ".join(heading.lower().split())
+        for section in self.sections:
+            if wanted in (section.number, section.key):
+                return section
+        return None
+
+    def to_document(self) -> SpecDocument:
+        # Pages and section texts are read from the mapping when used, so the
+        # document never holds the whole text
+        sections = [MappedSection(self, section) for section in self.sections]
+        return SpecDocument(self.source, MappedPages(self), sections)
+
+    def close(self):
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
+        self.__file.close()
+
+    def __check_open(self):
+        if self.__file.closed:
+            raise ValueError(f"Document {self.key} is closed")
+
+
+class DocumentStore(object):
+    # Parsed PDFs keyed by contents. Documents stay mapped until close(), which
+    # may be called at any time: later get() calls map them again.
+    def __init__(self, store_dir=None):
+        self.__dir = Path(store_dir) if store_dir else config.DOCSTORE_DIR
+        # (path, mtime_ns, size) -> sha256, so unchanged PDFs are hashed once
+        self.__hashes = {}
+        self.__open = {}
+        # Documents are loaded from worker threads, see SCG.__prepass
+        self.__lock = threading.Lock()
+
+    def get_dir(self) -> Path:
+        return self.__dir
+
+    def get(self, path) -> StoredDocument:
+        key = self.__hash_path(Path(path))
+        with self.__lock:
+            doc = self.__open.get(key)
+            if doc is None:
+                doc = self.__load(key) or self.__extract(key, Path(path))
+                self.__open[key] = doc
+            return doc
+
+    def load_document(self, path) -> SpecDocument:
+        return self.get(path).to_document()
+
+    def list_entries(self) -> list:
+        entries = []
+        for index_path in self.__dir.glob("*/*/index.json"):
+            try:
+                index = json.loads(index_path.read_text())
+            except (OSError, ValueError):
+                continue
+            entries.append(
+                {
+                    "key": index_path.parent.name,
+                    "source": index["source"],
+                    "pages": len(index["pages"]),
+                    "sections": len(index["sections"]),
+                    "size": (index_path.parent / "text.bin").stat().st_size,
+                }
+            )
+        return entries
+
+    def close(self):
+        with self.__lock:
+            for doc in self.__open.values():
+                doc.close()
+            self.__open.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def clear(self):
+        self.close()
+        shutil.rmtree(self.__dir, ignore_errors=True)
+
+    def __entry_dir(self, key) -> Path:
+        return self.__dir / key[:2] / key
+
+    def __load(self, key):
+        entry_dir = self.__entry_dir(key)
+        try:
+            index = json.loads((entry_dir / "index.json").read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Dropping unreadable document {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        if index.get("format") != STORE_FORMAT:
+            config.logger.debug(f"Document {key} has an old format, re-extracting")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        config.logger.debug(f"Document store hit: {index['source']} ({key})")
+        return StoredDocument(key, entry_dir, index)
+
+    def __extract(self, key, path) -> StoredDocument:
+        pages = extract_pages(path)
+        sections = split_sections(pages)
+        text = join_pages(pages)
+        page_starts = []
+        pos = 0
+        for page in pages:
+            page_starts.append(pos)
+            pos += len(page) + 1
+        offsets = byte_offsets(
+            text,
+            page_starts
+            + [start + len(page) for start, page in zip(page_starts, pages)]
+            + [s.start for s in sections]
+            + [s.end for s in sections],
+        )
+        n, m = len(pages), len(sections)
+        index = {
+            "format": STORE_FORMAT,
+            "source": str(path),
+            "pages": list(zip(offsets[:n], offsets[n : 2 * n])),
+            "sections": [
+                {
+                    "number": s.number,
+                    "title": s.title,
+                    "first_page": s.first_page,
+                    "last_page": s.last_page,
+                    "start": start,
+                    "end": end,
+                }
+                for s, start, end in zip(
+                    sections, offsets[2 * n : 2 * n + m], offsets[2 * n + m :]
+                )
+            ],
+        }
+        entry_dir = self.__entry_dir(key)
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        # Build the entry next to its final place and rename it in, so readers
+        # never see a half-written document
+        staging = Path(tempfile.mkdtemp(dir=entry_dir.parent))
+        (staging / "text.bin").write_bytes(text.encode())
+        (staging / "index.json").write_text(json.dumps(index))
+        try:
+            os.replace(staging, entry_dir)
+        except OSError:
+            # Another process stored the same document first
+            shutil.rmtree(staging, ignore_errors=True)
+        config.logger.info(
+            f"Stored {path}: {len(pages)} page(s), {len(sections)} section(s) under {key}"
+        )
+        return StoredDocument(key, entry_dir, index)
+
+    def __hash_path(self, path) -> str:
+        stat = os.stat(path)
+        memo = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+        if memo not in self.__hashes:
+            self.__hashes[memo] = hash_file(path)
+        return self.__hashes[memo]
@@ -0,0 +1,275 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+import sys
+import time
+
+from copilot.generated.session_events import SessionEventType
+
+import iraklis7_scg.config as config
+
+# Per event type verbosity of what is shown on stdout and logged: QUIET shows
+# nothing, SUMMARY sizes and ids only, FULL the whole payload. It only applies
+# to presentation sinks, every other sink (streamed files, metrics, traces)
+# gets every event it wants.
+QUIET, SUMMARY, FULL = 0, 1, 2
+LEVELS = {"quiet": QUIET, "summary": SUMMARY, "full": FULL}
+
+DEFAULT_VERBOSITY = {
+    SessionEventType.ASSISTANT_MESSAGE_DELTA.value: FULL,
+    SessionEventType.ASSISTANT_REASONING_DELTA.value: FULL,
+    SessionEventType.ASSISTANT_MESSAGE.value: FULL,
+    SessionEventType.ASSISTANT_REASONING.value: SUMMARY,
+    SessionEventType.SESSION_USAGE_INFO.value: FULL,
+    SessionEventType.TOOL_EXECUTION_START.value: FULL,
+    SessionEventType.TOOL_EXECUTION_COMPLETE.value: SUMMARY,
+    SessionEventType.ASSISTANT_USAGE.value: FULL,
+    SessionEventType.SESSION_ERROR.value: FULL,
+}
+
+
+def parse_verbosity(spec) -> dict:
+    # "tool.execution_complete=full,assistant.reasoning=quiet" -> {type: level}
+    result = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event_type, _, level = item.partition("=")
+        if level.strip().lower() not in LEVELS:
+            raise ValueError(f"Unknown verbosity '{level}' for {event_type}, expected {LEVELS}")
+        result[event_type.strip()] = LEVELS[level.strip().lower()]
+    return result
+
+
+@dataclass
+class EventRecord:
+    context: object
+    event: object
+    type: str
+    level: int
+    # perf_counter() when the SDK delivered the event, before any queueing
+    received: float
+
+
+class EventSink(object):
+    # Sinks run on the dispatcher task, never inside the SDK callback, so they
+    # may await; flush() is called once per batch of queued events.
+    # Presentation sinks are skipped for event types set to QUIET.
+    presentation = False
+
+    def wants(self, event_type) -> bool:
+        return True
+
+    async def handle(self, record):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+
+class StdoutSink(EventSink):
+    presentation = True
+    TYPES = (
+        SessionEventType.ASSISTANT_MESSAGE_DELTA.value,
+        SessionEventType.ASSISTANT_REASONING_DELTA.value,
+    )
+
+    def __init__(self, stream=None):
+        self.__stream = stream
+        self.__chunks = []
+
+    def wants(self, event_type) -> bool:
+        return event_type in self.TYPES
+
+    async def handle(self, record):
+        self.__chunks.append(record.event.data.delta_content or "")
+
+    async def flush(self):
+        # One write for the whole batch instead of one flushed print per token
+        if self.__chunks:
+            stream = self.__stream or sys.stdout
+            stream.write("".join(self.__chunks))
+            stream.flush()
+            self.__chunks.clear()
+
+
+class LogSink(EventSink):
+    presentation = True
+
+    def __init__(self, logger=None):
+        self.__logger = logger or config.logger
+        self.__formatters = {
+            SessionEventType.ASSISTANT_MESSAGE.value: self.__message,
+            SessionEventType.ASSISTANT_REASONING.value: self.__reasoning,
+            SessionEventType.SESSION_USAGE_INFO.value: self.__usage_info,
+            SessionEventType.TOOL_EXECUTION_START.value: self.__tool_start,
+            SessionEventType.TOOL_EXECUTION_COMPLETE.value: self.__tool_complete,
+            SessionEventType.ASSISTANT_USAGE.value: self.__usage,
+            SessionEventType.SESSION_ERROR.value: self.__error,
+        }
+
+    def wants(self, event_type) -> bool:
+        return (
+            event_type not in StdoutSink.TYPES
+            and event_type != SessionEventType.SESSION_IDLE.value
+        )
+
+    async def handle(self, record):
+        formatter = self.__formatters.get(record.type)
+        if formatter is None:
+            self.__logger.debug(f"Unhandled event type: {record.type}")
+            return
+        for level, message in formatter(record.event.data, record.level):
+            if self.__logger.isEnabledFor(level):
+                self.__logger.log(level, message())
+
+    # Formatters yield (level, thunk) so messages are only built when logged
+
+    def __message(self, data, verbosity):
+        if data.content != "":
+            if verbosity == FULL:
+                yield logging.INFO, lambda: data.content
+            else:
+                yield logging.INFO, lambda: f"Assistant message ({len(data.content)} chars)"
+
+    def __reasoning(self, data, verbosity):
+        if verbosity == FULL:
+            yield logging.DEBUG, lambda: "--- Reasoning ---"
+            yield logging.DEBUG, lambda: data.content
+        else:
+            yield logging.DEBUG, lambda: f"Reasoning ({len(data.content or '')} chars)"
+
+    def __usage_info(self, data, verbosity):
+        yield logging.DEBUG, lambda: f"Current tokens: {data.current_tokens}"
+
+    def __tool_start(self, data, verbosity):
+        yield logging.DEBUG, lambda: f"Tool name: {data.tool_name} with id={data.tool_call_id}"
+
+    def __tool_complete(self, data, verbosity):
+        if data.result:
+            if verbosity == FULL:
+                yield logging.DEBUG, lambda: f"Content: {data.result.content}"
+                yield logging.DEBUG, lambda: f"Detailed Content: {data.result.detailed_content}"
+            else:
+                yield logging.DEBUG, lambda: (
+                    f"Tool {data.tool_call_id} result: {len(data.result.content or '')} chars, "
+                    f"{len(data.result.detailed_content or '')} detailed"
+                )
+        if data.error:
+            yield logging.DEBUG, lambda: f"Message: {data.error.message}"
+        yield logging.DEBUG, lambda: f"Success: {data.success}"
+
+    def __usage(self, data, verbosity):
+        yield logging.DEBUG, lambda: f"Cache Read Tokens: {data.cache_read_tokens}"
+        yield logging.DEBUG, lambda: f"Cache Write Tokens: {data.cache_write_tokens}"
+        yield logging.DEBUG, lambda: f"Cost: {data.cost}"
+        yield logging.DEBUG, lambda: f"Duration: {data.duration}"
+        yield logging.DEBUG, lambda: f"Input Tokens: {data.input_tokens}"
+        yield logging.DEBUG, lambda: f"Output Tokens: {data.output_tokens}"
+
+    def __error(self, data, verbosity):
+        yield logging.ERROR, lambda: f"Error: {data.message}"
+
+
+class EventDispatcher(object):
+    # Fed synchronously from the SDK callback; the callback only enqueues and
+    # a single task drains the queue in batches and runs the sinks
+    def __init__(self, sinks=None, verbosity=None):
+        self.__sinks = list(sinks) if sinks is not None else [StdoutSink(), LogSink()]
+        self.__verbosity = dict(DEFAULT_VERBOSITY)
+        self.__verbosity.update(parse_verbosity(config.EVENT_VERBOSITY))
+        self.__verbosity.update(verbosity or {})
+        self.__queue = None
+        self.__task = None
+        self.__loop = None
+        self.__stats = {"queued": 0, "handled": 0, "batches": 0, "max_batch": 0, "errors": 0}
+
+    def add_sink(self, sink):
+        self.__sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.__sinks.remove(sink)
+
+    def get_sinks(self) -> list:
+        return list(self.__sinks)
+
+    def set_verbosity(self, event_type, level):
+        self.__verbosity[event_type] = LEVELS[level] if isinstance(level, str) else level
+
+    def get_verbosity(self, event_type) -> int:
+        return self.__verbosity.get(event_type, SUMMARY)
+
+    def submit(self, context, event):
+        received = time.perf_counter()
+        event_type = event.type.value
+        level = self.get_verbosity(event_type)
+        if not any(self.__receives(sink, event_type, level) for sink in self.__sinks):
+            return
+        record = EventRecord(context, event, event_type, level, received)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self.__loop is not None and self.__loop.is_closed():
+            # The loop that ran the dispatcher is gone, e.g. after asyncio.run()
+            self.__task = None
+        if self.__task is None:
+            if loop is None:
+                return
+            self.__loop = loop
+            self.__queue = asyncio.Queue()
+            self.__task = loop.create_task(self.__run())
+        self.__stats["queued"] += 1
+        if loop is self.__loop:
+            self.__queue.put_nowait(record)
+        else:
+            # Delivered from another thread, hand it over to the loop
+            self.__loop.call_soon_threadsafe(self.__queue.put_nowait, record)
+
+    async def drain(self):
+        # Wait until every event submitted so far has reached the sinks
+        if self.__queue is not None:
+            await self.__queue.join()
+
+    async def close(self):
+        await self.drain()
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+            self.__queue = None
+        for sink in self.__sinks:
+            await sink.close()
+
+    def get_stats(self) -> dict:
+        return dict(self.__stats)
+
+    async def __run(self):
+        while True:
+            batch = [await self.__queue.get()]
+            while not self.__queue.empty():
+                batch.append(self.__queue.get_nowait())
+            self.__stats["batches"] += 1
+            self.__stats["max_batch"] = max(self.__stats["max_batch"], len(batch))
+            for record in batch:
+                for sink in self.__sinks:
+                    if self.__receives(sink, record.type, record.level):
+                        await self.__call(sink.handle, record)
+            for sink in self.__sinks:
+                await self.__call(sink.flush)
+            self.__stats["handled"] += len(batch)
+            for _ in batch:
+                self.__queue.task_done()
+
+    @staticmethod
+    def __receives(sink, event_type, level) -> bool:
+        return sink.wants(event_type) and not (level == QUIET and sink.presentation)
+
+    async def __call(self, method, *args):
+        # A broken sink must not stop the others or the dispatcher
+        try:
+            await method(*args)
+        except Exception as e:
+            self.__stats["errors"] += 1
+            config.logger.warning(f"Event sink {type(method.__self__).__name__} failed: {e}")
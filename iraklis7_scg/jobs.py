@@ -0,0 +1,112 @@
+import asyncio
+from dataclasses import dataclass, field
+import time
+
+import iraklis7_scg.config as config
+
+# SCG coroutine methods a job may run
+ACTIONS = ("create_report", "build_uvm_tb")
+
+
+@dataclass
+class Job:
+    action: str
+    model: str
+    attachments: list
+    streaming: bool = False
+    name: str = ""
+    options: dict = field(default_factory=dict)
+
+
+@dataclass
+class JobResult:
+    job: Job
+    response: str = None
+    error: Exception = None
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+class JobScheduler(object):
+    def __init__(self, scg, concurrency=4):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.__scg = scg
+        self.__concurrency = concurrency
+        self.__results = []
+        self.__wall_time = 0.0
+        self.__peak = 0
+        self.__running = 0
+
+    async def run(self, jobs) -> list:
+        # Runs every job on the already started client, at most `concurrency` at once
+        for job in jobs:
+            if job.action not in ACTIONS:
+                raise ValueError(f"Unknown action {job.action}, expected one of {ACTIONS}")
+        semaphore = asyncio.Semaphore(self.__concurrency)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.__run_job(semaphore, job) for job in jobs))
+        self.__wall_time += time.perf_counter() - started
+        self.__results.extend(results)
+        stats = self.get_stats()
+        config.logger.info(
+            f"Jobs: {stats['succeeded']}/{stats['jobs']} succeeded in "
+            f"{stats['wall_time']:.1f}s ({stats['jobs_per_min']:.2f} jobs/min, "
+            f"peak concurrency {stats['peak_concurrency']})"
+        )
+        return results
+
+    async def __run_job(self, semaphore, job) -> JobResult:
+        async with semaphore:
+            self.__running += 1
+            self.__peak = max(self.__peak, self.__running)
+            result = JobResult(job=job, started=time.perf_counter())
+            label = job.name or f"{job.action}/{job.model}"
+            config.logger.info(f"Job {label} started")
+            try:
+                method = getattr(self.__scg, job.action)
+                result.response = await method(
+                    model=job.model,
+                    streaming=job.streaming,
+                    attachments=job.attachments,
+                    **job.options,
+                )
+            except Exception as e:
+                # One failed job must not cancel its siblings
+                result.error = e
+                config.logger.error(f"Job {label} failed: {e}")
+            finally:
+                result.finished = time.perf_counter()
+                self.__running -= 1
+            config.logger.info(f"Job {label} finished in {result.duration:.1f}s")
+            return result
+
+    def get_results(self) -> list:
+        return list(self.__results)
+
+    def get_stats(self) -> dict:
+        durations = [r.duration for r in self.__results]
+        succeeded = sum(1 for r in self.__results if r.ok)
+        wall = self.__wall_time
+        return {
+            "jobs": len(self.__results),
+            "succeeded": succeeded,
+            "failed": len(self.__results) - succeeded,
+            "concurrency": self.__concurrency,
+            "peak_concurrency": self.__peak,
+            "wall_time": wall,
+            "busy_time": sum(durations),
+            "mean_job_time": sum(durations) / len(durations) if durations else 0.0,
+            "max_job_time": max(durations, default=0.0),
+            "jobs_per_min": 60.0 * len(durations) / wall if wall else 0.0,
+            # Busy time over wall time, i.e. the effective parallelism achieved
+            "speedup": sum(durations) / wall if wall else 0.0,
+        }
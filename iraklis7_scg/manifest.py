@@ -0,0 +1,237 @@
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import time
+
+from iraklis7_scg.cache import hash_file
+import iraklis7_scg.config as config
+from iraklis7_scg.spec import Section, align_sections, normalise_rows
+
+# Kept next to the generated testbench, see SCG.build_uvm_tb(incremental=True)
+MANIFEST_NAME = ".scg_manifest.json"
+# Bump whenever the layout changes, older manifests then trigger a full build
+MANIFEST_FORMAT = 2
+# Header every generated file is asked to start with, e.g. "// Spec sections: 4.2, 4.6"
+SECTIONS_HEADER_RE = re.compile(r"^\s*(?://|#)\s*Spec sections:\s*(.*)$", re.M | re.I)
+# Otherwise the references the checks' error messages carry, e.g. "see section 4.2"
+SECTION_REF_RE = re.compile(r"(?:\b[Ss]ection|\b[Ss]ec\.|§)\s*([1-9]\d?(?:\.\d{1,2}){0,3})\b")
+# Files without usable references depend on every section
+ALL_SECTIONS = "*"
+
+
+@dataclass
+class ManifestEntry:
+    hash: str
+    # Section keys, see section_hashes(), or [ALL_SECTIONS]
+    sections: list
+
+
+@dataclass
+class Manifest:
+    spec: str
+    spec_hash: str
+    model: str
+    # Section key -> {"number", "title", "heading", "hash"} of the spec the files were built from
+    sections: dict
+    files: dict = field(default_factory=dict)
+    created: float = 0.0
+    format: int = MANIFEST_FORMAT
+
+    @classmethod
+    def load(cls, directory):
+        path = Path(directory) / MANIFEST_NAME
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Ignoring unreadable manifest {path}: {e}")
+            return None
+        if data.get("format") != MANIFEST_FORMAT:
+            config.logger.info(f"Ignoring manifest {path} of format {data.get('format')}")
+            return None
+        data["files"] = {rel: ManifestEntry(**e) for rel, e in data["files"].items()}
+        return cls(**data)
+
+    def refresh(self, directory, files):
+        # Records the current contents of files already in the manifest, e.g.
+        # ones an update rewrote, without advancing the spec they were built from
+        directory = Path(directory)
+        for rel in files:
+            entry = self.files.get(rel)
+            if entry is not None and (directory / rel).is_file():
+                entry.hash = hash_file(directory / rel)
+
+    def save(self, directory):
+        # Replaced atomically, an interrupted write must not leave half a manifest
+        path = Path(directory) / MANIFEST_NAME
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2))
+        os.replace(tmp, path)
+
+
+@dataclass
+class UpdatePlan:
+    # Sections that differ from the manifest's spec, as keys of the latest
+    # spec except for removed ones
+    changed: list
+    added: list
+    removed: list
+    # Files to regenerate, because a section they depend on changed or they are gone
+    affected: list
+    missing: list
+    # Files changed by hand since they were generated
+    edited: list
+    kept: list
+
+    @property
+    def up_to_date(self) -> bool:
+        return not (self.changed or self.added or self.removed or self.affected)
+
+
+def section_hashes(doc) -> dict:
+    # Keyed by title, as spec.align_sections pairs sections; repeated titles
+    # get a counter. Hashes ignore layout the same way spec.diff_documents
+    # does: spacing, and the order of whole rows. The text of every row is
+    # hashed in order, so reordered or changed values within a row (bit
+    # positions, reset values, encodings) change the hash.
+    result = {}
+    for section in doc.sections:
+        key = section.key
+        n = 2
+        while key in result:
+            key = f"{section.key}#{n}"
+            n += 1
+        rows = normalise_rows(doc.section_text(section))
+        text = "\n".join(sorted(rows.elements()))
+        result[key] = {
+            "number": section.number,
+            "title": section.title,
+            "heading": section.heading,
+            "hash": hashlib.sha256(text.encode()).hexdigest(),
+        }
+    return result
+
+
+def file_sections(text, sections) -> list:
+    # Sections a generated file was derived from, as keys of section_hashes().
+    # A reference to "4" covers 4.1, 4.2, ... as well.
+    header = SECTIONS_HEADER_RE.search(text)
+    if header:
+        if header.group(1).strip().lower() in (ALL_SECTIONS, "all"):
+            return [ALL_SECTIONS]
+        numbers = re.findall(r"[1-9]\d?(?:\.\d{1,2}){0,3}", header.group(1))
+    else:
+        numbers = SECTION_REF_RE.findall(text)
+    found = set()
+    for number in set(numbers):
+        for key, section in sections.items():
+            heading = section["heading"]
+            if heading.startswith(f"{number} ") or heading.startswith(f"{number}."):
+                found.add(key)
+    return sorted(found) or [ALL_SECTIONS]
+
+
+def is_tracked(rel) -> bool:
+    # The manifest itself and files being written are not testbench files
+    name = Path(rel).name
+    return name != MANIFEST_NAME and not name.endswith(".tmp")
+
+
+def build_manifest(directory, doc, spec, model, files) -> Manifest:
+    directory = Path(directory)
+    sections = section_hashes(doc)
+    entries = {}
+    for rel in sorted(files):
+        path = directory / rel
+        if not is_tracked(rel) or not path.is_file():
+            continue
+        text = path.read_text(errors="replace")
+        entries[rel] = ManifestEntry(hash_file(path), file_sections(text, sections))
+    return Manifest(
+        spec=str(spec),
+        spec_hash=doc.key,
+        model=model,
+        sections=sections,
+        files=entries,
+        created=time.time(),
+    )
+
+
+def plan_update(manifest, directory, doc) -> UpdatePlan:
+    # Compares the spec with the one the testbench was built from and
+    # re-validates every file against its recorded hash
+    directory = Path(directory)
+    new = section_hashes(doc)
+    new_keys = {id(section): key for section, key in zip(doc.sections, new)}
+    old_sections = [Section(s["number"], s["title"], 0, 0) for s in manifest.sections.values()]
+    old_keys = {id(section): key for section, key in zip(old_sections, manifest.sections)}
+    # Renamed and renumbered sections are paired up as in the report prepass
+    changed, added, removed, touched = [], [], [], set()
+    for old, section in align_sections(old_sections, doc.sections):
+        if old is None:
+            added.append(new_keys[id(section)])
+        elif section is None:
+            removed.append(old_keys[id(old)])
+            touched.add(old_keys[id(old)])
+        elif manifest.sections[old_keys[id(old)]]["hash"] != new[new_keys[id(section)]]["hash"]:
+            changed.append(new_keys[id(section)])
+            touched.add(old_keys[id(old)])
+
+    affected, missing, edited, kept = [], [], [], []
+    for rel, entry in sorted(manifest.files.items()):
+        path = directory / rel
+        if not path.is_file():
+            missing.append(rel)
+            affected.append(rel)
+            continue
+        if hash_file(path) != entry.hash:
+            edited.append(rel)
+        if ALL_SECTIONS in entry.sections:
+            depends = bool(touched or added)
+        else:
+            depends = bool(touched.intersection(entry.sections))
+        (affected if depends else kept).append(rel)
+    return UpdatePlan(changed, added, removed, affected, missing, edited, kept)
+
+
+def render_update(doc, manifest, plan, directory) -> str:
+    # Input of the scg_update_uvm_tb session: what changed in the spec, the
+    # current text of the files to rewrite and the names of those to keep
+    directory = Path(directory)
+    sections = {key: s for key, s in zip(section_hashes(doc), doc.sections)}
+    out = [f"Specification: {Path(manifest.spec).name}, testbench built by {manifest.model}", ""]
+    for title, keys in (("Changed sections", plan.changed), ("Added sections", plan.added)):
+        if not keys:
+            continue
+        out.append(f"## {title}")
+        for key in keys:
+            section = sections[key]
+            out.append(
+                f"### {section.heading} (p. {section.first_page}-{section.last_page})\n"
+                f"{doc.section_text(section)}\n"
+            )
+    if plan.removed:
+        out.append("## Removed sections")
+        out.extend(f"- {manifest.sections[key]['heading']}" for key in plan.removed)
+        out.append("")
+    out.append("## Files to regenerate")
+    for rel in plan.affected:
+        if rel in plan.missing:
+            out.append(f"### {rel} (missing, write it again)\n")
+        else:
+            text = (directory / rel).read_text(errors="replace")
+            out.append(f"### {rel}\n```\n{text}\n```\n")
+    if not plan.affected:
+        out.append("None, unless the added sections need new files.\n")
+    out.append("## Files to keep unchanged")
+    for rel in plan.kept:
+        headings = [
+            manifest.sections.get(key, {}).get("heading", key)
+            for key in manifest.files[rel].sections
+        ]
+        out.append(f"- {rel}: {', '.join(headings)}")
+    return "\n".join(out)
@@ -0,0 +1,159 @@
+import asyncio
+from dataclasses import dataclass, replace
+import time
+
+import iraklis7_scg.config as config
+from iraklis7_scg.spec import Section, SectionDelta
+
+
+@dataclass
+class MapReduceOptions:
+    window: int = 20
+    overlap: int = 2
+    parallelism: int = 4
+
+    def __post_init__(self):
+        if self.window < 1:
+            raise ValueError("window must be at least 1 page")
+        if not 0 <= self.overlap < self.window:
+            raise ValueError("overlap must be between 0 and window - 1 pages")
+        if self.parallelism < 1:
+            raise ValueError("parallelism must be at least 1")
+
+
+@dataclass
+class Chunk:
+    first_page: int
+    last_page: int
+    text: str
+
+    @property
+    def label(self) -> str:
+        return f"p. {self.first_page}-{self.last_page}"
+
+
+def page_windows(page_count, window, overlap) -> list:
+    # (first, last) page ranges, numbered from 1, each sharing `overlap` pages
+    # with the previous one so content split across a boundary is seen whole
+    windows = []
+    first = 1
+    while first <= page_count:
+        last = min(first + window - 1, page_count)
+        windows.append((first, last))
+        if last == page_count:
+            break
+        first = last - overlap + 1
+    return windows
+
+
+def delta_windows(deltas, windows, pages) -> list:
+    # Group the section deltas of a diff by the page windows of the latest
+    # version, pages being its page texts. A section running past a window is
+    # cut down to the lines on the window's pages. Removed sections have no
+    # latest pages and go with the section before them. Unchanged sections
+    # are left out.
+    placed = []
+    page = 1
+    for delta in deltas:
+        if delta.new:
+            span = (delta.new.first_page, delta.new.last_page)
+            page = delta.new.last_page
+        else:
+            span = (page, page)
+        if delta.status != "unchanged":
+            placed.append((span, delta))
+    groups = []
+    for first, last in windows:
+        group = [
+            d if first <= a and b <= last else _clip_delta(d, first, last, pages)
+            for (a, b), d in placed
+            if a <= last and b >= first
+        ]
+        if group:
+            groups.append(((first, last), group))
+    return groups
+
+
+def _clip_delta(delta, first, last, pages) -> SectionDelta:
+    # The part of an added or changed section on pages first-last
+    section = delta.new
+    line_pages = _line_pages(section, pages)
+    # A plain Section: dataclasses.replace cannot rebuild a docstore MappedSection
+    clipped = Section(
+        section.number,
+        section.title,
+        max(first, section.first_page),
+        min(last, section.last_page),
+        section.text,
+        section.start,
+        section.end,
+    )
+    if delta.status == "added":
+        lines = section.text.splitlines()
+        clipped.text = "\n".join(line for line, n in zip(lines, line_pages) if first <= n <= last)
+        return replace(delta, new=clipped)
+    # Removed lines go with the page of the latest line that follows them
+    kept = []
+    removed = []
+    i = 0
+    for line in delta.diff.splitlines():
+        if line.startswith("-"):
+            removed.append(line)
+            continue
+        n = line_pages[min(i, len(line_pages) - 1)]
+        i += 1
+        if first <= n <= last:
+            kept.extend(removed)
+            kept.append(line)
+        removed = []
+    if removed and first <= line_pages[-1] <= last:
+        kept.extend(removed)
+    return replace(delta, new=clipped, diff="\n".join(kept))
+
+
+def _line_pages(section, pages) -> list:
+    # Page of each line of section.text, found by matching the lines in order
+    # against the lines of the section's pages
+    candidates = [
+        (n, line.strip())
+        for n in range(section.first_page, section.last_page + 1)
+        for line in pages[n - 1].splitlines()
+    ]
+    result = []
+    i = 0
+    for line in section.text.splitlines():
+        key = line.strip()
+        j = i
+        while j < len(candidates) and candidates[j][1] != key:
+            j += 1
+        if j < len(candidates):
+            result.append(candidates[j][0])
+            i = j + 1
+        else:
+            result.append(result[-1] if result else section.first_page)
+    return result or [section.first_page]
+
+
+async def run_map(fn, chunks, parallelism) -> list:
+    # Results come back in chunk order. One failed chunk cancels the rest,
+    # since a merge over missing parts would silently drop content.
+    semaphore = asyncio.Semaphore(parallelism)
+    started = time.perf_counter()
+
+    async def run(chunk):
+        async with semaphore:
+            return await fn(chunk)
+
+    tasks = [asyncio.ensure_future(run(chunk)) for chunk in chunks]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    config.logger.info(
+        f"Mapped {len(chunks)} chunk(s) in {time.perf_counter() - started:.1f}s "
+        f"(parallelism {parallelism})"
+    )
+    return results
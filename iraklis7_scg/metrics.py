@@ -0,0 +1,329 @@
+from dataclasses import asdict, dataclass, field
+import fcntl
+import json
+import os
+from pathlib import Path
+import time
+
+from copilot.generated.session_events import SessionEventType
+
+import iraklis7_scg.config as config
+from iraklis7_scg.events import EventSink
+
+# Per session fields summed when runs are grouped by action or model
+TOTALS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_read_tokens",
+    "cache_write_tokens",
+    "cost",
+    "duration",
+)
+# Any of these marks the first output of a session, streamed or not
+FIRST_TOKEN_TYPES = (
+    SessionEventType.ASSISTANT_MESSAGE_DELTA.value,
+    SessionEventType.ASSISTANT_REASONING_DELTA.value,
+    SessionEventType.ASSISTANT_MESSAGE.value,
+)
+USAGE_TYPES = (
+    SessionEventType.ASSISTANT_USAGE.value,
+    SessionEventType.SESSION_USAGE_INFO.value,
+)
+
+
+@dataclass
+class SessionMetrics:
+    action: str
+    model: str
+    # time.time() when the prompt was sent, for the exported record
+    started: float
+    # perf_counter() timestamps of the send, the first output event and completion
+    sent: float = 0.0
+    first_token: float = None
+    finished: float = None
+    status: str = "running"
+    requests: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    cost: float = 0.0
+    # Time spent in model calls as reported by the usage events
+    api_duration: float = 0.0
+    peak_context_tokens: int = 0
+    # Template revision the prompt was assembled from, e.g. "scg_build_uvm_tb@v1"
+    prompt: str = ""
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.perf_counter()) - self.sent
+
+    @property
+    def ttft(self) -> float:
+        return None if self.first_token is None else self.first_token - self.sent
+
+    @property
+    def tokens_per_sec(self) -> float:
+        # Output rate once generation started, so queueing and prompt
+        # processing do not count against the model
+        start = self.first_token if self.first_token is not None else self.sent
+        elapsed = (self.finished or time.perf_counter()) - start
+        return self.output_tokens / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def cache_read_ratio(self) -> float:
+        return cache_read_ratio(self.input_tokens, self.cache_read_tokens)
+
+    @property
+    def cache_write_ratio(self) -> float:
+        return cache_write_ratio(
+            self.input_tokens, self.cache_read_tokens, self.cache_write_tokens
+        )
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        for key in ("sent", "first_token", "finished"):
+            del record[key]
+        record.update(
+            duration=self.duration,
+            ttft=self.ttft,
+            tokens_per_sec=self.tokens_per_sec,
+            cache_read_ratio=self.cache_read_ratio,
+            cache_write_ratio=self.cache_write_ratio,
+        )
+        return record
+
+
+@dataclass
+class MetricsGroup:
+    sessions: int = 0
+    errors: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    cost: float = 0.0
+    duration: float = 0.0
+    ttfts: list = field(default_factory=list)
+    # Seconds spent generating, the denominator of tokens_per_sec
+    generating: float = 0.0
+
+    def add(self, metrics):
+        self.sessions += 1
+        self.errors += metrics.status != "ok"
+        for key in TOTALS:
+            setattr(self, key, getattr(self, key) + getattr(metrics, key))
+        if metrics.ttft is not None:
+            self.ttfts.append(metrics.ttft)
+        if metrics.tokens_per_sec:
+            self.generating += metrics.output_tokens / metrics.tokens_per_sec
+
+    def to_dict(self) -> dict:
+        ttfts = sorted(self.ttfts)
+        return {
+            "sessions": self.sessions,
+            "errors": self.errors,
+            **{key: getattr(self, key) for key in TOTALS},
+            "ttft_mean": sum(ttfts) / len(ttfts) if ttfts else None,
+            "ttft_max": ttfts[-1] if ttfts else None,
+            "tokens_per_sec": self.output_tokens / self.generating if self.generating else 0.0,
+            "cache_read_ratio": cache_read_ratio(self.input_tokens, self.cache_read_tokens),
+            "cache_write_ratio": cache_write_ratio(
+                self.input_tokens, self.cache_read_tokens, self.cache_write_tokens
+            ),
+        }
+
+
+def cache_read_ratio(input_tokens, cache_read_tokens) -> float:
+    # Share of the prompt served from the provider's prompt cache. Usage events
+    # report cache reads separately from the uncached input tokens.
+    total = input_tokens + cache_read_tokens
+    return cache_read_tokens / total if total else 0.0
+
+
+def cache_write_ratio(input_tokens, cache_read_tokens, cache_write_tokens) -> float:
+    # Share of the prompt written to the cache for later runs, over the same
+    # total as cache_read_ratio. High writes with low reads mean the shared
+    # prefix keeps changing between runs.
+    total = input_tokens + cache_read_tokens
+    return cache_write_tokens / total if total else 0.0
+
+
+# Series of the Prometheus textfile. Summaries carry no quantiles, only the
+# _sum and _count of one observation per session.
+PROM_SERIES = (
+    ("scg_sessions_total", "counter", "Sessions run"),
+    ("scg_session_errors_total", "counter", "Sessions that failed"),
+    ("scg_input_tokens_total", "counter", "Uncached input tokens"),
+    ("scg_output_tokens_total", "counter", "Output tokens"),
+    ("scg_cache_read_tokens_total", "counter", "Input tokens read from the prompt cache"),
+    ("scg_cache_write_tokens_total", "counter", "Input tokens written to the prompt cache"),
+    ("scg_cost_total", "counter", "Cost reported by the usage events"),
+    ("scg_session_duration_seconds", "summary", "Wall time of sessions"),
+    ("scg_time_to_first_token_seconds", "summary", "Time from send to first output"),
+    ("scg_generation_seconds", "summary", "Time from first output to completion"),
+)
+
+
+def prometheus_samples(metrics) -> dict:
+    # What one finished session adds to the samples of its series
+    streamed = int(metrics.ttft is not None)
+    return {
+        "scg_sessions_total": 1,
+        "scg_session_errors_total": int(metrics.status != "ok"),
+        "scg_input_tokens_total": metrics.input_tokens,
+        "scg_output_tokens_total": metrics.output_tokens,
+        "scg_cache_read_tokens_total": metrics.cache_read_tokens,
+        "scg_cache_write_tokens_total": metrics.cache_write_tokens,
+        "scg_cost_total": metrics.cost,
+        "scg_session_duration_seconds_sum": metrics.duration,
+        "scg_session_duration_seconds_count": 1,
+        "scg_time_to_first_token_seconds_sum": metrics.ttft or 0.0,
+        "scg_time_to_first_token_seconds_count": streamed,
+        "scg_generation_seconds_sum": (
+            metrics.output_tokens / metrics.tokens_per_sec if metrics.tokens_per_sec else 0.0
+        ),
+        "scg_generation_seconds_count": streamed,
+    }
+
+
+def prometheus_text(totals) -> str:
+    # totals maps (action, model) to the samples summed over every session
+    # exported so far, cumulative as node_exporter's textfile collector expects
+    series = [
+        (f'action="{_escape(action)}",model="{_escape(model)}"', samples)
+        for (action, model), samples in sorted(totals.items())
+    ]
+    lines = []
+    for name, kind, help_text in PROM_SERIES:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        names = [name] if kind == "counter" else [f"{name}_sum", f"{name}_count"]
+        for labels, samples in series:
+            lines.extend(f"{sample}{{{labels}}} {samples.get(sample, 0)}" for sample in names)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsSink(EventSink):
+    # Collects usage events per run: SCG calls begin() before sending a prompt
+    # and end() once the run is over. Finished runs are appended to a JSON lines
+    # file and added to the totals shared by every process, which are kept in
+    # scg_totals.json and rendered to the Prometheus textfile scg.prom.
+    def __init__(self, metrics_dir=None):
+        self.__dir = Path(metrics_dir) if metrics_dir is not None else config.METRICS_DIR
+        self.__running = {}
+        self.__finished = []
+
+    def begin(self, context, action, model, prompt="") -> SessionMetrics:
+        metrics = SessionMetrics(action, model, time.time(), time.perf_counter(), prompt=prompt)
+        self.__running[id(context)] = metrics
+        return metrics
+
+    def end(self, context, status="ok") -> SessionMetrics:
+        metrics = self.__running.pop(id(context), None)
+        if metrics is None:
+            return None
+        metrics.finished = time.perf_counter()
+        metrics.status = status
+        self.__finished.append(metrics)
+        self.__export(metrics)
+        return metrics
+
+    def wants(self, event_type) -> bool:
+        return bool(self.__running) and (
+            event_type in USAGE_TYPES or event_type in FIRST_TOKEN_TYPES
+        )
+
+    async def handle(self, record):
+        metrics = self.__running.get(id(record.context))
+        if metrics is None:
+            return
+        data = record.event.data
+        if record.type in FIRST_TOKEN_TYPES:
+            # record.received is taken in the SDK callback, before queueing
+            if metrics.first_token is None:
+                metrics.first_token = record.received
+        elif record.type == SessionEventType.ASSISTANT_USAGE.value:
+            metrics.requests += 1
+            metrics.input_tokens += int(data.input_tokens or 0)
+            metrics.output_tokens += int(data.output_tokens or 0)
+            metrics.cache_read_tokens += int(data.cache_read_tokens or 0)
+            metrics.cache_write_tokens += int(data.cache_write_tokens or 0)
+            metrics.cost += float(data.cost or 0)
+            metrics.api_duration += _seconds(data.duration)
+        else:
+            metrics.peak_context_tokens = max(
+                metrics.peak_context_tokens, int(data.current_tokens or 0)
+            )
+
+    def get_dir(self) -> Path:
+        return self.__dir
+
+    def get_prom_path(self) -> Path:
+        return self.__dir / "scg.prom"
+
+    def get_sessions(self) -> list:
+        return list(self.__finished)
+
+    def summary(self, by="action") -> dict:
+        # Aggregates finished runs by "action", "model", "prompt" (template
+        # revision) or "session"
+        if by == "session":
+            return {i: metrics.to_dict() for i, metrics in enumerate(self.__finished)}
+        if by not in ("action", "model", "prompt"):
+            raise ValueError(f"Unknown grouping {by}, expected action, model, prompt or session")
+        groups = {}
+        for metrics in self.__finished:
+            groups.setdefault(getattr(metrics, by), MetricsGroup()).add(metrics)
+        return {key: group.to_dict() for key, group in groups.items()}
+
+    def __export(self, metrics):
+        if self.__dir is None:
+            return
+        try:
+            self.__dir.mkdir(parents=True, exist_ok=True)
+            with open(self.__dir / "sessions.jsonl", "a") as f:
+                f.write(json.dumps(metrics.to_dict()) + "\n")
+            self.__merge(metrics)
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Metrics export failed: {e}")
+
+    def __merge(self, metrics):
+        # Runs of concurrent processes take turns under the lock, so no session
+        # is lost between reading and rewriting the totals
+        with open(self.__dir / "scg.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self.__dir / "scg_totals.json"
+            totals = {}
+            if state.exists():
+                totals = {
+                    (entry["action"], entry["model"]): entry["samples"]
+                    for entry in json.loads(state.read_text())
+                }
+            samples = totals.setdefault((metrics.action, metrics.model), {})
+            for name, value in prometheus_samples(metrics).items():
+                samples[name] = samples.get(name, 0) + value
+            entries = [
+                {"action": action, "model": model, "samples": samples}
+                for (action, model), samples in sorted(totals.items())
+            ]
+            _replace(state, json.dumps(entries))
+            _replace(self.get_prom_path(), prometheus_text(totals))
+
+
+def _replace(path, text):
+    # Written atomically, a textfile collector must never see half a file
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _seconds(duration) -> float:
+    # The SDK parses the wire value (milliseconds) into a timedelta
+    if hasattr(duration, "total_seconds"):
+        return duration.total_seconds()
+    return float(duration or 0) / 1000.0
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
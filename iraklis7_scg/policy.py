@@ -0,0 +1,135 @@
+from collections import deque
+from dataclasses import dataclass
+import json
+import math
+import random
+
+import iraklis7_scg.config as config
+
+# Deadlines, stall detection, retries and hedging of model requests. The
+# timeouts the callers pass (600 s for a report, 1800 s for a testbench) are
+# ceilings; once enough runs of an action and model have been seen, the
+# deadline follows their observed latency instead.
+
+
+class SessionError(Exception):
+    # Error event reported by the session, raised to the sender
+    pass
+
+
+class RequestTimeout(TimeoutError):
+    # No reply within the deadline
+    pass
+
+
+class RequestStalled(RequestTimeout):
+    # No session event within the stall window, although the deadline is not up
+    pass
+
+
+# Errors worth another attempt on a fresh session
+RETRYABLE = (TimeoutError, ConnectionError, SessionError)
+
+
+@dataclass
+class RequestPolicy:
+    # Deadline: headroom times this percentile of recent successful runs of
+    # the same action and model, between min_timeout and the caller's timeout,
+    # once min_samples runs have been seen
+    percentile: float = 0.95
+    headroom: float = 2.0
+    min_timeout: float = 60.0
+    min_samples: int = 5
+    # Abort a run that has sent no event for this long, 0 or None to only
+    # wait for the deadline
+    stall_timeout: float = 300.0
+    # Further attempts after a timeout, stall or session error, each on a new
+    # session, after an exponential backoff with full jitter
+    retries: int = 2
+    backoff: float = 2.0
+    backoff_max: float = 60.0
+    # Start a second session once a run has taken longer than this percentile
+    # of its history, the first reply wins. Only runs that write no files
+    # (map steps, triage) are hedged. hedge_model defaults to the same model.
+    hedge_percentile: float = None
+    hedge_model: str = None
+
+    def __post_init__(self):
+        for name in ("percentile", "hedge_percentile"):
+            value = getattr(self, name)
+            if value is not None and not 0 < value < 1:
+                raise ValueError(f"{name} must be between 0 and 1, got {value}")
+        if self.headroom < 1:
+            raise ValueError("headroom must be at least 1")
+        if self.retries < 0:
+            raise ValueError("retries must not be negative")
+
+    @classmethod
+    def from_settings(cls, **overrides) -> "RequestPolicy":
+        params = dict(
+            stall_timeout=config.STALL_TIMEOUT,
+            retries=config.REQUEST_RETRIES,
+            hedge_percentile=config.HEDGE_PERCENTILE,
+            hedge_model=config.HEDGE_MODEL,
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    def deadline(self, tracker, action, model, ceiling) -> float:
+        observed = tracker.percentile(action, model, self.percentile, self.min_samples)
+        if observed is None:
+            return ceiling
+        return max(min(observed * self.headroom, ceiling), min(self.min_timeout, ceiling))
+
+    def hedge_delay(self, tracker, action, model) -> float:
+        # None when hedging is off or there is too little history to tell a slow run
+        if self.hedge_percentile is None:
+            return None
+        return tracker.percentile(action, model, self.hedge_percentile, self.min_samples)
+
+    def retry_delay(self, attempt, error, rand=random.random) -> float:
+        # Seconds to wait before attempt + 1, or None to give up
+        if attempt >= self.retries or not isinstance(error, RETRYABLE):
+            return None
+        return rand() * min(self.backoff_max, self.backoff * 2**attempt)
+
+
+class LatencyTracker(object):
+    # Durations of the last `window` successful runs per (action, model)
+    def __init__(self, window=100):
+        self.__window = window
+        self.__samples = {}
+
+    def record(self, action, model, seconds):
+        key = (action, model)
+        self.__samples.setdefault(key, deque(maxlen=self.__window)).append(seconds)
+
+    def samples(self, action, model) -> list:
+        return list(self.__samples.get((action, model), ()))
+
+    def percentile(self, action, model, q, min_samples=1) -> float:
+        # Nearest rank, None with fewer than min_samples runs
+        samples = sorted(self.__samples.get((action, model), ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples), math.ceil(q * len(samples))) - 1]
+
+    def load(self, path) -> int:
+        # Seeds the history from the sessions.jsonl a MetricsSink writes, so
+        # deadlines carry over between runs of the command
+        count = 0
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("status") == "ok" and record.get("duration"):
+                        self.record(record["action"], record["model"], record["duration"])
+                        count += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            config.logger.warning(f"Ignoring latency history {path}: {e}")
+        return count
@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+import json
+import time
+
+import iraklis7_scg.config as config
+from iraklis7_scg.tracing import Tracer
+
+
+class PooledSession(object):
+    def __init__(self, key, session, setup_time):
+        self.key = key
+        self.session = session
+        self.setup_time = setup_time
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+
+
+class SessionPool(object):
+    # Sessions are keyed by (model, system message, streaming). With reuse=False
+    # (the default) a leased session is retired after use, because the SDK cannot
+    # clear a session's history, and a replacement is created in the background
+    # so the next lease for a pre-warmed key still skips the setup latency.
+    def __init__(
+        self, client, max_idle=4, idle_timeout=300.0, max_age=1800.0, reuse=False, tracer=None
+    ):
+        self.__client = client
+        # Spans for session create and destroy, recorded only when a tracer is given
+        self.__tracer = tracer if tracer is not None else Tracer(enabled=False)
+        self.__max_idle = max_idle
+        self.__idle_timeout = idle_timeout
+        self.__max_age = max_age
+        self.__reuse = reuse
+        self.__idle = {}
+        self.__configs = {}
+        self.__targets = {}
+        self.__pending = {}
+        self.__tasks = set()
+        self.__stats = {"hits": 0, "misses": 0, "created": 0, "retired": 0, "setup_time": 0.0}
+
+    @staticmethod
+    def make_key(session_config) -> tuple:
+        system_message = json.dumps(session_config.get("system_message"), sort_keys=True)
+        return (
+            session_config.get("model"),
+            system_message,
+            bool(session_config.get("streaming")),
+        )
+
+    async def prewarm(self, session_config, count=1):
+        # Keep `count` idle sessions ready for this key from now on
+        key = self.make_key(session_config)
+        self.__configs[key] = session_config
+        self.__targets[key] = min(count, self.__max_idle)
+        await asyncio.gather(*(self.__add_idle(key) for _ in range(self.__missing(key))))
+        config.logger.info(f"Pre-warmed {len(self.__idle.get(key, ()))} session(s) for {key[0]}")
+
+    async def acquire(self, session_config) -> PooledSession:
+        key = self.make_key(session_config)
+        self.__configs.setdefault(key, session_config)
+        await self.prune()
+        idle = self.__idle.get(key)
+        if idle:
+            pooled = idle.popleft()
+            self.__stats["hits"] += 1
+            config.logger.debug(f"Session pool hit for {key[0]}")
+        else:
+            pooled = await self.__create(key)
+            self.__stats["misses"] += 1
+            config.logger.debug(f"Session pool miss for {key[0]}")
+        pooled.uses += 1
+        self.__refill(key)
+        return pooled
+
+    async def release(self, pooled, healthy=True):
+        pooled.last_used = time.monotonic()
+        idle = self.__idle.setdefault(pooled.key, deque())
+        if self.__reuse and healthy and not self.__expired(pooled) and len(idle) < self.__max_idle:
+            try:
+                # Make sure nothing is still in flight before handing the session out again
+                await pooled.session.abort()
+                idle.append(pooled)
+                return
+            except Exception as e:
+                config.logger.debug(f"Session could not be reset, retiring it: {e}")
+        await self.__retire(pooled)
+        self.__refill(pooled.key)
+
+    async def prune(self):
+        # Expired sessions leave the pool before the first await, so a concurrent
+        # acquire() never sees them or removes them a second time. The deques are
+        # edited in place, a release() may be holding one across an await.
+        expired = []
+        for idle in list(self.__idle.values()):
+            for pooled in [p for p in idle if self.__expired(p)]:
+                idle.remove(pooled)
+                expired.append(pooled)
+        await asyncio.gather(*(self.__retire(pooled) for pooled in expired))
+
+    async def close(self):
+        for task in list(self.__tasks):
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__targets.clear()
+        idle = []
+        for sessions in list(self.__idle.values()):
+            idle.extend(sessions)
+            sessions.clear()
+        await asyncio.gather(*(self.__retire(pooled) for pooled in idle))
+
+    def get_stats(self) -> dict:
+        stats = dict(self.__stats)
+        leases = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / leases if leases else 0.0
+        stats["mean_setup_time"] = (
+            stats["setup_time"] / stats["created"] if stats["created"] else 0.0
+        )
+        stats["idle"] = sum(len(idle) for idle in self.__idle.values())
+        return stats
+
+    def __expired(self, pooled) -> bool:
+        now = time.monotonic()
+        return (
+            now - pooled.created > self.__max_age or now - pooled.last_used > self.__idle_timeout
+        )
+
+    def __missing(self, key) -> int:
+        have = len(self.__idle.get(key, ())) + self.__pending.get(key, 0)
+        return max(0, self.__targets.get(key, 0) - have)
+
+    def __refill(self, key):
+        for _ in range(self.__missing(key)):
+            self.__pending[key] = self.__pending.get(key, 0) + 1
+            task = asyncio.ensure_future(self.__add_idle(key, pending=True))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def __add_idle(self, key, pending=False):
+        try:
+            pooled = await self.__create(key)
+            self.__idle.setdefault(key, deque()).append(pooled)
+        except Exception as e:
+            config.logger.warning(f"Session pre-warm failed for {key[0]}: {e}")
+        finally:
+            if pending:
+                self.__pending[key] -= 1
+
+    async def __create(self, key) -> PooledSession:
+        started = time.perf_counter()
+        session = await self.__client.create_session(self.__configs[key])
+        setup_time = time.perf_counter() - started
+        self.__tracer.complete(
+            "session create",
+            "session",
+            started,
+            started + setup_time,
+            session,
+            {"model": key[0], "pooled": True},
+        )
+        self.__tracer.lane(session, f"session {key[0]}")
+        self.__stats["created"] += 1
+        self.__stats["setup_time"] += setup_time
+        return PooledSession(key, session, setup_time)
+
+    async def __retire(self, pooled):
+        self.__stats["retired"] += 1
+        try:
+            with self.__tracer.span("session destroy", "session", pooled.session):
+                await pooled.session.destroy()
+        except Exception as e:
+            config.logger.debug(f"Error destroying pooled session: {e}")
+        finally:
+            self.__tracer.retire(pooled.session)
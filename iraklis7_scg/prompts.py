@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+import hashlib
+
+# Providers cache the longest prefix a request shares with earlier requests:
+# the system message first, then the user message with its attachments. So a
+# template's role and task instructions go into the system message, which is
+# the same for every run of an action, attachments that repeat across runs
+# (the RTL index, reference excerpts) follow in a fixed order, and what
+# differs per run (the specs, resume instructions) comes last.
+
+# The user message when all instructions are in the system message
+TASK_PROMPT = "Carry out the task described in your instructions on the attached inputs."
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    # Bump whenever user or prompt change, so metrics and recordings can be
+    # told apart by template revision
+    version: int
+    user: str
+    prompt: str
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    @property
+    def fingerprint(self) -> str:
+        # Catches edits that forgot the version bump
+        return hashlib.sha256(f"{self.user}\0{self.prompt}".encode()).hexdigest()[:12]
+
+    @property
+    def system_message(self) -> str:
+        return f"{self.user.strip()}\n\n{self.prompt.strip()}".strip()
+
+
+@dataclass
+class AssembledPrompt:
+    template: PromptTemplate
+    system_message: str
+    prompt: str
+    attachments: list
+
+
+def attachment_order(attachment) -> tuple:
+    # Callers build stable attachments in varying order; sort them the same
+    # way every time so the cached prefix is not broken by a reordering
+    return (
+        attachment.get("type", ""),
+        str(attachment.get("path") or attachment.get("filePath") or ""),
+        attachment.get("displayName", ""),
+    )
+
+
+def assemble(template, attachments, stable=(), suffix="") -> AssembledPrompt:
+    # attachments keep their order, [latest, previous] means something;
+    # suffix carries per-run instructions such as resuming a partial output
+    prompt = TASK_PROMPT
+    if suffix:
+        prompt += "\n\n" + suffix.strip()
+    return AssembledPrompt(
+        template,
+        template.system_message,
+        prompt,
+        sorted(stable, key=attachment_order) + list(attachments),
+    )
+
+
+def load_templates(prompts) -> dict:
+    # prompts maps names to {"version", "user", "prompt"} dicts, as SCG defines them
+    return {
+        name: PromptTemplate(name, params.get("version", 1), params["user"], params["prompt"])
+        for name, params in prompts.items()
+    }
@@ -0,0 +1,306 @@
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import json
+from pathlib import Path
+import time
+from types import SimpleNamespace
+import uuid
+
+from copilot import CopilotClient
+from copilot.generated.session_events import SessionEventType, session_event_from_dict
+
+import iraklis7_scg.config as config
+
+RECORDING_FORMAT = 1
+# Rough size of a token, used to pace replayed deltas at a given token rate
+CHARS_PER_TOKEN = 4
+
+
+def prompt_key(prompt) -> str:
+    return hashlib.sha256((prompt or "").encode()).hexdigest()
+
+
+def load_recordings(record_dir) -> list:
+    recordings = []
+    for path in sorted(Path(record_dir).glob("*.json")):
+        try:
+            recording = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Skipping unreadable recording {path}: {e}")
+            continue
+        if recording.get("format") != RECORDING_FORMAT:
+            config.logger.warning(f"Skipping recording {path} with unknown format")
+            continue
+        recordings.append(recording)
+    if not recordings:
+        raise ValueError(f"No recordings found in {record_dir}")
+    return recordings
+
+
+def synthetic_recording(
+    model="replay", text=None, chunk_chars=16, tools=2, input_tokens=20000, cache_read_tokens=0
+) -> dict:
+    # A plausible session without a backend: tool round trips, a streamed
+    # answer, the final message, usage and idle
+    text = text or "# Delta report\n\n" + "The UART 16550 register map changed. " * 64
+    events = []
+
+    def add(event_type, **data):
+        events.append({"t": len(events) * 0.01, "event": _event(event_type, data)})
+
+    for i in range(tools):
+        add("tool.execution_start", toolCallId=f"call_{i}", toolName="view")
+        add("tool.execution_complete", toolCallId=f"call_{i}", success=True)
+    for start in range(0, len(text), chunk_chars):
+        add(
+            "assistant.message_delta",
+            messageId="m0",
+            deltaContent=text[start : start + chunk_chars],
+        )
+    add("assistant.message", messageId="m0", content=text)
+    add(
+        "assistant.usage",
+        model=model,
+        inputTokens=input_tokens,
+        outputTokens=len(text) // CHARS_PER_TOKEN,
+        cacheReadTokens=cache_read_tokens,
+        cacheWriteTokens=0,
+        cost=1.0,
+        duration=len(events) * 10,
+    )
+    add("session.idle")
+    return {
+        "format": RECORDING_FORMAT,
+        "model": model,
+        "streaming": True,
+        "prompt_key": None,
+        "prompt": "",
+        "events": events,
+    }
+
+
+class RecordingSession(object):
+    # Passes everything through to the real session and writes the events of
+    # every send, with their offsets from the send, to one file per send
+    def __init__(self, session, recorder, session_config):
+        self.__session = session
+        self.__recorder = recorder
+        self.__config = session_config
+        self.__current = None
+        session.on(self.__record)
+
+    def __getattr__(self, name):
+        return getattr(self.__session, name)
+
+    def on(self, handler):
+        return self.__session.on(handler)
+
+    async def send(self, options):
+        self.__begin(options)
+        try:
+            return await self.__session.send(options)
+        except Exception:
+            self.__end()
+            raise
+
+    async def send_and_wait(self, options, timeout=None):
+        self.__begin(options)
+        try:
+            return await self.__session.send_and_wait(options, timeout=timeout)
+        finally:
+            self.__end()
+
+    def __begin(self, options):
+        prompt = options.get("prompt", "")
+        self.__current = {
+            "format": RECORDING_FORMAT,
+            "model": self.__config.get("model"),
+            "streaming": bool(self.__config.get("streaming")),
+            "prompt_key": prompt_key(prompt),
+            "prompt": prompt[:200],
+            "started": time.perf_counter(),
+            "events": [],
+        }
+
+    def __record(self, event):
+        if self.__current is None:
+            return
+        offset = time.perf_counter() - self.__current["started"]
+        self.__current["events"].append({"t": round(offset, 6), "event": event.to_dict()})
+        if event.type in (SessionEventType.SESSION_IDLE, SessionEventType.SESSION_ERROR):
+            self.__end()
+
+    def __end(self):
+        recording, self.__current = self.__current, None
+        if recording:
+            del recording["started"]
+            self.__recorder.save(recording)
+
+
+class RecordingClient(object):
+    # Wraps a CopilotClient and records the event stream of every send to record_dir
+    def __init__(self, client, record_dir):
+        self.__client = client
+        self.__dir = Path(record_dir)
+        self.__count = 0
+
+    def __getattr__(self, name):
+        return getattr(self.__client, name)
+
+    async def create_session(self, session_config):
+        session = await self.__client.create_session(session_config)
+        return RecordingSession(session, self, session_config)
+
+    def save(self, recording):
+        self.__dir.mkdir(parents=True, exist_ok=True)
+        self.__count += 1
+        model = str(recording["model"]).replace("/", "_")
+        name = f"{time.strftime('%Y%m%d%H%M%S')}_{self.__count:04d}_{model}.json"
+        (self.__dir / name).write_text(json.dumps(recording))
+        config.logger.debug(f"Recorded {len(recording['events'])} event(s) to {name}")
+
+
+class ReplaySession(object):
+    # Plays a recording back through the registered handlers, the way the SDK
+    # delivers events, with configurable latency and token rate
+    def __init__(self, client, session_config):
+        self.session_id = str(uuid.uuid4())
+        self.__client = client
+        self.__streaming = bool(session_config.get("streaming"))
+        self.__model = session_config.get("model")
+        self.__handlers = []
+        self.__task = None
+
+    def on(self, handler):
+        self.__handlers.append(handler)
+        return lambda: self.__handlers.remove(handler) if handler in self.__handlers else None
+
+    async def send(self, options):
+        recording = self.__client.pick(self.__model, options.get("prompt", ""))
+        self.__task = asyncio.ensure_future(self.__play(recording))
+        return str(uuid.uuid4())
+
+    async def send_and_wait(self, options, timeout=None):
+        await self.send(options)
+        return await asyncio.wait_for(asyncio.shield(self.__task), timeout)
+
+    async def abort(self):
+        if self.__task is not None:
+            self.__task.cancel()
+
+    async def destroy(self):
+        await self.abort()
+        self.__handlers.clear()
+
+    async def __play(self, recording):
+        client = self.__client
+        if client.latency:
+            await asyncio.sleep(client.latency)
+        last = None
+        previous = 0.0
+        for offset, event in client.events(recording):
+            delta = event.type == SessionEventType.ASSISTANT_MESSAGE_DELTA
+            if delta and not self.__streaming:
+                # The service sends no deltas to sessions without streaming
+                continue
+            if delta and client.token_rate:
+                tokens = len(event.data.delta_content or "") / CHARS_PER_TOKEN
+                await asyncio.sleep(tokens / client.token_rate)
+            elif client.time_scale:
+                await asyncio.sleep(max(offset - previous, 0) * client.time_scale)
+            previous = offset
+            if event.type == SessionEventType.ASSISTANT_MESSAGE:
+                last = event
+            client.stats["events"] += 1
+            for handler in list(self.__handlers):
+                handler(event)
+        return last
+
+
+class ReplayClient(object):
+    # Stands in for CopilotClient: sessions replay recorded event streams.
+    # A send gets the recording of the same prompt if there is one, otherwise
+    # the next recording of the session's model, otherwise the next of any.
+    # latency delays the first event, token_rate (tokens/s) paces the deltas
+    # and time_scale scales the recorded gaps between other events (0 = none).
+    def __init__(self, recordings, latency=0.0, token_rate=None, time_scale=0.0):
+        if not recordings:
+            raise ValueError("ReplayClient needs at least one recording")
+        self.latency = latency
+        self.token_rate = token_rate
+        self.time_scale = time_scale
+        self.stats = {"sessions": 0, "sends": 0, "events": 0}
+        self.__recordings = list(recordings)
+        self.__next = {}
+        self.__parsed = {}
+        self.__state = "disconnected"
+
+    @classmethod
+    def from_dir(cls, record_dir, **options):
+        return cls(load_recordings(record_dir), **options)
+
+    def pick(self, model, prompt) -> dict:
+        self.stats["sends"] += 1
+        key = prompt_key(prompt)
+        for candidates, slot in (
+            ([r for r in self.__recordings if r.get("prompt_key") == key], key),
+            ([r for r in self.__recordings if r.get("model") == model], model),
+            (self.__recordings, None),
+        ):
+            if candidates:
+                index = self.__next.get(slot, 0)
+                self.__next[slot] = index + 1
+                return candidates[index % len(candidates)]
+
+    def events(self, recording) -> list:
+        # Parsed once per recording, so replays measure our overhead and not
+        # the SDK's event parsing
+        key = id(recording)
+        if key not in self.__parsed:
+            self.__parsed[key] = [
+                (item["t"], session_event_from_dict(item["event"])) for item in recording["events"]
+            ]
+        return self.__parsed[key]
+
+    async def start(self):
+        self.__state = "connected"
+
+    async def stop(self):
+        self.__state = "disconnected"
+        return []
+
+    def get_state(self) -> str:
+        return self.__state
+
+    async def ping(self, message=None):
+        return SimpleNamespace(message=message, timestamp=time.time() * 1000.0)
+
+    async def list_models(self) -> list:
+        return sorted({str(r.get("model")) for r in self.__recordings})
+
+    async def create_session(self, session_config):
+        self.stats["sessions"] += 1
+        return ReplaySession(self, session_config)
+
+
+def make_client():
+    # CopilotClient, unless SCG_REPLAY_DIR asks for recorded sessions; with
+    # SCG_RECORD_DIR every session is also recorded there
+    if config.REPLAY_DIR:
+        client = ReplayClient.from_dir(config.REPLAY_DIR)
+        config.logger.info(f"Replaying sessions recorded in {config.REPLAY_DIR}")
+    else:
+        client = CopilotClient()
+    if config.RECORD_DIR:
+        client = RecordingClient(client, config.RECORD_DIR)
+    return client
+
+
+def _event(event_type, data) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "type": event_type,
+        "data": data,
+    }
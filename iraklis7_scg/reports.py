@@ -0,0 +1,461 @@
+from dataclasses import asdict, dataclass, field
+import os
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
+
+from iraklis7_scg.cache import hash_file
+import iraklis7_scg.config as config
+from iraklis7_scg.manifest import SECTION_REF_RE
+
+# Bump whenever parsing or the schema changes, the index is then rebuilt
+REPORT_INDEX_FORMAT = 1
+# <SPECIFICATION NAME>_<latest version>_delta_<previous version>_report.md, as
+# the scg_delta_report prompts ask for, e.g. UART_v0.7_delta_v0.6_report.md
+REPORT_NAME_RE = re.compile(r"^(.+?)_([^_]+)_delta_([^_]+)_report\.md$", re.I)
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+NUMBERING_RE = re.compile(r"^\d+(?:\.\d+)*\.?\s+")
+EFFORT_RE = re.compile(r"effort(?:\s+rating)?\W*(minor|major)\b", re.I)
+# Section references as in manifest.py, plus figures and tables
+REFERENCE_RE = re.compile(SECTION_REF_RE.pattern + r"|\b((?i:figure|table))\s+(\d+(?:\.\d+)*)")
+EFFORTS = ("Minor", "Major")
+SCHEMA = """
+CREATE TABLE reports (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    latest TEXT NOT NULL,
+    previous TEXT NOT NULL,
+    title TEXT NOT NULL,
+    effort TEXT,
+    indexed REAL NOT NULL
+);
+CREATE TABLE features (
+    id INTEGER PRIMARY KEY,
+    report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+    number TEXT NOT NULL,
+    title TEXT NOT NULL,
+    effort TEXT
+);
+CREATE TABLE refs (
+    report_id INTEGER NOT NULL REFERENCES reports(id) ON DELETE CASCADE,
+    feature_id INTEGER REFERENCES features(id) ON DELETE CASCADE,
+    ref TEXT NOT NULL
+);
+CREATE INDEX features_report ON features(report_id);
+CREATE INDEX refs_ref ON refs(ref);
+CREATE INDEX reports_spec ON reports(spec);
+CREATE VIRTUAL TABLE parts USING fts5(
+    part UNINDEXED,
+    title,
+    body,
+    report_id UNINDEXED,
+    feature_id UNINDEXED,
+    tokenize = 'porter unicode61'
+);
+"""
+
+
+@dataclass
+class Feature:
+    number: str
+    title: str
+    # "Minor", "Major", or None when the report gives no rating
+    effort: str
+    # "Section 4.6", "Figure 1", ... in order of first mention
+    references: list
+    body: str
+
+
+@dataclass
+class ParsedReport:
+    spec: str
+    latest: str
+    previous: str
+    title: str
+    overview: str = ""
+    conclusion: str = ""
+    features: list = field(default_factory=list)
+    # (heading, text) of the sections that are none of the above
+    other: list = field(default_factory=list)
+
+    @property
+    def effort(self) -> str:
+        # The largest rating of any feature
+        efforts = {feature.effort for feature in self.features}
+        return next((e for e in reversed(EFFORTS) if e in efforts), None)
+
+
+@dataclass
+class Hit:
+    path: str
+    spec: str
+    latest: str
+    previous: str
+    # "overview", "feature", "conclusion" or "other"
+    part: str
+    title: str
+    effort: str = None
+    snippet: str = ""
+    references: list = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class ReportInfo:
+    path: str
+    spec: str
+    latest: str
+    previous: str
+    title: str
+    effort: str
+    features: list
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def report_versions(name):
+    # (spec, latest, previous) from a report file name, versions without a
+    # leading "v" so UART_v0.7_delta_v0.6 and UART_0.6_delta_0.5b chain up
+    match = REPORT_NAME_RE.match(Path(name).name)
+    if not match:
+        return None
+    spec, latest, previous = match.groups()
+    return spec, _version(latest), _version(previous)
+
+
+def version_key(version) -> tuple:
+    # "0.10" after "0.9", "0.5b" after "0.5"
+    return tuple(
+        (0, int(p), "") if p.isdigit() else (1, 0, p)
+        for p in re.findall(r"\d+|[a-z]+", version.lower())
+    )
+
+
+def parse_report(text, name) -> ParsedReport:
+    spec, latest, previous = report_versions(name) or (Path(name).stem, "", "")
+    report = ParsedReport(spec, latest, previous, "")
+    sections = _split_headings(text)
+    # The features are the subsections of "New Features"
+    feature_level = None
+    for level, heading, body in sections:
+        kind = NUMBERING_RE.sub("", heading).lower()
+        if level == 1 and not report.title:
+            report.title = heading
+            if body:
+                report.other.append((heading, body))
+            continue
+        if feature_level is not None and level > feature_level:
+            number = NUMBERING_RE.match(heading)
+            report.features.append(
+                Feature(
+                    number.group(0).strip().rstrip(".") if number else "",
+                    NUMBERING_RE.sub("", heading),
+                    _effort(body),
+                    _references(body),
+                    body,
+                )
+            )
+            continue
+        feature_level = None
+        if "new feature" in kind:
+            feature_level = level
+        elif "overview" in kind and not report.overview:
+            report.overview = body
+        elif "conclusion" in kind and not report.conclusion:
+            report.conclusion = body
+        elif body:
+            report.other.append((heading, body))
+    report.title = report.title or Path(name).stem
+    return report
+
+
+class ReportStore(object):
+    # SQLite index of generated delta reports with full-text search over
+    # their sections. ingest() parses only files that are new or changed
+    # since the last ingest; queries never touch the reports themselves.
+    def __init__(self, path=None):
+        self.__path = Path(path) if path else config.REPORT_INDEX_FILE
+        self.__db = None
+        self.__lock = threading.Lock()
+
+    def get_path(self) -> Path:
+        return self.__path
+
+    def ingest(self, directory=None) -> dict:
+        # Mirrors directory (config.REPORT_DIR by default): reports removed
+        # from it are dropped, reports indexed from other directories are kept.
+        # Unchanged files are recognised by mtime and size, or by hash after a
+        # touch.
+        directory = Path(directory) if directory else config.REPORT_DIR
+        root = directory.resolve()
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+        with self.__lock:
+            db = self.__connect()
+            known = {
+                row[1]: row
+                for row in db.execute("SELECT id, path, mtime_ns, size, hash FROM reports")
+            }
+            paths = sorted(directory.glob("*_report.md")) if directory.is_dir() else []
+            for path in paths:
+                if not report_versions(path.name):
+                    continue
+                key = str(path.resolve())
+                seen.add(key)
+                stat = os.stat(path)
+                row = known.get(key)
+                if row and (row[2], row[3]) == (stat.st_mtime_ns, stat.st_size):
+                    stats["unchanged"] += 1
+                    continue
+                digest = hash_file(path)
+                with db:
+                    if row and row[4] == digest:
+                        db.execute(
+                            "UPDATE reports SET mtime_ns = ?, size = ? WHERE id = ?",
+                            (stat.st_mtime_ns, stat.st_size, row[0]),
+                        )
+                        stats["unchanged"] += 1
+                        continue
+                    if row:
+                        self.__delete(db, row[0])
+                    report = parse_report(path.read_text(errors="replace"), path.name)
+                    self.__insert(db, key, stat, digest, report)
+                stats["updated" if row else "added"] += 1
+                config.logger.debug(f"Indexed report {path}")
+            with db:
+                for key, row in known.items():
+                    if Path(key).parent == root and key not in seen:
+                        self.__delete(db, row[0])
+                        stats["removed"] += 1
+        if stats["added"] or stats["updated"] or stats["removed"]:
+            config.logger.info(f"Report index {self.__path}: {stats}")
+        return stats
+
+    def search(self, query, spec=None, effort=None, limit=20) -> list:
+        # Best matches first. query is plain words, all of which must occur
+        # (stemmed, so "resets" finds "reset"), or FTS5 syntax if it has quotes
+        # or operators, e.g. '"reset value" OR initialization'.
+        sql = """
+            SELECT r.path, r.spec, r.latest, r.previous, p.part, p.title,
+                   COALESCE(f.effort, CASE WHEN p.part = 'feature' THEN NULL ELSE r.effort END),
+                   snippet(parts, 2, '[', ']', ' ... ', 16), p.feature_id, p.report_id
+            FROM parts p
+            JOIN reports r ON r.id = p.report_id
+            LEFT JOIN features f ON f.id = p.feature_id
+            WHERE parts MATCH ?
+        """
+        params = [match_expression(query)]
+        sql, params = self.__filters(sql, params, spec, effort, "COALESCE(f.effort, r.effort)")
+        sql += " ORDER BY p.rank LIMIT ?"
+        params.append(limit)
+        with self.__lock:
+            db = self.__connect()
+            rows = db.execute(sql, params).fetchall()
+            return [self.__hit(db, row[:8], row[8], row[9]) for row in rows]
+
+    def features(self, spec=None, effort=None, section=None) -> list:
+        # New features, optionally only those referencing a spec section
+        # ("4.6", subsections included) or figure/table ("Figure 1")
+        sql = """
+            SELECT DISTINCT r.path, r.spec, r.latest, r.previous, 'feature', f.title, f.effort,
+                   '', f.id, r.id
+            FROM features f JOIN reports r ON r.id = f.report_id
+        """
+        params = []
+        if section:
+            sql += " JOIN refs x ON x.feature_id = f.id WHERE (x.ref = ? OR x.ref LIKE ?)"
+            ref = _reference(section)
+            params += [ref, f"{ref}.%"]
+        else:
+            sql += " WHERE 1"
+        sql, params = self.__filters(sql, params, spec, effort, column="f.effort")
+        with self.__lock:
+            db = self.__connect()
+            rows = db.execute(sql, params).fetchall()
+            hits = [self.__hit(db, row[:8], row[8], row[9]) for row in rows]
+        return sorted(hits, key=lambda h: (h.spec, version_key(h.latest), h.title))
+
+    def reports(self, spec=None) -> list:
+        sql = "SELECT id, path, spec, latest, previous, title, effort FROM reports WHERE 1"
+        sql, params = self.__filters(sql, [], spec, None)
+        with self.__lock:
+            db = self.__connect()
+            result = []
+            for row in db.execute(sql, params).fetchall():
+                features = [
+                    {"number": f[0], "title": f[1], "effort": f[2]}
+                    for f in db.execute(
+                        "SELECT number, title, effort FROM features WHERE report_id = ? "
+                        "ORDER BY id",
+                        (row[0],),
+                    )
+                ]
+                result.append(ReportInfo(*row[1:], features))
+        return sorted(result, key=lambda r: (r.spec, version_key(r.latest)))
+
+    def clear(self):
+        with self.__lock:
+            self.close()
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{self.__path}{suffix}").unlink(missing_ok=True)
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__db is not None:
+            return self.__db
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        # Used from worker threads as well, always under self.__lock
+        db = sqlite3.connect(self.__path, check_same_thread=False)
+        db.execute("PRAGMA foreign_keys = ON")
+        db.execute("PRAGMA journal_mode = WAL")
+        if db.execute("PRAGMA user_version").fetchone()[0] != REPORT_INDEX_FORMAT:
+            config.logger.info(f"Creating report index {self.__path}")
+            with db:
+                for (name,) in db.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' "
+                    "AND name IN ('parts', 'refs', 'features', 'reports')"
+                ).fetchall():
+                    db.execute(f"DROP TABLE {name}")
+                db.executescript(SCHEMA)
+                db.execute(f"PRAGMA user_version = {REPORT_INDEX_FORMAT}")
+        self.__db = db
+        return db
+
+    def __insert(self, db, key, stat, digest, report):
+        report_id = db.execute(
+            "INSERT INTO reports (path, mtime_ns, size, hash, spec, latest, previous, title, "
+            "effort, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                stat.st_mtime_ns,
+                stat.st_size,
+                digest,
+                report.spec,
+                report.latest,
+                report.previous,
+                report.title,
+                report.effort,
+                time.time(),
+            ),
+        ).lastrowid
+        parts = [("overview", report.title, report.overview, None)]
+        for feature in report.features:
+            feature_id = db.execute(
+                "INSERT INTO features (report_id, number, title, effort) VALUES (?, ?, ?, ?)",
+                (report_id, feature.number, feature.title, feature.effort),
+            ).lastrowid
+            db.executemany(
+                "INSERT INTO refs (report_id, feature_id, ref) VALUES (?, ?, ?)",
+                [(report_id, feature_id, ref) for ref in feature.references],
+            )
+            parts.append(("feature", feature.title, feature.body, feature_id))
+        parts.append(("conclusion", "Conclusion", report.conclusion, None))
+        parts.extend(("other", heading, body, None) for heading, body in report.other)
+        db.executemany(
+            "INSERT INTO parts (part, title, body, report_id, feature_id) VALUES (?, ?, ?, ?, ?)",
+            [(part, title, body, report_id, fid) for part, title, body, fid in parts if body],
+        )
+
+    def __delete(self, db, report_id):
+        # parts is a virtual table, without the cascade of the others
+        db.execute("DELETE FROM parts WHERE report_id = ?", (report_id,))
+        db.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+
+    def __filters(self, sql, params, spec, effort, column="r.effort"):
+        if spec:
+            sql += " AND r.spec = ? COLLATE NOCASE"
+            params.append(spec)
+        if effort:
+            if effort.capitalize() not in EFFORTS:
+                raise ValueError(f"Unknown effort {effort}, expected one of {EFFORTS}")
+            sql += f" AND {column} = ?"
+            params.append(effort.capitalize())
+        return sql, params
+
+    def __hit(self, db, row, feature_id, report_id) -> Hit:
+        refs = db.execute(
+            "SELECT ref FROM refs WHERE report_id = ? AND feature_id IS ? ORDER BY rowid",
+            (report_id, feature_id),
+        ).fetchall()
+        return Hit(*row, references=[ref for (ref,) in refs])
+
+
+def match_expression(query) -> str:
+    # Plain words are quoted, so punctuation and words like "not" in them do
+    # not turn into FTS5 syntax; a trailing * keeps a prefix search
+    if re.search(r'["()]|\b(?:AND|OR|NOT|NEAR)\b', query):
+        return query
+    terms = re.findall(r"\w+\*?", query)
+    if not terms:
+        raise ValueError(f"Nothing to search for in {query!r}")
+    return " ".join(f'"{t.rstrip("*")}"*' if t.endswith("*") else f'"{t}"' for t in terms)
+
+
+def _version(version) -> str:
+    return version[1:] if version[:1] in ("v", "V") and version[1:2].isdigit() else version
+
+
+def _split_headings(text) -> list:
+    # (level, heading, body) of the sections that hold the report's parts:
+    # level 1 and 2 headings and the subsections of "New Features". Deeper
+    # headings stay in the body of their section.
+    sections = []
+    level, heading, lines = 0, "", []
+    in_features = None
+    fence = False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            fence = not fence
+        match = None if fence else HEADING_RE.match(line)
+        if match:
+            depth = len(match.group(1))
+            title = match.group(2).strip().strip("*").strip()
+            if depth <= 2 or (in_features is not None and depth == in_features + 1):
+                sections.append((level, heading, "\n".join(lines).strip()))
+                level, heading, lines = depth, title, []
+                if depth <= 2:
+                    kind = NUMBERING_RE.sub("", title).lower()
+                    in_features = depth if "new feature" in kind else None
+                continue
+        lines.append(line)
+    sections.append((level, heading, "\n".join(lines).strip()))
+    return [s for s in sections if s[1]]
+
+
+def _effort(text):
+    match = EFFORT_RE.search(text.replace("*", ""))
+    return match.group(1).capitalize() if match else None
+
+
+def _references(text) -> list:
+    refs = []
+    for match in REFERENCE_RE.finditer(text):
+        if match.group(1):
+            ref = f"Section {match.group(1)}"
+        else:
+            ref = f"{match.group(2).capitalize()} {match.group(3)}"
+        if ref not in refs:
+            refs.append(ref)
+    return refs
+
+
+def _reference(section) -> str:
+    # "4.6" -> "Section 4.6", "figure 1" -> "Figure 1"
+    section = section.strip()
+    if re.fullmatch(r"\d+(?:\.\d+)*", section):
+        return f"Section {section}"
+    kind, _, number = section.partition(" ")
+    return f"{kind.capitalize()} {number.strip()}"
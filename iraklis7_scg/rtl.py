@@ -0,0 +1,525 @@
+from dataclasses import asdict, dataclass, field
+import json
+import os
+from pathlib import Path
+import re
+import threading
+
+from iraklis7_scg.cache import hash_file
+import iraklis7_scg.config as config
+
+# Bump whenever parsing or the cached layout changes, so files are re-parsed
+RTL_INDEX_FORMAT = 1
+RTL_SUFFIXES = (".v", ".vh", ".sv", ".svh")
+BLOCK_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+DEFINE_RE = re.compile(r"^`define\s+(\w+)(?:\s+(.*?))?\s*$")
+CONDITION_RE = re.compile(r"^`(ifdef|ifndef|elsif|else|endif)\b\s*(\w*)")
+PORT_RE = re.compile(
+    r"^(input|output|inout)\b\s*(?:wire|reg|logic|tri)?\s*(?:signed\s*)?(\[[^\]]*\])?\s*(.*)$",
+    re.S,
+)
+PARAMETER_RE = re.compile(
+    r"^(parameter|localparam)\b\s*(?:integer\s*)?(?:\[[^\]]*\]\s*)?(.*)$", re.S
+)
+MODULE_RE = re.compile(r"^module\s+(\w+)\s*(#\s*\((.*?)\)\s*)?(?:\((.*)\))?\s*$", re.S)
+INSTANCE_RE = re.compile(
+    r"^(?:(?:end|begin|else|endcase)\s+)*(\w+)\s*(?:#\s*\(.*?\)\s*)?(\w+)\s*\(", re.S
+)
+# Register addresses, e.g. `define UART_REG_IE `UART_ADDR_WIDTH'd1 // Interrupt enable
+REGISTER_RE = re.compile(r"^(\w+?)_REG_(\w+)$")
+ADDRESS_RE = re.compile(r"'[dhbo]\s*([0-9a-fA-F_]+)$")
+BITS_RE = re.compile(r"^\d+(?::\d+)?$")
+# Left in a statement where an `ifdef changes inside it, e.g. in ANSI port lists
+MARK_RE = re.compile("\x01([^\x01]*)\x01")
+KEYWORDS = {"assign", "always", "initial", "if", "case", "for", "while", "wire", "reg", "integer"}
+
+
+@dataclass
+class Define:
+    name: str
+    value: str = ""
+    comment: str = ""
+    # `ifdef nesting it is defined under, e.g. "!DATA_BUS_WIDTH_8"
+    condition: str = ""
+    file: str = ""
+
+
+@dataclass
+class Port:
+    name: str
+    direction: str
+    width: str = ""
+    condition: str = ""
+
+
+@dataclass
+class Module:
+    name: str
+    file: str
+    ports: list = field(default_factory=list)
+    parameters: dict = field(default_factory=dict)
+    # (module, instance name) pairs, only the ones naming modules of the index
+    instances: list = field(default_factory=list)
+
+
+@dataclass
+class Register:
+    name: str
+    address: str
+    comment: str = ""
+    condition: str = ""
+    # (field, bits or encoded value, comment)
+    fields: list = field(default_factory=list)
+
+
+@dataclass
+class RtlIndex:
+    root: str
+    # Relative path -> sha256 of every source file
+    files: dict
+    defines: list
+    modules: list
+    registers: list
+
+    def get_module(self, name):
+        return next((m for m in self.modules if m.name == name), None)
+
+    def get_register(self, name):
+        return next((r for r in self.registers if r.name == name), None)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_markdown(self) -> str:
+        # Compact enough to attach to a session in place of the sources
+        out = [
+            f"# RTL index of {self.root}",
+            "Registers, module ports and configuration defines extracted from the RTL "
+            "sources; use it instead of reading the sources.",
+            "",
+            "## Registers",
+        ]
+        for reg in self.registers:
+            line = f"- {reg.name} @{reg.address}{_when(reg.condition)}"
+            if reg.comment:
+                line += f": {reg.comment}"
+            out.append(line)
+            for name, bits, comment in reg.fields:
+                out.append(f"  - {name} [{bits}]" + (f" {comment}" if comment else ""))
+        out += ["", "## Modules"]
+        for module in self.modules:
+            out.append(f"### {module.name} ({module.file})")
+            if module.parameters:
+                params = ", ".join(f"{k}={v}" for k, v in module.parameters.items())
+                out.append(f"Parameters: {params}")
+            for port in module.ports:
+                width = f" {port.width}" if port.width else ""
+                out.append(f"- {port.direction}{width} {port.name}{_when(port.condition)}")
+            if module.instances:
+                out.append("Instances: " + ", ".join(f"{i} ({m})" for m, i in module.instances))
+        out += ["", "## Defines"]
+        # Register addresses and fields are listed above already
+        stems = [_field_stem(d.name) for d in self.defines if REGISTER_RE.match(d.name)]
+        for define in self.defines:
+            if REGISTER_RE.match(define.name) or define.name.startswith(tuple(stems)):
+                continue
+            value = f" {define.value}" if define.value else ""
+            comment = f" // {define.comment}" if define.comment else ""
+            out.append(f"- {define.name}{value}{_when(define.condition)}{comment}")
+        return "\n".join(out) + "\n"
+
+
+@dataclass
+class RtlDiff:
+    old: str
+    new: str
+    files_added: list
+    files_removed: list
+    files_changed: list
+    # Lists of (name, change) pairs, change being a short description
+    modules: list
+    registers: list
+    defines: list
+
+    @property
+    def empty(self) -> bool:
+        return not (self.files_added or self.files_removed or self.files_changed)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_markdown(self) -> str:
+        out = [f"# RTL changes from {self.old} to {self.new}", ""]
+        for title, names in (
+            ("Files added", self.files_added),
+            ("Files removed", self.files_removed),
+            ("Files changed", self.files_changed),
+        ):
+            if names:
+                out.append(f"{title}: {', '.join(names)}")
+        for title, changes in (
+            ("Modules", self.modules),
+            ("Registers", self.registers),
+            ("Defines", self.defines),
+        ):
+            if changes:
+                out += ["", f"## {title}"]
+                out.extend(f"- {name}: {change}" for name, change in changes)
+        return "\n".join(out) + "\n"
+
+
+def parse_source(text, file="") -> dict:
+    # Line based: ports, parameters and defines are recorded together with the
+    # `ifdef conditions they are declared under, which a full preprocessor
+    # run would resolve away
+    text = BLOCK_COMMENT_RE.sub(lambda m: "\n" * m.group(0).count("\n"), text)
+    defines, modules = [], []
+    conditions = []
+    module = None
+    in_subprogram = False
+    statement = ""
+    # Conditions in force where the pending statement started
+    started = ""
+    for line in text.splitlines():
+        code, _, comment = line.partition("//")
+        stripped = code.strip()
+        directive = CONDITION_RE.match(stripped)
+        if directive:
+            kind, name = directive.groups()
+            if kind in ("ifdef", "ifndef"):
+                conditions.append(name if kind == "ifdef" else f"!{name}")
+            elif conditions and kind == "else":
+                top = conditions[-1]
+                conditions[-1] = top[1:] if top.startswith("!") else f"!{top}"
+            elif conditions and kind == "elsif":
+                conditions[-1] = name
+            elif conditions:
+                conditions.pop()
+            if statement.strip():
+                statement += f" \x01{' && '.join(conditions)}\x01 "
+            continue
+        define = DEFINE_RE.match(stripped)
+        if define:
+            name, value = define.groups()
+            defines.append(
+                Define(name, value or "", comment.strip(" /"), " && ".join(conditions), file)
+            )
+            continue
+        if stripped.startswith("`"):
+            continue
+        if re.search(r"\b(function|task)\b", stripped) and not stripped.startswith("end"):
+            in_subprogram = True
+        if re.search(r"\bend(function|task)\b", stripped):
+            in_subprogram = False
+            continue
+        if re.search(r"\bendmodule\b", stripped):
+            module, statement = None, ""
+            continue
+        if in_subprogram:
+            continue
+        if not statement.strip():
+            started = " && ".join(conditions)
+        statement += " " + code
+        while ";" in statement:
+            head, statement = statement.split(";", 1)
+            module = _statement(" ".join(head.split()), started, module, modules, file)
+            started = " && ".join(conditions)
+    return {"defines": [asdict(d) for d in defines], "modules": [asdict(m) for m in modules]}
+
+
+def build_index(root, files, parsed) -> RtlIndex:
+    # parsed maps relative path -> parse_source() result
+    defines = [Define(**d) for rel in sorted(parsed) for d in parsed[rel]["defines"]]
+    modules = []
+    for rel in sorted(parsed):
+        for m in parsed[rel]["modules"]:
+            m["ports"] = [Port(**p) for p in m["ports"]]
+            m["instances"] = [tuple(i) for i in m["instances"]]
+            modules.append(Module(**m))
+    names = {m.name for m in modules}
+    for module in modules:
+        module.instances = [i for i in module.instances if i[0] in names]
+    return RtlIndex(str(root), dict(files), defines, modules, register_map(defines))
+
+
+def register_map(defines) -> list:
+    # Registers are the <PREFIX>_REG_<NAME> address defines; their fields are
+    # the <PREFIX>_<NAME>_<FIELD> defines, either bit positions or encodings
+    registers = {}
+    for define in defines:
+        match = REGISTER_RE.match(define.name)
+        if not match:
+            continue
+        address = ADDRESS_RE.search(define.value)
+        if address:
+            radix = {"d": 10, "h": 16, "b": 2, "o": 8}[address.group(0)[1].lower()]
+            address = str(int(address.group(1).replace("_", ""), radix))
+        registers[define.name] = Register(
+            match.group(2), address or define.value, define.comment, define.condition
+        )
+    for define in defines:
+        for name, reg in registers.items():
+            stem = _field_stem(name)
+            if define.name.startswith(stem):
+                bits = define.value if BITS_RE.match(define.value) else f"= {define.value}"
+                reg.fields.append((define.name[len(stem) :], bits, define.comment))
+    return list(registers.values())
+
+
+def diff_index(old, new) -> RtlDiff:
+    files_added = sorted(set(new.files) - set(old.files))
+    files_removed = sorted(set(old.files) - set(new.files))
+    files_changed = sorted(
+        f for f in set(old.files) & set(new.files) if old.files[f] != new.files[f]
+    )
+
+    modules = []
+    old_modules = {m.name: m for m in old.modules}
+    new_modules = {m.name: m for m in new.modules}
+    for name in sorted(set(old_modules) | set(new_modules)):
+        was, now = old_modules.get(name), new_modules.get(name)
+        if was is None:
+            modules.append((name, f"added in {now.file}"))
+            continue
+        if now is None:
+            modules.append((name, f"removed from {was.file}"))
+            continue
+        modules.extend((name, change) for change in _port_changes(was, now))
+        for param in sorted(set(was.parameters) | set(now.parameters)):
+            if was.parameters.get(param) != now.parameters.get(param):
+                modules.append(
+                    (
+                        name,
+                        f"parameter {param} {_change(was.parameters.get(param), now.parameters.get(param))}",
+                    )
+                )
+
+    registers = []
+    old_regs = {r.name: r for r in old.registers}
+    new_regs = {r.name: r for r in new.registers}
+    for name in sorted(set(old_regs) | set(new_regs)):
+        was, now = old_regs.get(name), new_regs.get(name)
+        if was is None or now is None:
+            reg = now or was
+            registers.append(
+                (name, f"{'added' if now else 'removed'} @{reg.address} {reg.comment}".rstrip())
+            )
+            continue
+        if was.address != now.address:
+            registers.append((name, f"address {_change(was.address, now.address)}"))
+        if was.condition != now.condition:
+            registers.append((name, f"condition {_change(was.condition, now.condition)}"))
+        old_fields = {f[0]: f[1] for f in was.fields}
+        new_fields = {f[0]: f[1] for f in now.fields}
+        for fname in sorted(set(old_fields) | set(new_fields)):
+            if old_fields.get(fname) != new_fields.get(fname):
+                registers.append(
+                    (f"{name}.{fname}", _change(old_fields.get(fname), new_fields.get(fname)))
+                )
+
+    defines = []
+    old_defines = _define_values(old.defines)
+    new_defines = _define_values(new.defines)
+    # Register addresses and fields are compared above
+    stems = tuple(
+        _field_stem(n) for n in set(old_defines) | set(new_defines) if REGISTER_RE.match(n)
+    )
+    for name in sorted(set(old_defines) | set(new_defines)):
+        if REGISTER_RE.match(name) or name.startswith(stems):
+            continue
+        if old_defines.get(name) != new_defines.get(name):
+            defines.append((name, _change(old_defines.get(name), new_defines.get(name))))
+    return RtlDiff(
+        old.root, new.root, files_added, files_removed, files_changed, modules, registers, defines
+    )
+
+
+class RtlIndexStore(object):
+    # Parsed RTL files, keyed by file contents: <key[:2]>/<key>.json. Only
+    # files that changed since they were last seen are parsed again.
+    def __init__(self, store_dir=None):
+        self.__dir = Path(store_dir) if store_dir else config.RTL_INDEX_DIR
+        # (path, mtime_ns, size) -> sha256, as in DocumentStore
+        self.__hashes = {}
+        self.__lock = threading.Lock()
+
+    def get_dir(self) -> Path:
+        return self.__dir
+
+    def get(self, root) -> RtlIndex:
+        root = Path(root)
+        if not root.is_dir():
+            raise ValueError(f"No RTL directory {root}")
+        files, parsed = {}, {}
+        for path in sorted(root.rglob("*")):
+            if not path.is_file() or path.suffix.lower() not in RTL_SUFFIXES:
+                continue
+            rel = path.relative_to(root).as_posix()
+            files[rel] = key = self.__hash_path(path)
+            parsed[rel] = self.__load(key) or self.__parse(key, path, rel)
+        return build_index(_display(root), files, parsed)
+
+    def diff(self, old_root, new_root) -> RtlDiff:
+        return diff_index(self.get(old_root), self.get(new_root))
+
+    def clear(self):
+        for path in self.__dir.glob("*/*.json"):
+            path.unlink(missing_ok=True)
+
+    def __entry_path(self, key) -> Path:
+        return self.__dir / key[:2] / f"{key}.json"
+
+    def __load(self, key):
+        try:
+            entry = json.loads(self.__entry_path(key).read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            config.logger.warning(f"Dropping unreadable RTL index entry {key}: {e}")
+            return None
+        if entry.get("format") != RTL_INDEX_FORMAT:
+            return None
+        return entry
+
+    def __parse(self, key, path, rel) -> dict:
+        entry = parse_source(path.read_text(errors="replace"), rel)
+        entry["format"] = RTL_INDEX_FORMAT
+        target = self.__entry_path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(entry))
+        os.replace(tmp, target)
+        config.logger.debug(f"Indexed {path} under {key}")
+        return entry
+
+    def __hash_path(self, path) -> str:
+        stat = os.stat(path)
+        memo = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+        with self.__lock:
+            if memo not in self.__hashes:
+                self.__hashes[memo] = hash_file(path)
+            return self.__hashes[memo]
+
+
+def _statement(statement, condition, module, modules, file):
+    header = MODULE_RE.match(statement)
+    if header:
+        name, _, params, ports = header.groups()
+        module = Module(name, file)
+        modules.append(module)
+        if params:
+            _add_parameters(module, MARK_RE.sub("", params))
+        # ANSI style headers declare the ports in the list itself, each under
+        # the condition of the last marker before it
+        for item in _split(ports or ""):
+            parts = MARK_RE.split(item)
+            for i, part in enumerate(parts):
+                if i % 2:
+                    condition = part
+                elif PORT_RE.match(part.strip()):
+                    _add_ports(module, part.strip(), condition)
+        return module
+    statement = MARK_RE.sub("", statement).strip()
+    if module is None:
+        return module
+    if PORT_RE.match(statement):
+        _add_ports(module, statement, condition)
+    elif PARAMETER_RE.match(statement):
+        _add_parameters(module, PARAMETER_RE.match(statement).group(2))
+    else:
+        instance = INSTANCE_RE.match(statement)
+        if instance and instance.group(1) not in KEYWORDS:
+            if instance.groups() not in module.instances:
+                module.instances.append(instance.groups())
+    return module
+
+
+def _add_ports(module, declaration, condition):
+    direction, width, names = PORT_RE.match(declaration).groups()
+    # A port may be declared in both branches of an `ifdef, with different widths
+    known = {(p.name, p.condition) for p in module.ports}
+    for name in _split(names):
+        name = name.split("=")[0].strip()
+        if re.fullmatch(r"\w+", name) and (name, condition) not in known:
+            module.ports.append(Port(name, direction, (width or "").replace(" ", ""), condition))
+
+
+def _add_parameters(module, declaration):
+    for item in _split(declaration):
+        name, _, value = item.replace("parameter", "").partition("=")
+        if name.strip():
+            module.parameters[name.strip()] = value.strip()
+
+
+def _split(text) -> list:
+    # Commas outside brackets and braces
+    items, depth, current = [], 0, ""
+    for c in text:
+        depth += c in "([{"
+        depth -= c in ")]}"
+        if c == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += c
+    if current.strip():
+        items.append(current.strip())
+    return items
+
+
+def _port_changes(was, now) -> list:
+    changes = []
+    old_ports = _port_variants(was)
+    new_ports = _port_variants(now)
+    for name in sorted(set(old_ports) | set(new_ports)):
+        a, b = old_ports.get(name), new_ports.get(name)
+        if a is None:
+            changes.append(f"port {name} added ({b})")
+        elif b is None:
+            changes.append(f"port {name} removed ({a})")
+        elif a != b:
+            changes.append(f"port {name} {_change(a, b)}")
+    return changes
+
+
+def _port_variants(module) -> dict:
+    variants = {}
+    for port in module.ports:
+        variants.setdefault(port.name, []).append(_describe(port))
+    return {name: "; ".join(descriptions) for name, descriptions in variants.items()}
+
+
+def _describe(port) -> str:
+    return " ".join(filter(None, (port.direction, port.width, _when(port.condition).strip())))
+
+
+def _define_values(defines) -> dict:
+    values = {}
+    for define in defines:
+        values.setdefault(define.name, set()).add((define.value, define.condition))
+    return {
+        name: "; ".join(f"{v}{_when(c)}" for v, c in sorted(pairs))
+        for name, pairs in values.items()
+    }
+
+
+def _change(old, new) -> str:
+    return f"{old if old is not None else '(none)'} -> {new if new is not None else '(none)'}"
+
+
+def _when(condition) -> str:
+    return f" (if {condition})" if condition else ""
+
+
+def _field_stem(register_define) -> str:
+    # UART_REG_IE -> UART_IE_
+    prefix, name = REGISTER_RE.match(register_define).groups()
+    return f"{prefix}_{name}_"
+
+
+def _display(root) -> str:
+    root = Path(root).resolve()
+    try:
+        return root.relative_to(config.PROJ_ROOT).as_posix()
+    except ValueError:
+        return str(root)
@@ -1,60 +1,729 @@
-from copilot import SessionConfig
-from copilot.types import MessageOptions, SessionConfig, SystemMessageAppendConfig
+import asyncio
+from pathlib import Path
+import time
 
+from copilot.types import (
+    MessageOptions,
+    SelectionAttachment,
+    SessionConfig,
+    SystemMessageAppendConfig,
+)
+
+from iraklis7_scg.cache import ResultCache, changed_files, snapshot_dir
 import iraklis7_scg.config as config
 from iraklis7_scg.cpw import CPW
+from iraklis7_scg.docstore import DocumentStore
+from iraklis7_scg.jobs import ACTIONS, JobScheduler
+from iraklis7_scg.manifest import Manifest, build_manifest, plan_update, render_update
+from iraklis7_scg.mapreduce import (
+    Chunk,
+    MapReduceOptions,
+    delta_windows,
+    page_windows,
+    run_map,
+)
+from iraklis7_scg.metrics import MetricsSink
+from iraklis7_scg.policy import LatencyTracker, RequestPolicy
+from iraklis7_scg.prompts import PromptTemplate, assemble, load_templates
+from iraklis7_scg.reports import ReportStore
+from iraklis7_scg.rtl import RtlIndexStore
+from iraklis7_scg.spec import delta_payload, diff_documents, render_payload
+from iraklis7_scg.streaming import STREAM_OPENED, ReportStream, StreamSink
+from iraklis7_scg.triage import triage_pair
 
 
 class SCG(CPW):
-    def __init__(self):
-        super().__init__()
+    def __init__(
+        self,
+        cache=None,
+        pool_options=None,
+        docs=None,
+        events=None,
+        metrics=None,
+        tracer=None,
+        client=None,
+        rtl=None,
+        policy=None,
+        latency=None,
+        reports=None,
+    ):
+        super().__init__(pool_options, events, tracer, client)
         self.__dict = self.__create_dict()
+        self.__templates = load_templates(self.__dict)
+        self.__cache = cache if cache is not None else ResultCache()
+        self.__docs = docs if docs is not None else DocumentStore()
+        self.__rtl = rtl if rtl is not None else RtlIndexStore()
+        # Index of the reports in config.REPORT_DIR, updated after every report
+        self.__reports = reports if reports is not None else ReportStore()
+        # Streamed output of running sessions, written to disk as it arrives
+        self.__streams = StreamSink()
+        self.get_events().add_sink(self.__streams)
+        # Token, latency and cost figures of every run
+        self.__metrics = metrics if metrics is not None else MetricsSink()
+        self.get_events().add_sink(self.__metrics)
+        # Deadlines, retries and hedging, from the latency of earlier runs
+        self.__policy = policy if policy is not None else RequestPolicy.from_settings()
+        self.__latency = latency if latency is not None else LatencyTracker()
+        if latency is None and self.__metrics.get_dir() is not None:
+            self.__latency.load(self.__metrics.get_dir() / "sessions.jsonl")
+        # Runs currently writing into each destination directory, see __run_action
+        self.__active = {}
+        self.__overlapped = set()
 
-    async def create_report(self, model, streaming, attachments):
-        action = "scg_delta_report"
-        timeout = 600.0
-        user = self.get_user_message(action)
-        prompt = self.get_prompt(action)
-        sys_mes = SystemMessageAppendConfig(mode="append", content=user)
-        try:
-            await self.create_session(
-                SessionConfig(model=model, system_message=sys_mes, streaming=streaming)
-            )
+    async def client_stop(self):
+        await super().client_stop()
+        # Both reopen on demand, so the SCG can be started again
+        self.__docs.close()
+        self.__reports.close()
 
-            response = await self.client_send(
+    async def create_report(
+        self,
+        model,
+        streaming,
+        attachments,
+        use_cache=True,
+        prepass=True,
+        mapreduce=None,
+        triage=True,
+        triage_model=None,
+        rtl=None,
+        rtl_baseline=None,
+    ):
+        # attachments are [latest, previous]. With prepass the two PDFs are diffed
+        # locally and only the changed sections are sent, unless the diff cannot
+        # be built or is not much smaller than the specs themselves. rtl (a
+        # directory, or True for config.RTL_DIR) attaches an index of the RTL,
+        # rtl_baseline its changes against an older copy of the sources.
+        if triage:
+            await self.__triage(attachments, triage_model, use_cache)
+        extra = await self.rtl_attachments(rtl, rtl_baseline)
+        if mapreduce:
+            response = await self.__create_report_chunked(
+                model,
                 streaming,
-                MessageOptions(prompt=prompt, attachments=attachments, mode="immediate"),
-                timeout,
+                attachments,
+                use_cache,
+                self.__mapreduce_options(mapreduce),
+                extra,
             )
+        else:
+            action = "scg_delta_report"
+            if prepass:
+                diffed = await self.__prepass(attachments)
+                if diffed:
+                    action = "scg_delta_report_diff"
+                    attachments = diffed
+            response = await self.__run_action(
+                action,
+                600.0,
+                config.REPORT_DIR,
+                model,
+                streaming,
+                attachments,
+                use_cache,
+                stable=extra,
+            )
+        await self.__index_reports()
+        return response
+
+    async def __index_reports(self):
+        # The report is searchable from now on without another session;
+        # an index problem must not fail the report itself
+        try:
+            await asyncio.to_thread(self.__reports.ingest, config.REPORT_DIR)
         except Exception as e:
-            config.logger.error(f"Error: {e}")
-            raise
+            config.logger.warning(f"Report index not updated: {e}")
+
+    async def build_uvm_tb(
+        self,
+        model,
+        streaming,
+        attachments,
+        use_cache=True,
+        mapreduce=None,
+        incremental=False,
+        rtl=None,
+    ):
+        # mapreduce (True or MapReduceOptions) analyses page windows of the spec in
+        # parallel sessions and builds the testbench from the merged analyses.
+        # incremental regenerates only the files whose spec sections changed
+        # since the last incremental build, see manifest.py. rtl attaches an
+        # index of the RTL ports and registers, as in create_report.
+        extra = await self.rtl_attachments(rtl)
+        if incremental:
+            return await self.__build_uvm_tb_incremental(
+                model, streaming, attachments, use_cache, mapreduce, extra
+            )
+        if mapreduce:
+            return await self.__build_uvm_tb_chunked(
+                model,
+                streaming,
+                attachments,
+                use_cache,
+                self.__mapreduce_options(mapreduce),
+                extra,
+            )
+        return await self.__run_action(
+            "scg_build_uvm_tb",
+            1800.0,
+            config.UVM_TB_DIR,
+            model,
+            streaming,
+            attachments,
+            use_cache,
+            stable=extra,
+        )
+
+    async def prewarm(self, action, model, streaming, count=1):
+        # Have sessions for this action/model ready before the jobs arrive
+        await self.session_prewarm(self.__session_config(action, model, streaming), count)
+
+    async def run_jobs(self, jobs, concurrency=4) -> JobScheduler:
+        # Many reports/testbenches at once on this (already started) client
+        scheduler = JobScheduler(self, concurrency)
+        await scheduler.run(jobs)
+        return scheduler
+
+    async def stream_action(self, action, **kwargs):
+        # Runs create_report or build_uvm_tb with streaming on and yields the
+        # output as it is written to disk. A cache hit yields the response once.
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action {action}, expected one of {ACTIONS}")
+        opened = asyncio.get_running_loop().create_future()
+        token = STREAM_OPENED.set(opened)
+        try:
+            task = asyncio.ensure_future(getattr(self, action)(streaming=True, **kwargs))
         finally:
-            # Destroy the session
-            await self.session_destroy()
-
-    async def build_uvm_tb(self, model, streaming, attachments):
-        action = "scg_build_uvm_tb"
-        timeout = 1800.0
-        user = self.get_user_message(action)
-        prompt = self.get_prompt(action)
-        sys_mes = SystemMessageAppendConfig(mode="append", content=user)
+            STREAM_OPENED.reset(token)
         try:
-            await self.create_session(
-                SessionConfig(model=model, system_message=sys_mes, streaming=streaming)
+            await asyncio.wait([task, opened], return_when=asyncio.FIRST_COMPLETED)
+            if opened.done():
+                async for chunk in opened.result().chunks():
+                    yield chunk
+                await task
+            else:
+                opened.cancel()
+                response = await task
+                if response:
+                    yield response
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def spec_excerpt(self, path, first_page=None, last_page=None, section=None):
+        # Attach pre-extracted text of a page range or a section instead of the whole PDF
+        doc = await asyncio.to_thread(self.__docs.get, path)
+        if section is not None:
+            found = doc.find_section(section)
+            if found is None:
+                raise ValueError(f"No section {section} in {path}")
+            name = f"{Path(path).name} section {found.heading}"
+            text = f"{found.heading} (p. {found.first_page}-{found.last_page})\n"
+            text += doc.section_text(found)
+        else:
+            first_page = first_page or 1
+            last_page = last_page or doc.page_count
+            name = f"{Path(path).name} p. {first_page}-{last_page}"
+            text = doc.page_text(first_page, last_page)
+        return SelectionAttachment(
+            type="selection", filePath=str(path), displayName=name, text=text
+        )
+
+    async def rtl_attachments(self, rtl=None, baseline=None) -> list:
+        # Index of the RTL in rtl (True for config.RTL_DIR) and, with baseline,
+        # its changes since then; both are built locally from cached parses
+        if not rtl:
+            return []
+        rtl = config.RTL_DIR if rtl is True else Path(rtl)
+        index = await asyncio.to_thread(self.__rtl.get, rtl)
+        attachments = [
+            SelectionAttachment(
+                type="selection",
+                filePath=str(rtl),
+                displayName=f"RTL index of {index.root}",
+                text=index.to_markdown(),
             )
+        ]
+        if baseline:
+            diff = await asyncio.to_thread(self.__rtl.diff, baseline, rtl)
+            attachments.append(
+                SelectionAttachment(
+                    type="selection",
+                    filePath=str(rtl),
+                    displayName=f"RTL changes since {diff.old}",
+                    text=diff.to_markdown(),
+                )
+            )
+        return attachments
 
-            response = await self.client_send(
-                streaming,
-                MessageOptions(prompt=prompt, attachments=attachments, mode="immediate"),
-                timeout,
+    def get_cache(self) -> ResultCache:
+        return self.__cache
+
+    def get_metrics(self) -> MetricsSink:
+        return self.__metrics
+
+    def metrics_summary(self, by="action") -> dict:
+        # Tokens, cost, time to first token, tokens/sec and cache read ratio
+        # of the runs so far, grouped by "action", "model" or "session"
+        return self.__metrics.summary(by)
+
+    def get_docs(self) -> DocumentStore:
+        return self.__docs
+
+    def get_rtl(self) -> RtlIndexStore:
+        return self.__rtl
+
+    def get_reports(self) -> ReportStore:
+        return self.__reports
+
+    async def __triage(self, attachments, triage_model, use_cache):
+        # Reject pairs that are not consecutive versions of one spec before the
+        # expensive session starts. Title pages are read locally; only when they
+        # are inconclusive is triage_model (a small, fast model) asked, if given.
+        if not self.__is_pdfs(attachments, 2):
+            return
+        latest, previous = (a["path"] for a in attachments)
+        result = await asyncio.to_thread(triage_pair, latest, previous)
+        if result.rejected:
+            raise ValueError(f"Triage rejected {latest} / {previous}: {result.reason}")
+        if result.ok or not triage_model:
+            return
+        pages = [
+            SelectionAttachment(
+                type="selection",
+                filePath=str(path),
+                displayName=f"{Path(path).name} title page ({role})",
+                text=f"{role.capitalize()} version, file {Path(path).name}:\n{text}",
+            )
+            for role, path, text in (
+                ("latest", latest, result.latest.title_page),
+                ("previous", previous, result.previous.title_page),
+            )
+        ]
+        reply = await self.__run_action(
+            "scg_triage", 60.0, None, triage_model, False, pages, use_cache
+        )
+        if not (reply or "").strip().upper().startswith("OK"):
+            raise ValueError(f"Triage rejected {latest} / {previous}: {reply}")
+
+    async def __create_report_chunked(
+        self, model, streaming, attachments, use_cache, options, extra
+    ):
+        if not self.__is_pdfs(attachments, 2):
+            raise ValueError("Chunked create_report expects [latest, previous] PDF attachments")
+        latest_path, previous_path = (a["path"] for a in attachments)
+        latest = await asyncio.to_thread(self.__docs.load_document, latest_path)
+        previous = await asyncio.to_thread(self.__docs.load_document, previous_path)
+        deltas = diff_documents(previous, latest)
+        windows = page_windows(len(latest.pages), options.window, options.overlap)
+        chunks = [
+            Chunk(first, last, render_payload(latest, previous, deltas, detail=group))
+            for (first, last), group in delta_windows(deltas, windows, latest.pages)
+        ]
+        if not chunks:
+            # Nothing differs, the reduce step reports that from the outline alone
+            chunks = [Chunk(1, len(latest.pages), render_payload(latest, previous, deltas))]
+        return await self.__map_reduce(
+            "scg_map_delta_report",
+            "scg_reduce_delta_report",
+            600.0,
+            config.REPORT_DIR,
+            model,
+            streaming,
+            latest_path,
+            chunks,
+            use_cache,
+            options,
+            extra,
+        )
+
+    async def __build_uvm_tb_chunked(
+        self, model, streaming, attachments, use_cache, options, extra
+    ):
+        if not self.__is_pdfs(attachments, 1):
+            raise ValueError("Chunked build_uvm_tb expects one PDF attachment")
+        path = attachments[0]["path"]
+        doc = await asyncio.to_thread(self.__docs.get, path)
+        chunks = [
+            Chunk(first, last, doc.page_text(first, last))
+            for first, last in page_windows(doc.page_count, options.window, options.overlap)
+        ]
+        return await self.__map_reduce(
+            "scg_map_uvm_tb",
+            "scg_reduce_uvm_tb",
+            1800.0,
+            config.UVM_TB_DIR,
+            model,
+            streaming,
+            path,
+            chunks,
+            use_cache,
+            options,
+            extra,
+        )
+
+    async def __build_uvm_tb_incremental(
+        self, model, streaming, attachments, use_cache, mapreduce, extra
+    ):
+        if not self.__is_pdfs(attachments, 1):
+            raise ValueError("Incremental build_uvm_tb expects one PDF attachment")
+        dest_dir = Path(config.UVM_TB_DIR)
+        path = attachments[0]["path"]
+        doc = await asyncio.to_thread(self.__docs.get, path)
+        manifest = await asyncio.to_thread(Manifest.load, dest_dir)
+        before = snapshot_dir(dest_dir)
+        if manifest is None:
+            # Files are asked to name their sections, so the next build can be incremental
+            config.logger.info(f"No testbench manifest in {dest_dir}, building from scratch")
+            if mapreduce:
+                response = await self.__build_uvm_tb_chunked(
+                    model,
+                    streaming,
+                    attachments,
+                    use_cache,
+                    self.__mapreduce_options(mapreduce),
+                    extra,
+                )
+            else:
+                response = await self.__run_action(
+                    "scg_build_uvm_tb_mapped",
+                    1800.0,
+                    dest_dir,
+                    model,
+                    streaming,
+                    attachments,
+                    use_cache,
+                    stable=extra,
+                )
+            files = changed_files(before, snapshot_dir(dest_dir))
+        else:
+            plan = await asyncio.to_thread(plan_update, manifest, dest_dir, doc)
+            for rel in plan.edited:
+                config.logger.warning(f"{dest_dir / rel} was edited since it was generated")
+            if plan.up_to_date:
+                config.logger.info(f"Testbench in {dest_dir} is up to date with {path}")
+                response = None
+            else:
+                config.logger.info(
+                    f"Spec sections changed/added/removed: {len(plan.changed)}/"
+                    f"{len(plan.added)}/{len(plan.removed)}, regenerating "
+                    f"{len(plan.affected)} of {len(manifest.files)} file(s)"
+                )
+                payload = await asyncio.to_thread(render_update, doc, manifest, plan, dest_dir)
+                update = SelectionAttachment(
+                    type="selection",
+                    filePath=str(path),
+                    displayName=f"{Path(path).name} testbench update",
+                    text=payload,
+                )
+                response = await self.__run_action(
+                    "scg_update_uvm_tb",
+                    1800.0,
+                    dest_dir,
+                    model,
+                    streaming,
+                    [update],
+                    use_cache,
+                    stable=extra,
+                )
+            written = changed_files(before, snapshot_dir(dest_dir))
+            for rel in set(plan.kept) & set(written):
+                config.logger.warning(f"{dest_dir / rel} was meant to be kept but was rewritten")
+            stale = [rel for rel in plan.affected if rel not in written]
+            if stale:
+                # Advancing the manifest would mark them as up to date; keep the
+                # previous spec so the next update offers them again
+                config.logger.warning(
+                    f"Update left {len(stale)} affected file(s) unchanged, keeping the "
+                    f"manifest at {manifest.spec}: {', '.join(stale)}"
+                )
+                manifest.refresh(dest_dir, written)
+                await asyncio.to_thread(manifest.save, dest_dir)
+                return response
+            files = set(manifest.files) | set(written)
+        manifest = await asyncio.to_thread(build_manifest, dest_dir, doc, path, model, files)
+        manifest.save(dest_dir)
+        return response
+
+    async def __map_reduce(
+        self,
+        map_action,
+        reduce_action,
+        timeout,
+        dest_dir,
+        model,
+        streaming,
+        path,
+        chunks,
+        use_cache,
+        options,
+        extra,
+    ):
+        # extra (stable) attachments go to the reduce step only
+        name = Path(path).name
+
+        async def analyse(chunk):
+            # Map sessions only reply, they write no files, and are not streamed
+            # so that parallel sessions do not interleave on stdout
+            attachment = SelectionAttachment(
+                type="selection",
+                filePath=str(path),
+                displayName=f"{name} {chunk.label}",
+                text=chunk.text,
+            )
+            return await self.__run_action(
+                map_action, timeout, None, model, False, [attachment], use_cache
             )
+
+        config.logger.info(f"{map_action}: {len(chunks)} chunk(s) of {name}")
+        partials = await run_map(analyse, chunks, options.parallelism)
+        merged = [
+            SelectionAttachment(
+                type="selection",
+                filePath=str(path),
+                displayName=f"Analysis of {name} {chunk.label}",
+                text=f"Analysis of {name} {chunk.label}\n\n{partial or ''}",
+            )
+            for chunk, partial in zip(chunks, partials)
+        ]
+        return await self.__run_action(
+            reduce_action, timeout, dest_dir, model, streaming, merged, use_cache, stable=extra
+        )
+
+    def __mapreduce_options(self, mapreduce) -> MapReduceOptions:
+        return mapreduce if isinstance(mapreduce, MapReduceOptions) else MapReduceOptions()
+
+    def __is_pdfs(self, attachments, count) -> bool:
+        return len(attachments) == count and all(
+            a.get("type") == "file" and Path(a["path"]).suffix.lower() == ".pdf"
+            for a in attachments
+        )
+
+    async def __prepass(self, attachments):
+        if not self.__is_pdfs(attachments, 2):
+            config.logger.debug("Section diff skipped: expected two PDF file attachments")
+            return None
+        latest, previous = (a["path"] for a in attachments)
+        try:
+            # PDF parsing is CPU bound, keep it off the event loop
+            payload = await asyncio.to_thread(delta_payload, latest, previous, store=self.__docs)
+        except Exception as e:
+            config.logger.warning(f"Section diff failed, sending full attachments: {e}")
+            return None
+        if payload is None:
+            return None
+        return [
+            SelectionAttachment(
+                type="selection",
+                filePath=str(latest),
+                displayName=f"{Path(latest).name} vs {Path(previous).name} section diff",
+                text=payload,
+            )
+        ]
+
+    async def __run_action(
+        self, action, timeout, dest_dir, model, streaming, attachments, use_cache, stable=()
+    ):
+        # stable attachments are the same across runs (e.g. the RTL index) and
+        # are placed ahead of the per-run ones, see prompts.py
+        template = self.get_template(action)
+        assembled = assemble(template, attachments, stable)
+        user, prompt, attachments = (
+            assembled.system_message,
+            assembled.prompt,
+            assembled.attachments,
+        )
+
+        # Identical inputs produce the same job, so serve it without opening a session
+        key = None
+        if use_cache:
+            key = self.__cache.make_key(action, model, user, prompt, attachments)
+        if key:
+            entry = self.__cache.get(key)
+            if entry:
+                self.__cache.restore(entry, dest_dir)
+                return entry["response"]
+
+        stream = None
+        sent_attachments, sent_prompt = attachments, prompt
+        if streaming and dest_dir:
+            stream, sent_attachments, sent_prompt = self.__open_stream(
+                action, model, user, prompt, attachments, key
+            )
+
+        run = object()
+        # Runs that write no files (dest_dir None) cannot overlap anything
+        active = self.__active.setdefault(dest_dir, set()) if dest_dir else set()
+        if active:
+            self.__overlapped.update(active | {run})
+        active.add(run)
+        before = snapshot_dir(dest_dir)
+        healthy = False
+        try:
+            attempt = 0
+            while True:
+                options = MessageOptions(
+                    prompt=sent_prompt, attachments=sent_attachments, mode="immediate"
+                )
+                try:
+                    if dest_dir is None:
+                        response = await self.__hedged(action, model, streaming, options, timeout)
+                    else:
+                        response = await self.__attempt(
+                            action, model, streaming, options, timeout, stream
+                        )
+                    break
+                except Exception as e:
+                    delay = self.__policy.retry_delay(attempt, e)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    config.logger.warning(
+                        f"{action} attempt {attempt} failed ({e}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    if stream:
+                        # The next attempt continues from the partial output
+                        stream.close(complete=False)
+                        stream, sent_attachments, sent_prompt = self.__open_stream(
+                            action, model, user, prompt, attachments, key
+                        )
+            healthy = True
         except Exception as e:
             config.logger.error(f"Error: {e}")
             raise
         finally:
-            # Destroy the session
-            await self.session_destroy()
+            active.discard(run)
+            overlapped = run in self.__overlapped
+            self.__overlapped.discard(run)
+            if stream:
+                stream.close(complete=healthy)
+
+        if stream and stream.prefix:
+            # A resumed session only sends the continuation
+            response = stream.prefix + (response or "")
+        if overlapped:
+            # Another job wrote into the same directory meanwhile, so the changed
+            # files cannot be attributed to this run alone
+            config.logger.debug(f"Not caching {action}: concurrent writes to {dest_dir}")
+        elif key:
+            files = changed_files(before, snapshot_dir(dest_dir))
+            self.__cache.put(key, action, model, response, dest_dir, files)
+        if stream:
+            stream.discard()
+        return response
+
+    async def __attempt(self, action, model, streaming, options, timeout, stream=None):
+        # One session: lease, send within the policy's deadline, release
+        template = self.get_template(action)
+        timeout = self.__policy.deadline(self.__latency, action, model, timeout)
+        context = None
+        healthy = False
+        started = time.perf_counter()
+        try:
+            context = await self.session_lease(self.__session_config(action, model, streaming))
+            if stream:
+                self.__streams.attach(context, stream)
+                opened = STREAM_OPENED.get()
+                if opened is not None and not opened.done():
+                    opened.set_result(stream)
+            self.__metrics.begin(context, action, model, template.label)
+
+            sent = time.perf_counter()
+            response = await self.client_send(
+                streaming, options, timeout, context, self.__policy.stall_timeout
+            )
+            self.__latency.record(action, model, time.perf_counter() - sent)
+            healthy = True
+            return response
+        finally:
+            if context:
+                # Let queued chunks and usage events reach the sinks first
+                await self.get_events().drain()
+                metrics = self.__metrics.end(context, "ok" if healthy else "error")
+                if metrics and metrics.requests:
+                    config.logger.info(
+                        f"{template.label}: prompt cache read {metrics.cache_read_ratio:.0%}, "
+                        f"write {metrics.cache_write_ratio:.0%}"
+                    )
+                # On the session's lane, so lease, send and tool spans nest inside it
+                self.get_tracer().complete(
+                    action,
+                    "action",
+                    started,
+                    time.perf_counter(),
+                    context.session,
+                    {"model": model, "ok": healthy},
+                )
+                if stream:
+                    self.__streams.detach(context)
+                # Return the session to the pool, which retires it unless reuse is enabled
+                await self.session_release(context, healthy)
+
+    async def __hedged(self, action, model, streaming, options, timeout):
+        # Once the run is slower than the policy's hedge percentile, a second
+        # session races it; the first reply wins and the other is cancelled,
+        # which aborts its session. Only for runs that write no files.
+        delay = self.__policy.hedge_delay(self.__latency, action, model)
+        if delay is None:
+            return await self.__attempt(action, model, streaming, options, timeout)
+        first = asyncio.ensure_future(self.__attempt(action, model, streaming, options, timeout))
+        runs = {first: model}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if not done:
+                hedge_model = self.__policy.hedge_model or model
+                config.logger.info(
+                    f"{action}: no reply from {model} after {delay:.1f}s, "
+                    f"racing a {hedge_model} session"
+                )
+                second = self.__attempt(action, hedge_model, streaming, options, timeout)
+                runs[asyncio.ensure_future(second)] = hedge_model
+            pending = set(runs)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a reply over an error, and wait for the other run on an error
+                for task in done:
+                    if task.exception() is None:
+                        if len(runs) > 1:
+                            config.logger.info(f"{action}: {runs[task]} replied first")
+                        return task.result()
+                if not pending:
+                    raise next(iter(done)).exception()
+        finally:
+            for task in runs:
+                task.cancel()
+            await asyncio.gather(*runs, return_exceptions=True)
+
+    def __open_stream(self, action, model, user, prompt, attachments, key):
+        # Named after the inputs, so a rerun of an interrupted job finds its
+        # partial output and continues from it
+        key = key or self.__cache.make_key(action, model, user, prompt, attachments)
+        if key is None:
+            return None, attachments, prompt
+        path = Path(config.STREAM_DIR) / f"{action}_{key[:16]}.partial.md"
+        stream = ReportStream(path, action, model)
+        resume = stream.resumable
+        if resume:
+            config.logger.info(f"Resuming {action} from {stream.flushed} bytes in {stream.path}")
+            attachments = attachments + [
+                SelectionAttachment(
+                    type="selection",
+                    filePath=str(stream.path),
+                    displayName="Partial output of an interrupted run",
+                    text=stream.read_partial(),
+                )
+            ]
+            prompt = prompt + "\n\n" + self.get_prompt("scg_resume")
+        stream.open(resume)
+        return stream, attachments, prompt
+
+    def __session_config(self, action, model, streaming) -> SessionConfig:
+        # Role and instructions together, the prefix every run of the action shares
+        sys_mes = SystemMessageAppendConfig(
+            mode="append", content=self.get_template(action).system_message
+        )
+        return SessionConfig(model=model, system_message=sys_mes, streaming=streaming)
 
     def get_params(self, dkey) -> dict:
         return self.__dict[dkey]
@@ -65,9 +734,16 @@ class SCG(CPW):
     def get_prompt(self, dkey) -> str:
         return self.__dict[dkey]["prompt"]
 
+    def get_template(self, dkey) -> PromptTemplate:
+        return self.__templates[dkey]
+
+    def get_templates(self) -> dict:
+        return dict(self.__templates)
+
     def __create_dict(self) -> dict:
-        return {
+        prompts = {
             "scg_delta_report": {
+                "version": 1,
                 "user": """You are an experienced design verication technical lead, tasked with identifying and analyzing the differences between the latest device specification and its previous version. """,
                 "prompt": """You will be provided with both versions of the specification as attachments. Make sure that both files refer to the same specification and check that the version number on one is higher than the other. The version number may be found in the filename or inside the document, usually the first page. If you are unable to find the version numbers or if one of the files does not refer to the same specification, just return an error message explaining the situation and stop here. Otherwise, continue to the next part.
 A specification document must contain all the required information to produce a functional device that complies to the particular specification version. Make no assumptions about similar specifications, older specifications and disregard typical usage assumptions, only focus on the contents of the specifications provided. If a revision history is provided, disregard it and focus only on the contents of the specifications provided. Read both specifications to the end before proceeding, as important information may be spread across each document.
@@ -87,9 +763,44 @@ Once you are confident that you have identified all functional changes, produce
 2. New Features: List all new features in the latest specification in separate sections. For each new feature, provide a brief description of the functionality introduced with this feature, as well as references to specific specification subsections, diagrams, tables and sentences that most accurately describe its functionality and operation. Also, provide a brief description of the impact of this feature on the complexity of the latest specification and a rating of expected development effort as either 'Minor' or 'Major'.
 3. Conclusion: Provide a detailed estimate on the complexity of the latest specification vs the previous veraion, taking into account the new features mentioned above. Also, estimate how this complexity will weigh on the development of the device implementation (rtl) and UVM verification environment.
 
+Review the report and make sure that all new features contain proper references that will allow quick and easy identification on the specification document. When done, save the report as <SPECIFICATION NAME>_<latest version>_delta_<previous version>_report.md in the @workspace/reports directory.""",
+            },
+            "scg_resume": {
+                "version": 1,
+                "user": "",
+                "prompt": """A previous run of this task was interrupted. Its partial output is attached. Continue from where it stopped instead of starting over, without repeating what is already there, and make sure that the final result is complete.""",
+            },
+            "scg_triage": {
+                "version": 1,
+                "user": """You are an experienced design verication technical lead, tasked with checking that two specification documents are consecutive versions of the same specification. """,
+                "prompt": """You will be provided with the title pages of two specification documents, the latest and the previous version, along with their filenames. Check that both refer to the same specification and that the version number of the latest is higher than the other. The version number may be found in the filename or on the title page. If both hold, reply with OK on the first line. Otherwise, reply with ERROR: followed by a one sentence explanation. Do not create or modify any files.""",
+            },
+            "scg_delta_report_diff": {
+                "version": 1,
+                "user": """You are an experienced design verication technical lead, tasked with identifying and analyzing the differences between the latest device specification and its previous version. """,
+                "prompt": """You will be provided with a section-level diff of the two versions of the specification, extracted locally from both documents. It contains the title page of each version, an outline of the latest version in which every section is marked as changed, added, removed or unchanged along with its page numbers, and the full text of every section that is not unchanged. Changed sections are given as a diff, where lines starting with '-' only appear in the previous version and lines starting with '+' only appear in the latest version. Tables were extracted as text, so their rows may be split across lines or reordered; a changed section may therefore differ only in layout.
+Make sure that both title pages refer to the same specification and check that the version number on the latest is higher than the other. If you are unable to find the version numbers or if the two versions do not refer to the same specification, just return an error message explaining the situation and stop here. Otherwise, continue to the next part.
+Sections marked unchanged are identical in both versions and are not included. Make no assumptions about similar specifications, older specifications and disregard typical usage assumptions, only focus on the contents provided. If a revision history is provided, disregard it and focus only on the contents of the specifications. Read the whole diff before proceeding, as important information may be spread across several sections.
+Look for differences in:
+- architecture block diagrams
+- interface signals and connections
+- timing information
+- power information
+- clock rates
+- reset behavior
+- register definitions, contents and operation
+- inintialization sequences
+
+Once you are confident that you have identified all functional changes, produce a report with the following structure:
+
+1. Specification Overview: Mention the latest specification name and version, along with a brief summary of its features and operation.
+2. New Features: List all new features in the latest specification in separate sections. For each new feature, provide a brief description of the functionality introduced with this feature, as well as references to specific specification subsections, diagrams, tables and sentences that most accurately describe its functionality and operation, using the section numbers and page numbers from the outline. Also, provide a brief description of the impact of this feature on the complexity of the latest specification and a rating of expected development effort as either 'Minor' or 'Major'.
+3. Conclusion: Provide a detailed estimate on the complexity of the latest specification vs the previous veraion, taking into account the new features mentioned above. Also, estimate how this complexity will weigh on the development of the device implementation (rtl) and UVM verification environment.
+
 Review the report and make sure that all new features contain proper references that will allow quick and easy identification on the specification document. When done, save the report as <SPECIFICATION NAME>_<latest version>_delta_<previous version>_report.md in the @workspace/reports directory.""",
             },
             "scg_build_uvm_tb": {
+                "version": 1,
                 "user": """You are an experienced design verification 
 engineer, tasked with building a UVM testbench for a device 
 specification. """,
@@ -221,5 +932,112 @@ focus on the UART interface.
 Destination: Do not ask for confirmation, just save the testbench 
 files in the @workspace/uvm_tb directory.
 """,
-            }
+            },
+        }
+        prompts.update(self.__create_mapreduce_dict(prompts))
+        prompts.update(self.__create_incremental_dict(prompts))
+        return prompts
+
+    def __create_mapreduce_dict(self, prompts) -> dict:
+        # Chunked variants of the actions above. The reduce prompts reuse the
+        # instructions of the single-session prompts, only the input differs.
+        delta = prompts["scg_delta_report_diff"]["prompt"]
+        report = delta[delta.index("Look for differences in:") :]
+        build = prompts["scg_build_uvm_tb"]["prompt"].split("\n\n", 2)[2]
+        return {
+            "scg_map_delta_report": {
+                "version": 1,
+                "user": prompts["scg_delta_report"]["user"],
+                "prompt": """You will be provided with one part of a section-level diff of two versions of a specification, extracted locally from both documents. It contains the title page of each version, an outline of the latest version in which every section is marked as changed, added, removed or unchanged along with its page numbers, and the full text of the sections of this part that are not unchanged. Other parts are analysed separately, so only analyse the sections given in full. Changed sections are given as a diff, where lines starting with '-' only appear in the previous version and lines starting with '+' only appear in the latest version. Tables were extracted as text, so their rows may be split across lines or reordered; a changed section may therefore differ only in layout.
+Check whether both title pages refer to the same specification and whether the version number on the latest is higher than the other, and state the result.
+Then list every functional change in the given sections, such as changes to architecture block diagrams, interface signals and connections, timing information, power information, clock rates, reset behavior, register definitions, contents and operation, and inintialization sequences. For each change, give a brief description and precise references to the specification subsections, diagrams, tables and sentences of the latest version, using the section numbers and page numbers from the outline. Ignore changes that only affect layout or the revision history.
+Do not create or modify any files, reply with the analysis as markdown.""",
+            },
+            "scg_reduce_delta_report": {
+                "version": 1,
+                "user": prompts["scg_delta_report"]["user"],
+                "prompt": """You will be provided with analyses of consecutive parts of a section-level diff of two versions of a specification, made separately. Neighbouring parts may overlap, so the same change may be reported more than once; merge such duplicates. Each analysis states whether both versions refer to the same specification and whether the version number on the latest is higher. If any analysis reports that they do not, or that the version numbers could not be found, just return an error message explaining the situation and stop here. Otherwise, treat the analyses together as the full set of differences between the two versions.
+"""
+                + report,
+            },
+            "scg_map_uvm_tb": {
+                "version": 1,
+                "user": prompts["scg_build_uvm_tb"]["user"],
+                "prompt": """You will be provided with a range of pages from a device
+specification document, extracted as text. Other page ranges are analysed
+separately and a testbench will later be built from all the analyses
+together, so only analyse the pages given. The range may start or end in
+the middle of a section; say so when content looks cut off.
+
+Extract everything needed to build a UVM testbench for the device:
+interface signals with their width and direction, registers with their
+addresses, fields, access types and reset values, data frame formats,
+timing information, clocking and reset behavior, configuration options
+and initialization sequences. For each item, describe the checks a
+testbench must make to verify it.
+
+Give every item a precise reference to the specification section, diagram,
+table or sentence it comes from, including the page number.
+
+Do not create or modify any files, reply with the analysis as markdown.""",
+            },
+            "scg_reduce_uvm_tb": {
+                "version": 1,
+                "user": prompts["scg_build_uvm_tb"]["user"],
+                "prompt": """You will be provided with analyses of consecutive
+page ranges of a device specification document, made separately, instead of
+the document itself. Neighbouring ranges may overlap, so the same item may
+be described more than once; merge such duplicates, and join items that
+were cut off at a range boundary. Treat the merged analyses as the
+specification in the instructions below. If they appear incomplete, just
+return an error message explaining what information is missing and stop
+here.
+
+"""
+                + build,
+            },
+        }
+
+    def __create_incremental_dict(self, prompts) -> dict:
+        # Variants of scg_build_uvm_tb for incremental builds. Every file names
+        # the sections it was derived from, which is what the manifest maps.
+        build = prompts["scg_build_uvm_tb"]["prompt"]
+        sections = """
+Start every testbench file with a comment line of the form
+"// Spec sections: <numbers>", or "# Spec sections: <numbers>" in files
+that use # comments such as the Makefile, listing the numbers of the
+specification sections the file was derived from, e.g.
+"// Spec sections: 4.2, 4.6". Use "all" instead of numbers for files that
+depend on the whole specification, such as the package file.
+"""
+        return {
+            "scg_build_uvm_tb_mapped": {
+                "version": 1,
+                "user": prompts["scg_build_uvm_tb"]["user"],
+                "prompt": build + sections,
+            },
+            "scg_update_uvm_tb": {
+                "version": 1,
+                "user": prompts["scg_build_uvm_tb"]["user"],
+                "prompt": """You will be provided with the changes between the
+specification an existing UVM testbench was built from and its latest
+version, instead of the specification document itself: the full text of
+every changed and added section and the headings of removed sections,
+followed by the current contents of the testbench files that depend on
+those sections and the names of the files that do not.
+
+Update the testbench in @workspace/uvm_tb to the latest version of the
+specification. Rewrite only the files listed under "Files to regenerate",
+keeping their structure, class names and interfaces wherever the changes
+allow. You may read the files listed under "Files to keep unchanged" in
+@workspace/uvm_tb to stay consistent with them, but do not modify them.
+Only create new files when the added sections need components that do not
+exist yet, and then add them to the package file as well.
+
+The testbench was built following the instructions below, which still apply.
+
+"""
+                + build.split("\n\n", 2)[2]
+                + sections,
+            },
         }
@@ -0,0 +1,273 @@
+from collections import Counter
+from dataclasses import dataclass, field
+import difflib
+import re
+import unicodedata
+
+import pypdf
+
+import iraklis7_scg.config as config
+
+# Subsection headings such as "4.2 Interrupt Enable Register (IER)"
+HEADING_RE = re.compile(r"^([1-9]\d?(?:\.\d{1,2}){1,3})\.?\s+([A-Z][^\n]{1,80})$")
+# Chapters put the number on a line of its own, followed by the title
+CHAPTER_RE = re.compile(r"^([1-9]\d?)$")
+# Running headers and footers differ only in page numbers and dates
+FURNITURE_DIGITS_RE = re.compile(r"\d+")
+# Beyond this share of the extracted text the full attachments are sent instead
+MAX_PAYLOAD_RATIO = 0.6
+
+
+@dataclass
+class Section:
+    number: str
+    title: str
+    first_page: int
+    last_page: int
+    text: str = ""
+    start: int = 0
+    end: int = 0
+
+    @property
+    def heading(self) -> str:
+        return f"{self.number} {self.title}".strip()
+
+    @property
+    def key(self) -> str:
+        return " ".join(self.title.lower().split())
+
+
+@dataclass
+class SpecDocument:
+    path: str
+    pages: list
+    sections: list = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(len(p) for p in self.pages)
+
+
+@dataclass
+class SectionDelta:
+    status: str
+    old: Section = None
+    new: Section = None
+    diff: str = ""
+
+
+def extract_pages(path) -> list:
+    # Tables come through as text rows, which is enough to diff them
+    reader = pypdf.PdfReader(str(path))
+    return strip_furniture([page.extract_text() or "" for page in reader.pages])
+
+
+def strip_furniture(pages) -> list:
+    # Drop lines repeated on most pages, i.e. running headers and footers
+    def norm(line):
+        return FURNITURE_DIGITS_RE.sub("#", " ".join(line.split()))
+
+    page_lines = [[line.rstrip() for line in page.splitlines()] for page in pages]
+    if len(pages) < 3:
+        return ["\n".join(lines).strip() for lines in page_lines]
+    counts = Counter()
+    for lines in page_lines:
+        counts.update({norm(line) for line in lines if line.strip()})
+    furniture = {line for line, n in counts.items() if n >= len(pages) / 2}
+    return [
+        "\n".join(line for line in lines if line.strip() and norm(line) not in furniture)
+        for lines in page_lines
+    ]
+
+
+def split_sections(pages) -> list:
+    # Headings must be numbered in increasing order and chapters consecutively,
+    # which rejects register bit rows and list items that look like headings.
+    # Section start/end are offsets into join_pages(pages).
+    text = join_pages(pages)
+    sections = [Section("", "Front matter", 1, 1)]
+    last = ()
+    pos = 0
+    for page_no, page in enumerate(pages, start=1):
+        lines = page.split("\n")
+        i = 0
+        while i < len(lines):
+            line = lines[i].strip()
+            heading = None
+            match = HEADING_RE.match(line)
+            if match:
+                heading = (match.group(1), match.group(2).strip(), 1)
+            else:
+                match = CHAPTER_RE.match(line)
+                following = lines[i + 1].strip() if i + 1 < len(lines) else ""
+                chapter = int(match.group(1)) if match else 0
+                next_chapter = (last[0] if last else 0) + 1
+                if chapter == next_chapter and following[:1].isupper() and len(following) <= 60:
+                    heading = (match.group(1), following, 2)
+            if heading:
+                number = tuple(int(n) for n in heading[0].split("."))
+                if number > last:
+                    last = number
+                    sections[-1].end = pos
+                    pos += sum(len(lines[j]) + 1 for j in range(i, i + heading[2]))
+                    sections.append(Section(heading[0], heading[1], page_no, page_no, start=pos))
+                    i += heading[2]
+                    continue
+            if line:
+                sections[-1].last_page = page_no
+            pos += len(lines[i]) + 1
+            i += 1
+    sections[-1].end = len(text)
+    for section in sections:
+        section.text = text[section.start : section.end].strip()
+    return sections
+
+
+def join_pages(pages) -> str:
+    return "\n".join(pages)
+
+
+def extract_document(path) -> SpecDocument:
+    pages = extract_pages(path)
+    document = SpecDocument(str(path), pages, split_sections(pages))
+    config.logger.debug(
+        f"Extracted {len(pages)} page(s), {len(document.sections)} section(s) from {path}"
+    )
+    return document
+
+
+def align_sections(old_sections, new_sections) -> list:
+    # Pair sections by title first, since inserted sections renumber the rest,
+    # then by number for sections that were renamed
+    def index(sections):
+        seen = Counter()
+        keyed = {}
+        for section in sections:
+            seen[section.key] += 1
+            keyed[(section.key, seen[section.key])] = section
+        return keyed
+
+    old_keyed = index(old_sections)
+    new_keyed = index(new_sections)
+    pairs = {key: (old_keyed.get(key), new) for key, new in new_keyed.items()}
+    unmatched_old = {s.number: s for k, s in old_keyed.items() if k not in new_keyed and s.number}
+    for key, (old, new) in pairs.items():
+        if old is None and new.number in unmatched_old:
+            pairs[key] = (unmatched_old.pop(new.number), new)
+    aligned = list(pairs.values())
+    matched = {id(old) for old, _ in aligned if old is not None}
+    aligned.extend((old, None) for old in old_sections if id(old) not in matched)
+    return aligned
+
+
+def diff_documents(old, new) -> list:
+    deltas = []
+    for old_section, new_section in align_sections(old.sections, new.sections):
+        if old_section is None:
+            deltas.append(SectionDelta("added", new=new_section))
+        elif new_section is None:
+            deltas.append(SectionDelta("removed", old=old_section))
+        elif normalise_rows(old_section.text) == normalise_rows(new_section.text):
+            deltas.append(SectionDelta("unchanged", old_section, new_section))
+        else:
+            diff = diff_lines(old_section.text.splitlines(), new_section.text.splitlines())
+            deltas.append(SectionDelta("changed", old_section, new_section, diff))
+    return deltas
+
+
+def diff_lines(old_lines, new_lines) -> str:
+    # Whole-section diff, so it carries the latest text as well and nothing is
+    # sent twice. Lines that differ only in spacing count as equal.
+    def keys(lines):
+        return ["".join(unicodedata.normalize("NFKC", line).split()) for line in lines]
+
+    matcher = difflib.SequenceMatcher(None, keys(old_lines), keys(new_lines), autojunk=False)
+    out = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            out.extend(f" {line}" for line in new_lines[j1:j2])
+            continue
+        out.extend(f"-{line}" for line in old_lines[i1:i2])
+        out.extend(f"+{line}" for line in new_lines[j1:j2])
+    return "\n".join(out)
+
+
+def render_payload(latest, previous, deltas, detail=None) -> str:
+    # Outline of the latest version for context, then only what differs.
+    # detail narrows the sections given in full to a subset of deltas.
+    parts = [
+        "# Specification section diff",
+        f"Latest: {latest.path} ({len(latest.pages)} pages)",
+        f"Previous: {previous.path} ({len(previous.pages)} pages)",
+        "",
+        "## Title page (latest)",
+        latest.pages[0] if latest.pages else "",
+        "",
+        "## Title page (previous)",
+        previous.pages[0] if previous.pages else "",
+        "",
+        "## Outline (latest)",
+    ]
+    for delta in deltas:
+        section = delta.new or delta.old
+        pages = _page_range(section)
+        parts.append(f"- [{delta.status}] {section.heading} (p. {pages})")
+    parts.append("")
+    parts.append("## Changed sections")
+    for delta in deltas if detail is None else detail:
+        if delta.status == "unchanged":
+            continue
+        section = delta.new or delta.old
+        parts.append(f"### {section.heading} [{delta.status}]")
+        if delta.status == "changed":
+            parts.append(
+                f"Latest p. {_page_range(delta.new)}, previous p. {_page_range(delta.old)}"
+            )
+            parts.extend(["```diff", delta.diff, "```"])
+        else:
+            parts.append(f"p. {_page_range(section)}")
+            parts.append(section.text)
+        parts.append("")
+    return "\n".join(parts)
+
+
+def delta_payload(latest_path, previous_path, max_ratio=MAX_PAYLOAD_RATIO, store=None):
+    # Returns None when too much changed for the diff to be worth sending.
+    # With a DocumentStore, PDFs parsed before are not parsed again.
+    load = store.load_document if store is not None else extract_document
+    latest = load(latest_path)
+    previous = load(previous_path)
+    deltas = diff_documents(previous, latest)
+    payload = render_payload(latest, previous, deltas)
+    extracted = latest.size + previous.size
+    ratio = len(payload) / max(extracted, 1)
+    changed = sum(1 for d in deltas if d.status != "unchanged")
+    config.logger.info(
+        f"Section diff: {changed}/{len(deltas)} section(s) differ, "
+        f"payload is {len(payload)} of {extracted} chars ({ratio:.0%})"
+    )
+    if ratio > max_ratio:
+        config.logger.info("Section diff too large, falling back to full attachments")
+        return None
+    return payload
+
+
+def normalise_text(text) -> str:
+    # PDF producers differ in ligatures and spacing, so compare without
+    # whitespace; the order of the characters is kept
+    text = unicodedata.normalize("NFKC", text)
+    return "".join(c for c in text if not c.isspace())
+
+
+def normalise_rows(text) -> Counter:
+    # Producers also emit table rows and notes such as "Reset Value" in a
+    # different order, so rows may move; a row whose content changed, e.g.
+    # swapped bit fields or a reset value going from 01 to 10, still differs
+    rows = (normalise_text(line) for line in text.splitlines())
+    return Counter(row for row in rows if row)
+
+
+def _page_range(section) -> str:
+    if section.first_page == section.last_page:
+        return str(section.first_page)
+    return f"{section.first_page}-{section.last_page}"
@@ -0,0 +1,184 @@
+import asyncio
+import codecs
+import contextvars
+import json
+import os
+from pathlib import Path
+import time
+
+from copilot.generated.session_events import SessionEventType
+
+import iraklis7_scg.config as config
+from iraklis7_scg.events import EventSink
+
+# Partial output is flushed to disk and checkpointed after this many bytes or seconds
+CHECKPOINT_BYTES = 4096
+CHECKPOINT_INTERVAL = 2.0
+# Chunk size used when callers read the stream back
+READ_SIZE = 1 << 16
+# Future that SCG.stream_action waits on for the stream of the run it started
+STREAM_OPENED = contextvars.ContextVar("STREAM_OPENED", default=None)
+
+
+class ReportStream(object):
+    # Streamed assistant text for one run, appended to <name>.partial.md in
+    # config.STREAM_DIR through a buffered writer, never next to the files the
+    # run writes. A checkpoint file next to it records how much was written, so
+    # an interrupted run can be resumed.
+    def __init__(
+        self,
+        path,
+        action,
+        model,
+        checkpoint_bytes=CHECKPOINT_BYTES,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+    ):
+        self.path = Path(path)
+        self.checkpoint_path = self.path.with_suffix(".json")
+        self.action = action
+        self.model = model
+        self.__checkpoint_bytes = checkpoint_bytes
+        self.__checkpoint_interval = checkpoint_interval
+        self.__meta = self.__read_checkpoint()
+        self.__file = None
+        self.__pending = 0
+        self.__last_checkpoint = time.monotonic()
+        self.__changed = asyncio.Event()
+        self.closed = False
+        self.complete = False
+        # Text kept from interrupted runs, which the session's reply continues
+        self.prefix = ""
+
+    @property
+    def resumable(self) -> bool:
+        return not self.__meta.get("complete", True) and self.__meta.get("bytes", 0) > 0
+
+    @property
+    def flushed(self) -> int:
+        # Bytes on disk and visible to readers
+        return self.__meta.get("bytes", 0)
+
+    def read_partial(self) -> str:
+        # Text kept by an interrupted run, up to its last checkpoint
+        with open(self.path, "rb") as f:
+            return f.read(self.flushed).decode(errors="ignore")
+
+    def open(self, resume=False):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.resumable:
+            # Drop anything written after the last checkpoint
+            with open(self.path, "r+b") as f:
+                f.truncate(self.flushed)
+            self.prefix = self.read_partial()
+            self.__meta["resumes"] = self.__meta.get("resumes", 0) + 1
+        else:
+            self.prefix = ""
+            self.__meta = {"bytes": 0, "resumes": 0}
+            self.path.write_bytes(b"")
+        self.__meta.update({"action": self.action, "model": self.model, "complete": False})
+        self.__file = open(self.path, "ab")
+        self.__checkpoint()
+        config.logger.debug(f"Streaming {self.action} output to {self.path}")
+
+    def write(self, text):
+        data = text.encode()
+        self.__file.write(data)
+        self.__pending += len(data)
+
+    def maybe_checkpoint(self):
+        now = time.monotonic()
+        if self.__pending >= self.__checkpoint_bytes or (
+            self.__pending and now - self.__last_checkpoint >= self.__checkpoint_interval
+        ):
+            self.__checkpoint()
+
+    def close(self, complete):
+        if self.closed:
+            return
+        self.complete = complete
+        self.__meta["complete"] = complete
+        if self.__file is not None:
+            self.__checkpoint()
+            self.__file.close()
+        self.closed = True
+        self.__changed.set()
+        if not complete:
+            config.logger.info(f"Partial {self.action} output kept in {self.path}")
+
+    def discard(self):
+        # Once the full text (prefix and reply) has been returned or cached; a
+        # complete checkpoint is never resumed, so a crash before this is harmless
+        self.path.unlink(missing_ok=True)
+        self.checkpoint_path.unlink(missing_ok=True)
+
+    async def chunks(self):
+        # Reads back what has been flushed so far and waits for more, so the
+        # caller's memory use does not grow with the length of the output
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        offset = 0
+        with open(self.path, "rb") as f:
+            while True:
+                self.__changed.clear()
+                while offset < self.flushed:
+                    f.seek(offset)
+                    data = f.read(min(READ_SIZE, self.flushed - offset))
+                    offset += len(data)
+                    text = decoder.decode(data)
+                    if text:
+                        yield text
+                if self.closed and offset >= self.flushed:
+                    break
+                await self.__changed.wait()
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+
+    def __checkpoint(self):
+        # Runs on the event loop, so no fsync: flushed data survives the process,
+        # which is all a resume needs
+        self.__file.flush()
+        self.__meta["bytes"] = self.__meta.get("bytes", 0) + self.__pending
+        self.__meta["updated"] = time.time()
+        self.__pending = 0
+        self.__last_checkpoint = time.monotonic()
+        tmp = self.checkpoint_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.__meta))
+        os.replace(tmp, self.checkpoint_path)
+        self.__changed.set()
+
+    def __read_checkpoint(self) -> dict:
+        try:
+            meta = json.loads(self.checkpoint_path.read_text())
+        except (OSError, ValueError):
+            return {}
+        # A file shorter than its checkpoint cannot be trusted
+        if not self.path.is_file() or self.path.stat().st_size < meta.get("bytes", 0):
+            return {}
+        return meta
+
+
+class StreamSink(EventSink):
+    # Routes ASSISTANT_MESSAGE_DELTA chunks of attached sessions to their streams
+    def __init__(self):
+        self.__streams = {}
+
+    def attach(self, context, stream):
+        self.__streams[id(context)] = stream
+
+    def detach(self, context):
+        self.__streams.pop(id(context), None)
+
+    def wants(self, event_type) -> bool:
+        return (
+            bool(self.__streams) and event_type == SessionEventType.ASSISTANT_MESSAGE_DELTA.value
+        )
+
+    async def handle(self, record):
+        stream = self.__streams.get(id(record.context))
+        if stream is not None and not stream.closed:
+            stream.write(record.event.data.delta_content or "")
+
+    async def flush(self):
+        for stream in self.__streams.values():
+            if not stream.closed:
+                stream.maybe_checkpoint()
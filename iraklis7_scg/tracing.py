@@ -0,0 +1,212 @@
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import time
+
+from copilot.generated.session_events import SessionEventType
+
+import iraklis7_scg.config as config
+from iraklis7_scg.events import EventSink
+
+# Lane 0 holds client wide spans, every session gets a lane of its own so
+# spans on one lane never overlap without nesting
+CLIENT_LANE = 0
+
+
+class Tracer(object):
+    # Records spans as Chrome trace "complete" events, viewable in
+    # chrome://tracing or ui.perfetto.dev. Timestamps are perf_counter()
+    # values, so spans built from SDK callback times line up with the rest.
+    def __init__(self, max_events=None, enabled=True):
+        self.enabled = enabled
+        max_events = max_events if max_events is not None else config.TRACE_MAX_EVENTS
+        self.__events = deque(maxlen=max_events)
+        self.__origin = time.perf_counter()
+        self.__wall_origin = time.time()
+        self.__lanes = {}
+        self.__next_lane = CLIENT_LANE + 1
+        self.__names = {CLIENT_LANE: "client"}
+        # id(key) -> {slot: value} for spans started by one event and ended by
+        # a later one, see TraceSink
+        self.__marks = {}
+        self.__dropped = 0
+
+    def lane(self, key=None, name=None) -> int:
+        # Lanes are keyed by the SDK session object, shared by every context
+        # that wraps it, so a pooled session keeps one lane from create to destroy
+        if key is None:
+            return CLIENT_LANE
+        lane = self.__lanes.get(id(key))
+        if lane is None:
+            lane = self.__lanes[id(key)] = self.__next_lane
+            self.__next_lane += 1
+            self.__names[lane] = f"session {lane}"
+        if name:
+            self.__names[lane] = name
+        return lane
+
+    def retire(self, key):
+        # Called once the session behind key is destroyed: its id may be reused
+        # by a new object, which must not inherit the lane or open spans
+        self.__lanes.pop(id(key), None)
+        self.__marks.pop(id(key), None)
+
+    def mark(self, key, slot, value):
+        # Keeps the first value per slot until unmark() or retire()
+        self.__marks.setdefault(id(key), {}).setdefault(slot, value)
+
+    def unmark(self, key, slot):
+        marks = self.__marks.get(id(key))
+        return marks.pop(slot, None) if marks else None
+
+    @contextmanager
+    def span(self, name, cat, key=None, **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.complete(name, cat, start, time.perf_counter(), key, args)
+
+    def complete(self, name, cat, start, end, key=None, args=None):
+        if not self.enabled:
+            return
+        self.__add(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self.__us(start),
+                "dur": max(self.__us(end) - self.__us(start), 0),
+                "pid": os.getpid(),
+                "tid": self.lane(key),
+                "args": args or {},
+            }
+        )
+
+    def instant(self, name, cat, when, key=None, args=None):
+        if not self.enabled:
+            return
+        self.__add(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "i",
+                "s": "t",
+                "ts": self.__us(when),
+                "pid": os.getpid(),
+                "tid": self.lane(key),
+                "args": args or {},
+            }
+        )
+
+    def get_events(self) -> list:
+        return list(self.__events)
+
+    def get_stats(self) -> dict:
+        return {
+            "events": len(self.__events),
+            "dropped": self.__dropped,
+            "lanes": len(self.__names),
+        }
+
+    def to_chrome(self) -> dict:
+        pid = os.getpid()
+        meta = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "iraklis7_scg"}}
+        ] + [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": lane, "args": {"name": name}}
+            for lane, name in self.__names.items()
+        ]
+        return {
+            "traceEvents": meta + sorted(self.__events, key=lambda e: e["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"started": self.__wall_origin, "dropped": self.__dropped},
+        }
+
+    def export(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.to_chrome()))
+        os.replace(tmp, path)
+        config.logger.info(f"Trace with {len(self.__events)} event(s) written to {path}")
+
+    def clear(self):
+        self.__events.clear()
+        self.__dropped = 0
+
+    def __add(self, event):
+        if len(self.__events) == self.__events.maxlen:
+            # The oldest spans go first, a long run keeps its most recent history
+            self.__dropped += 1
+        self.__events.append(event)
+
+    def __us(self, when) -> float:
+        return round((when - self.__origin) * 1e6, 3)
+
+
+class TraceSink(EventSink):
+    # Turns session events into spans: tool executions matched by tool_call_id,
+    # and reasoning and message streaming from their first delta to the final
+    # event. Open spans are kept by the tracer, which drops them when the
+    # session is retired.
+    TYPES = (
+        SessionEventType.TOOL_EXECUTION_START.value,
+        SessionEventType.TOOL_EXECUTION_COMPLETE.value,
+        SessionEventType.ASSISTANT_REASONING_DELTA.value,
+        SessionEventType.ASSISTANT_REASONING.value,
+        SessionEventType.ASSISTANT_MESSAGE_DELTA.value,
+        SessionEventType.ASSISTANT_MESSAGE.value,
+        SessionEventType.SESSION_ERROR.value,
+    )
+
+    def __init__(self, tracer):
+        self.__tracer = tracer
+
+    def wants(self, event_type) -> bool:
+        return self.__tracer.enabled and event_type in self.TYPES
+
+    async def handle(self, record):
+        key = getattr(record.context, "session", record.context)
+        data = record.event.data
+        when = record.received
+        if record.type == SessionEventType.TOOL_EXECUTION_START.value:
+            self.__tracer.mark(key, ("tool", data.tool_call_id), (when, data.tool_name))
+        elif record.type == SessionEventType.TOOL_EXECUTION_COMPLETE.value:
+            start, name = self.__tracer.unmark(key, ("tool", data.tool_call_id)) or (None, None)
+            if start is not None:
+                self.__tracer.complete(
+                    f"tool: {name}",
+                    "tool",
+                    start,
+                    when,
+                    key,
+                    {"tool_call_id": data.tool_call_id, "success": data.success},
+                )
+        elif record.type == SessionEventType.ASSISTANT_REASONING_DELTA.value:
+            self.__tracer.mark(key, "reasoning", when)
+        elif record.type == SessionEventType.ASSISTANT_MESSAGE_DELTA.value:
+            # Reasoning is over once the answer starts
+            self.__close(key, "reasoning", when)
+            self.__tracer.mark(key, "message", when)
+        elif record.type == SessionEventType.ASSISTANT_REASONING.value:
+            self.__close(key, "reasoning", when)
+        elif record.type == SessionEventType.ASSISTANT_MESSAGE.value:
+            self.__close(key, "reasoning", when)
+            if not self.__close(key, "message", when):
+                # Not streamed, only the final message marks the point
+                self.__tracer.instant("message", "stream", when, key)
+        else:
+            self.__tracer.instant("session error", "session", when, key, {"message": data.message})
+
+    def __close(self, key, kind, when) -> bool:
+        start = self.__tracer.unmark(key, kind)
+        if start is None:
+            return False
+        self.__tracer.complete(f"{kind} streaming", "stream", start, when, key)
+        return True
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+import difflib
+from pathlib import Path
+import re
+import unicodedata
+
+import pypdf
+
+import iraklis7_scg.config as config
+
+VERSION_RE = re.compile(
+    r"\b(?:rev(?:ision)?|version|ver)\b\.?\s*:?\s*v?(\d+(?:\.\d+)*[a-z]?)\b", re.IGNORECASE
+)
+FILENAME_VERSION_RE = re.compile(
+    r"(?:^|[_\-\s])v?(\d+(?:\.\d+)+[a-z]?)(?=$|[_\-\s])", re.IGNORECASE
+)
+# The title is everything on the title page above the author/revision block
+TITLE_END_RE = re.compile(r"^(?:author|by|rev|revision|version|ver)\b|@", re.IGNORECASE)
+# Titles at least this similar are taken to name the same specification
+MIN_TITLE_SIMILARITY = 0.8
+
+
+@dataclass
+class SpecIdentity:
+    path: str
+    title: str = ""
+    version: str = ""
+    title_page: str = ""
+
+
+@dataclass
+class TriageResult:
+    status: str
+    reason: str
+    latest: SpecIdentity
+    previous: SpecIdentity
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "pass"
+
+    @property
+    def rejected(self) -> bool:
+        return self.status == "reject"
+
+
+def title_page(path, max_pages=2) -> str:
+    # Only the first pages are extracted, which keeps triage far cheaper than
+    # parsing the whole document
+    reader = pypdf.PdfReader(str(path))
+    for page in reader.pages[:max_pages]:
+        text = page.extract_text() or ""
+        if text.strip():
+            return text
+    return ""
+
+
+def identify(path, text) -> SpecIdentity:
+    lines = [line.strip() for line in unicodedata.normalize("NFKC", text).splitlines()]
+    lines = [line for line in lines if line]
+    title = []
+    for line in lines:
+        if TITLE_END_RE.search(line):
+            break
+        title.append(line)
+    version = VERSION_RE.search("\n".join(lines))
+    if version is None:
+        version = FILENAME_VERSION_RE.search(Path(path).stem)
+    return SpecIdentity(
+        str(path), " ".join(title), version.group(1) if version else "", "\n".join(lines)
+    )
+
+
+def compare_versions(a, b) -> int:
+    # "0.5b" < "0.6" < "0.6a" < "0.7" < "1.0"; returns -1, 0 or 1
+    def parse(version):
+        match = re.fullmatch(r"(\d+(?:\.\d+)*)([a-z]?)", version.lower())
+        return [int(n) for n in match.group(1).split(".")], match.group(2)
+
+    (a_nums, a_suffix), (b_nums, b_suffix) = parse(a), parse(b)
+    width = max(len(a_nums), len(b_nums))
+    a_key = (a_nums + [0] * (width - len(a_nums)), a_suffix)
+    b_key = (b_nums + [0] * (width - len(b_nums)), b_suffix)
+    return (a_key > b_key) - (a_key < b_key)
+
+
+def check_pair(latest, previous) -> TriageResult:
+    def result(status, reason):
+        return TriageResult(status, reason, latest, previous)
+
+    if latest.title and previous.title:
+        similarity = difflib.SequenceMatcher(
+            None, _normalise(latest.title), _normalise(previous.title)
+        ).ratio()
+        if similarity < MIN_TITLE_SIMILARITY:
+            return result(
+                "reject",
+                f"Different specifications: '{latest.title}' vs '{previous.title}'",
+            )
+    if latest.version and previous.version:
+        order = compare_versions(latest.version, previous.version)
+        if order == 0:
+            return result("reject", f"Both files are version {latest.version}")
+        if order < 0:
+            return result(
+                "reject",
+                f"Latest version {latest.version} is older than previous {previous.version}",
+            )
+    if not (latest.title and previous.title and latest.version and previous.version):
+        # Nothing contradicts the pair, but the model has to confirm it
+        return result("unknown", "Title or version not found on the title pages")
+    return result(
+        "pass",
+        f"{latest.title}: version {latest.version} follows {previous.version}",
+    )
+
+
+def triage_pair(latest_path, previous_path) -> TriageResult:
+    latest = identify(latest_path, title_page(latest_path))
+    previous = identify(previous_path, title_page(previous_path))
+    result = check_pair(latest, previous)
+    config.logger.info(f"Triage {result.status}: {result.reason}")
+    return result
+
+
+def _normalise(title) -> str:
+    return " ".join(re.findall(r"\w+", title.lower()))
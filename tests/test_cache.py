@@ -0,0 +1,72 @@
+import time
+
+from copilot.types import FileAttachment
+
+from iraklis7_scg.cache import ResultCache, changed_files, snapshot_dir
+
+
+def test_cache_key(tmp_path):
+    spec = tmp_path / "spec.pdf"
+    spec.write_bytes(b"rev 0.7")
+    cache = ResultCache(cache_dir=tmp_path / "cache")
+    attachments = [FileAttachment(type="file", path=str(spec))]
+
+    key = cache.make_key("scg_delta_report", "gpt-5.2-Codex", "user", "prompt", attachments)
+    assert key == cache.make_key(
+        "scg_delta_report", "gpt-5.2-Codex", "user", "prompt", attachments
+    )
+    assert key != cache.make_key(
+        "scg_delta_report", "claude-sonnet-4.6", "user", "prompt", attachments
+    )
+
+    spec.write_bytes(b"rev 0.8")
+    assert key != cache.make_key(
+        "scg_delta_report", "gpt-5.2-Codex", "user", "prompt", attachments
+    )
+
+    missing = [FileAttachment(type="file", path=str(tmp_path / "missing.pdf"))]
+    assert cache.make_key("scg_delta_report", "gpt-5.2-Codex", "user", "prompt", missing) is None
+
+
+def test_cache_roundtrip(tmp_path):
+    out = tmp_path / "reports"
+    out.mkdir()
+    cache = ResultCache(cache_dir=tmp_path / "cache")
+
+    before = snapshot_dir(out)
+    (out / "UART_v0.7_delta_v0.6_report.md").write_text("# Report")
+    files = changed_files(before, snapshot_dir(out))
+    assert files == ["UART_v0.7_delta_v0.6_report.md"]
+
+    cache.put("ab" * 32, "scg_delta_report", "gpt-5.2-Codex", "done", out, files)
+    (out / "UART_v0.7_delta_v0.6_report.md").unlink()
+
+    entry = cache.get("ab" * 32)
+    assert entry["response"] == "done"
+    cache.restore(entry, out)
+    assert (out / "UART_v0.7_delta_v0.6_report.md").read_text() == "# Report"
+    assert not list(tmp_path.glob("cache/*/*/*.tmp"))
+
+    # Failed or cut short runs are not cached
+    for response in (None, "", "  \n"):
+        assert cache.put("cd" * 32, "scg_delta_report", "m", response, out, files) is None
+    assert cache.get("cd" * 32) is None
+
+
+def test_cache_eviction(tmp_path):
+    out = tmp_path / "reports"
+    out.mkdir()
+    (out / "report.md").write_text("x" * 100)
+
+    cache = ResultCache(cache_dir=tmp_path / "cache", max_bytes=250)
+    for i in range(2):
+        cache.put(f"{i:02d}" * 32, "scg_delta_report", "m", "done", out, ["report.md"])
+        time.sleep(0.01)
+    # Touching the oldest entry makes the second one least recently used
+    cache.get("00" * 32)
+    cache.put("02" * 32, "scg_delta_report", "m", "done", out, ["report.md"])
+    keys = {m["key"] for m in cache.list_entries()}
+    assert keys == {"00" * 32, "02" * 32}
+
+    aged = ResultCache(cache_dir=tmp_path / "cache", max_age=0)
+    assert aged.get("00" * 32) is None
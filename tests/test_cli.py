@@ -0,0 +1,77 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+import iraklis7_scg.config as config
+from iraklis7_scg.config import Settings
+
+# Runs cli.main in a fresh interpreter, so the modules it imports can be checked
+SCRIPT = """
+import json, sys
+from iraklis7_scg.cli import main
+code = main(json.loads(sys.argv[1]))
+print(json.dumps({"code": code, "copilot": "copilot" in sys.modules}))
+"""
+
+
+def run_cli(tmp_path, *argv):
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT, json.dumps(list(argv))],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        env={"PATH": "", "PYTHONPATH": str(config.PROJ_ROOT)},
+    )
+    assert result.returncode == 0, result.stderr
+    *output, status = result.stdout.splitlines()
+    return json.loads(status), output, result.stderr
+
+
+def test_settings_overrides():
+    settings = Settings.from_env(
+        {"SCG_CACHE_DIR": "/env/cache", "SCG_CACHE_MAX_BYTES": "10"}, report_dir="/cli"
+    )
+    assert str(settings.cache_dir) == "/env/cache"
+    assert settings.cache_max_bytes == 10
+    assert str(settings.report_dir) == "/cli"
+    with pytest.raises(ValueError):
+        Settings.from_env({}, cache_dri="/typo")
+
+
+def test_light_commands_skip_sdk_and_log_file(tmp_path):
+    cache_dir = tmp_path / "cache"
+    status, output, _ = run_cli(tmp_path, "--cache-dir", str(cache_dir), "cache", "list")
+    assert status == {"code": 0, "copilot": False}
+    assert output == []
+
+    status, output, _ = run_cli(tmp_path, "--cache-dir", str(cache_dir), "config")
+    assert status["copilot"] is False
+    assert json.loads("\n".join(output))["cache_dir"] == str(cache_dir)
+    assert not (tmp_path / "iraklis7_scg.log").exists()
+
+
+def test_validate_rejects_missing_and_non_pdf(tmp_path):
+    (tmp_path / "notes.pdf").write_text("plain text")
+    status, _, stderr = run_cli(tmp_path, "validate", "notes.pdf", "missing.pdf")
+    assert status == {"code": 1, "copilot": False}
+    assert "notes.pdf: not a PDF" in stderr
+    assert "missing.pdf: not found" in stderr
+
+
+def test_reports_query_without_sdk(tmp_path):
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    (reports / "UART_v0.7_delta_v0.6_report.md").write_text(
+        "# UART v0.7\n\n## 2. New Features\n\n### 2.1 Sampler\n\nSee Section 4.6.\n\n"
+        "**Development Effort Rating:** **MINOR**\n"
+    )
+    index = tmp_path / "reports.db"
+    argv = ("--report-dir", str(reports), "--report-index-file", str(index), "reports")
+    status, output, _ = run_cli(tmp_path, *argv, "search", "sampler", "--json")
+    assert status == {"code": 0, "copilot": False}
+    (hit,) = json.loads("\n".join(output))
+    assert (hit["latest"], hit["effort"], hit["references"]) == ("0.7", "Minor", ["Section 4.6"])
+    status, output, _ = run_cli(tmp_path, *argv, "features", "--section", "4.6")
+    assert output == ["UART 0.7 vs 0.6          feature    Minor  Sampler", "    Section 4.6"]
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from iraklis7_scg.daemon import SCGDaemon, request, submit
+from iraklis7_scg.jobs import Job
+
+
+class FakeSCG(object):
+    def __init__(self, order, gate, healthy=True):
+        self.order = order
+        self.gate = gate
+        self.healthy = healthy
+        self.stopped = False
+
+    async def client_start(self):
+        pass
+
+    async def client_stop(self):
+        self.stopped = True
+
+    async def client_ping(self):
+        if not self.healthy:
+            raise ConnectionError("CLI process exited")
+
+    async def client_check_connection(self):
+        return "connected"
+
+    async def create_report(self, model, streaming, attachments):
+        self.order.append(model)
+        await self.gate.wait()
+        return f"report by {model}"
+
+    async def stream_action(self, action, model, attachments):
+        for chunk in ["# UVM ", "testbench"]:
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_daemon_jobs(tmp_path):
+    order = []
+    gate = asyncio.Event()
+    clients = []
+
+    def factory():
+        clients.append(FakeSCG(order, gate, healthy=bool(clients)))
+        return clients[-1]
+
+    path = tmp_path / "scg.sock"
+    daemon = SCGDaemon(path, concurrency=1, ping_interval=0.05, factory=factory)
+    await daemon.start()
+    try:
+
+        async def run(model, priority):
+            job = Job("create_report", model, [{"type": "file", "path": "spec.pdf"}])
+            return [reply async for reply in submit(job, priority, path)]
+
+        blocking = asyncio.ensure_future(run("first", 10))
+        await asyncio.sleep(0.02)
+        late = asyncio.ensure_future(run("low", 20))
+        urgent = asyncio.ensure_future(run("high", 1))
+        await asyncio.sleep(0.1)
+        # The first client failed its health check, but is only replaced once
+        # its running job is done; no other job starts meanwhile
+        assert len(clients) == 1 and not clients[0].stopped
+        assert (await request("status", path))["stats"]["ready"] is False
+        gate.set()
+        replies = await asyncio.gather(blocking, late, urgent)
+        assert len(clients) == 2 and clients[0].stopped
+        assert replies[0][-1]["response"] == "report by first"
+        assert order == ["first", "high", "low"]
+        assert [r["event"] for r in replies[2]] == ["queued", "started", "done"]
+        assert replies[2][-1]["response"] == "report by high"
+
+        job = Job("build_uvm_tb", "claude", [], streaming=True)
+        replies = [reply async for reply in submit(job, socket_path=path)]
+        assert "".join(r["text"] for r in replies if r["event"] == "chunk") == "# UVM testbench"
+
+        job = Job("destroy", "m", [])
+        replies = [reply async for reply in submit(job, socket_path=path)]
+        assert replies[-1]["event"] == "error" and "Unknown action" in replies[-1]["message"]
+
+        status = await request("status", path)
+        assert status["stats"]["succeeded"] == 4 and status["stats"]["restarts"] == 1
+    finally:
+        await daemon.stop()
+    assert not path.exists()
+
+
+@pytest.mark.asyncio
+async def test_restart_drain_timeout(tmp_path):
+    gate = asyncio.Event()
+    clients = []
+
+    def factory():
+        clients.append(FakeSCG([], gate, healthy=bool(clients)))
+        return clients[-1]
+
+    path = tmp_path / "scg.sock"
+    daemon = SCGDaemon(path, ping_interval=0.05, drain_timeout=0.05, factory=factory)
+    await daemon.start()
+    try:
+        job = Job("create_report", "stuck", [])
+        daemon.submit(job)
+        await asyncio.sleep(0.2)
+        # A job that does not finish in time no longer holds up the restart
+        assert len(clients) == 2 and clients[0].stopped
+    finally:
+        gate.set()
+        await daemon.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_with_jobs_in_flight(tmp_path):
+    gate = asyncio.Event()
+    path = tmp_path / "scg.sock"
+    daemon = SCGDaemon(path, concurrency=1, factory=lambda: FakeSCG([], gate))
+    await daemon.start()
+
+    async def run(model):
+        job = Job("create_report", model, [])
+        return [reply async for reply in submit(job, socket_path=path)]
+
+    running = asyncio.ensure_future(run("running"))
+    queued = asyncio.ensure_future(run("queued"))
+    await asyncio.sleep(0.1)
+    assert (await request("status", path))["stats"]["running"]
+    # Neither the daemon nor its clients wait for the job that never finishes
+    await asyncio.wait_for(daemon.stop(), 2.0)
+    replies = await asyncio.wait_for(asyncio.gather(running, queued), 2.0)
+    for reply in replies:
+        assert reply[-1] == {"event": "error", "id": reply[0]["id"], "message": "Daemon stopped"}
+    assert [r["event"] for r in replies[0]] == ["queued", "started", "error"]
+    assert not path.exists()
@@ -0,0 +1,69 @@
+import pytest
+
+import iraklis7_scg.config as config
+import iraklis7_scg.docstore as docstore
+from iraklis7_scg.docstore import (
+    DocumentStore,
+    MappedPages,
+    MappedSection,
+    byte_offsets,
+)
+from iraklis7_scg.spec import extract_document
+
+
+def test_byte_offsets():
+    text = "Speciﬁcation ➔ DSR"
+    offsets = byte_offsets(text, [0, 5, 12, 13, len(text)])
+    assert offsets == [len(text[:o].encode()) for o in [0, 5, 12, 13, len(text)]]
+
+
+def test_document_store(tmp_path, monkeypatch):
+    store = DocumentStore(tmp_path / "docs")
+    doc = store.get(config.LATEST_SPEC)
+    extracted = extract_document(config.LATEST_SPEC)
+
+    assert doc.page_count == len(extracted.pages)
+    assert doc.page_text(15) == extracted.pages[14]
+    scr = doc.find_section("4.6")
+    assert scr.title == "Sampling Control Register (SCR)"
+    assert doc.section_text(scr) == extracted.sections[13].text
+    assert doc.find_section("sampling control register (scr)") is scr
+    with pytest.raises(ValueError):
+        doc.page_text(0)
+    assert store.get(config.LATEST_SPEC) is doc
+    scr_text = doc.section_text(scr)
+    page_count = doc.page_count
+    store.close()
+
+    # A fresh store over the same directory never parses the PDF again
+    def fail(path):
+        raise AssertionError(f"{path} parsed twice")
+
+    monkeypatch.setattr(docstore, "extract_pages", fail)
+    again = DocumentStore(tmp_path / "docs")
+    assert again.load_document(config.LATEST_SPEC).sections[13].text == scr_text
+    assert [e["pages"] for e in again.list_entries()] == [page_count]
+    again.close()
+
+    # Pages of a loaded document are read from the mapping when used
+    with DocumentStore(tmp_path / "docs") as store:
+        document = store.load_document(config.LATEST_SPEC)
+        assert isinstance(document.pages, MappedPages)
+        assert list(document.pages) == extracted.pages
+        assert document.pages[-1] == extracted.pages[-1]
+        assert document.pages[1:3] == extracted.pages[1:3]
+        assert document.size == extracted.size
+        # So are section texts, unless one is assigned
+        section = document.sections[13]
+        assert isinstance(section, MappedSection) and section.text == scr_text
+        section.text = "replaced"
+        assert section.text == "replaced"
+        with pytest.raises(IndexError):
+            document.pages[page_count]
+    with pytest.raises(ValueError):
+        document.pages[0]
+    with pytest.raises(ValueError):
+        document.sections[0].text
+    # A closed store maps its documents again on the next get
+    assert store.get(config.LATEST_SPEC).page_text(15) == extracted.pages[14]
+    store.close()
@@ -0,0 +1,105 @@
+import io
+import logging
+from types import SimpleNamespace
+
+from copilot.generated.session_events import SessionEventType
+import pytest
+
+from iraklis7_scg.events import (
+    FULL,
+    QUIET,
+    SUMMARY,
+    EventDispatcher,
+    EventSink,
+    LogSink,
+    StdoutSink,
+    parse_verbosity,
+)
+
+
+def event(event_type, **data):
+    return SimpleNamespace(type=event_type, data=SimpleNamespace(**data))
+
+
+class ListSink(EventSink):
+    def __init__(self):
+        self.records = []
+
+    async def handle(self, record):
+        self.records.append(record)
+
+
+class BrokenSink(EventSink):
+    async def handle(self, record):
+        raise RuntimeError("broken")
+
+
+def test_parse_verbosity():
+    assert parse_verbosity("tool.execution_complete=full, assistant.reasoning=quiet") == {
+        "tool.execution_complete": FULL,
+        "assistant.reasoning": QUIET,
+    }
+    with pytest.raises(ValueError):
+        parse_verbosity("assistant.reasoning=loud")
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_batches_stdout():
+    stream = io.StringIO()
+    writes = []
+    stream.write = lambda text, write=stream.write: writes.append(text) or write(text)
+    sink = ListSink()
+    dispatcher = EventDispatcher([StdoutSink(stream), sink, BrokenSink()])
+
+    for chunk in ["The ", "UART ", "report"]:
+        dispatcher.submit(
+            None, event(SessionEventType.ASSISTANT_MESSAGE_DELTA, delta_content=chunk)
+        )
+    # Nothing runs inside the callback itself
+    assert stream.getvalue() == "" and not sink.records
+    await dispatcher.drain()
+
+    assert stream.getvalue() == "The UART report"
+    assert writes == ["The UART report"]
+    assert len(sink.records) == 3
+    stats = dispatcher.get_stats()
+    assert stats["batches"] == 1 and stats["errors"] == 3
+
+    # Quiet on stdout, but other sinks (streamed files, metrics) still get it
+    dispatcher.set_verbosity(SessionEventType.ASSISTANT_MESSAGE_DELTA.value, "quiet")
+    dispatcher.submit(None, event(SessionEventType.ASSISTANT_MESSAGE_DELTA, delta_content="x"))
+    await dispatcher.drain()
+    assert stream.getvalue() == "The UART report"
+    assert len(sink.records) == 4
+    await dispatcher.close()
+
+    quiet = EventDispatcher([StdoutSink(stream)])
+    quiet.set_verbosity(SessionEventType.ASSISTANT_MESSAGE_DELTA.value, "quiet")
+    quiet.submit(None, event(SessionEventType.ASSISTANT_MESSAGE_DELTA, delta_content="x"))
+    # Nobody would handle it, so it is not even queued
+    assert quiet.get_stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_log_sink_verbosity(caplog):
+    caplog.set_level(logging.DEBUG)
+    result = SimpleNamespace(content="c" * 1000, detailed_content="d" * 10)
+    complete = event(
+        SessionEventType.TOOL_EXECUTION_COMPLETE,
+        tool_call_id="t1",
+        result=result,
+        error=None,
+        success=True,
+    )
+    dispatcher = EventDispatcher([LogSink()])
+    assert dispatcher.get_verbosity(complete.type.value) == SUMMARY
+    dispatcher.submit(None, complete)
+    await dispatcher.drain()
+    assert "Tool t1 result: 1000 chars, 10 detailed" in caplog.text
+    assert "c" * 1000 not in caplog.text
+
+    dispatcher.set_verbosity(complete.type.value, FULL)
+    dispatcher.submit(None, complete)
+    await dispatcher.drain()
+    assert "c" * 1000 in caplog.text
+    await dispatcher.close()
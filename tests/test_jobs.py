@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from iraklis7_scg.jobs import Job, JobScheduler
+
+
+class FakeSCG(object):
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def create_report(self, model, streaming, attachments):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        if model == "broken":
+            raise Exception("Session Error: broken")
+        return f"{model}:{len(attachments)}"
+
+
+@pytest.mark.asyncio
+async def test_job_scheduler():
+    scg = FakeSCG()
+    jobs = [Job(action="create_report", model=f"m{i}", attachments=[i]) for i in range(6)]
+    jobs.append(Job(action="create_report", model="broken", attachments=[]))
+
+    scheduler = JobScheduler(scg, concurrency=3)
+    results = await scheduler.run(jobs)
+
+    assert scg.peak == 3
+    assert [r.response for r in results[:6]] == [f"m{i}:1" for i in range(6)]
+    assert not results[6].ok and "broken" in str(results[6].error)
+
+    stats = scheduler.get_stats()
+    assert stats["jobs"] == 7 and stats["failed"] == 1
+    assert stats["peak_concurrency"] == 3
+    assert stats["speedup"] > 1.5
+
+
+@pytest.mark.asyncio
+async def test_job_scheduler_rejects_unknown_action():
+    with pytest.raises(ValueError):
+        await JobScheduler(FakeSCG()).run([Job(action="destroy", model="m", attachments=[])])
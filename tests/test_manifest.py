@@ -0,0 +1,103 @@
+import json
+from types import SimpleNamespace
+
+import iraklis7_scg.config as config
+from iraklis7_scg.docstore import DocumentStore
+from iraklis7_scg.manifest import (
+    ALL_SECTIONS,
+    MANIFEST_NAME,
+    Manifest,
+    build_manifest,
+    file_sections,
+    plan_update,
+    render_update,
+    section_hashes,
+)
+from iraklis7_scg.spec import Section
+
+PREVIOUS_SPEC = config.PROJ_ROOT / "ip/uart16550/doc/UART_spec.pdf"
+# Built from the previous spec, where LSR is 4.7 and the FCR is 4.4
+FILES = {
+    "uart_monitor.sv": "// Spec sections: 4.7\nclass uart_monitor;\nendclass\n",
+    "uart_driver.sv": "// Spec sections: 4.2\nclass uart_driver;\nendclass\n",
+    "uart_pkg.sv": "// Spec sections: all\npackage uart_pkg;\nendpackage\n",
+    "uart_seq.sv": '`uvm_error("SEQ", "FIFO not reset, see section 4.4")\n',
+    "uart_seq.sv.tmp": "half written\n",
+}
+
+
+def test_file_sections(tmp_path):
+    store = DocumentStore(tmp_path / "docs")
+    sections = build_manifest(tmp_path, store.get(PREVIOUS_SPEC), "", "", []).sections
+    assert file_sections("// Spec sections: 4.7", sections) == ["line status register (lsr)"]
+    # A chapter covers its subsections
+    assert len(file_sections("# Spec sections: 2", sections)) == 4
+    assert file_sections("see Section 4.10", sections) == ["debug 1"]
+    assert file_sections("// Spec sections: all", sections) == [ALL_SECTIONS]
+    assert file_sections("class uart_if;", sections) == [ALL_SECTIONS]
+
+
+def test_plan_update(tmp_path):
+    store = DocumentStore(tmp_path / "docs")
+    tb = tmp_path / "uvm_tb"
+    tb.mkdir()
+    for name, text in FILES.items():
+        (tb / name).write_text(text)
+    previous = store.get(PREVIOUS_SPEC)
+    manifest = build_manifest(tb, previous, PREVIOUS_SPEC, "model", list(FILES))
+    assert "uart_seq.sv.tmp" not in manifest.files
+    manifest.save(tb)
+    manifest = Manifest.load(tb)
+    assert manifest.files["uart_seq.sv"].sections == ["fifo control register (fcr)"]
+
+    assert plan_update(manifest, tb, previous).up_to_date
+
+    latest = store.get(config.LATEST_SPEC)
+    plan = plan_update(manifest, tb, latest)
+    assert "line status register (lsr)" in plan.changed
+    assert "interrupt enable register (ier)" not in plan.changed
+    assert plan.added == ["sampling control register (scr)"]
+    assert plan.affected == ["uart_monitor.sv", "uart_pkg.sv"]
+    assert plan.kept == ["uart_driver.sv", "uart_seq.sv"]
+
+    payload = render_update(latest, manifest, plan, tb)
+    assert "### 4.6 Sampling Control Register (SCR)" in payload
+    assert "class uart_monitor;" in payload
+    assert "class uart_driver;" not in payload
+    assert "- uart_driver.sv: 4.2 Interrupt Enable Register (IER)" in payload
+
+    # Hand edits are reported but do not force a rewrite, missing files do
+    (tb / "uart_driver.sv").write_text("// edited\n")
+    (tb / "uart_seq.sv").unlink()
+    plan = plan_update(manifest, tb, previous)
+    assert plan.edited == ["uart_driver.sv"]
+    assert plan.missing == ["uart_seq.sv"]
+    assert plan.affected == ["uart_seq.sv"]
+    assert not plan.up_to_date
+
+    # A file rewritten by an update that did not finish is no longer edited,
+    # while the spec it was built from stays the same
+    manifest.refresh(tb, ["uart_driver.sv", "uart_seq.sv", "new.sv"])
+    plan = plan_update(manifest, tb, latest)
+    assert plan.edited == []
+    assert plan.affected == ["uart_monitor.sv", "uart_pkg.sv", "uart_seq.sv"]
+
+
+def test_section_hashes_keep_row_content():
+    section = Section("4.2", "Interrupt Enable Register (IER)", 7, 7)
+
+    def doc(text):
+        return SimpleNamespace(sections=[section], section_text=lambda s: text)
+
+    rows = "0 RW Received data\n1 RW THR empty\nReset Value: 01b"
+    hashes = section_hashes(doc(rows))
+    # Rows emitted in another order are the same section
+    assert hashes == section_hashes(doc("Reset Value: 01b\n0 RW Received  data\n1 RW THR empty"))
+    # Swapped bit fields and a reset value of 01 -> 10 have the same characters
+    swapped = "0 RW THR empty\n1 RW Received data\nReset Value: 10b"
+    assert hashes != section_hashes(doc(swapped))
+
+
+def test_old_manifest_format_is_ignored(tmp_path):
+    (tmp_path / MANIFEST_NAME).write_text(json.dumps({"format": 1, "files": {}}))
+    assert Manifest.load(tmp_path) is None
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from iraklis7_scg.mapreduce import (
+    MapReduceOptions,
+    delta_windows,
+    page_windows,
+    run_map,
+)
+from iraklis7_scg.spec import Section, SectionDelta
+
+
+def test_page_windows():
+    assert page_windows(24, 10, 2) == [(1, 10), (9, 18), (17, 24)]
+    assert page_windows(5, 10, 2) == [(1, 5)]
+    assert page_windows(10, 5, 0) == [(1, 5), (6, 10)]
+    with pytest.raises(ValueError):
+        MapReduceOptions(window=4, overlap=4)
+
+
+def test_delta_windows():
+    def section(title, first, last, text=""):
+        return Section("", title, first, last, text)
+
+    pages = [f"line {n}" for n in range(1, 13)]
+    pages[2] = "b\nline 3"
+    changed = SectionDelta(
+        "changed",
+        section("b", 3, 4, "line 3\nline 4"),
+        section("b", 3, 5, "line 3\nline 4\nline 5"),
+        " line 3\n-old 4\n+line 4\n+line 5",
+    )
+    deltas = [
+        SectionDelta("unchanged", section("a", 1, 2), section("a", 1, 2)),
+        changed,
+        SectionDelta("removed", old=section("c", 6, 6)),
+        SectionDelta("added", new=section("d", 9, 11, "line 9\nline 10\nline 11")),
+    ]
+    groups = delta_windows(deltas, [(1, 4), (5, 8), (9, 10), (11, 12)], pages)
+    assert [(window, [d.status for d in group]) for window, group in groups] == [
+        ((1, 4), ["changed"]),
+        ((5, 8), ["changed", "removed"]),
+        ((9, 10), ["added"]),
+        ((11, 12), ["added"]),
+    ]
+    # Sections running past a window only bring the lines on its pages
+    first, second = groups[0][1][0], groups[1][1][0]
+    assert (first.new.first_page, first.new.last_page) == (3, 4)
+    assert first.diff == " line 3\n-old 4\n+line 4"
+    assert (second.new.first_page, second.new.last_page) == (5, 5)
+    assert second.diff == "+line 5"
+    assert groups[2][1][0].new.text == "line 9\nline 10"
+    assert groups[3][1][0].new.text == "line 11"
+    assert changed.new.last_page == 5
+    assert groups[1][1][1] is deltas[2]
+
+
+@pytest.mark.asyncio
+async def test_run_map():
+    running = 0
+    peak = 0
+
+    async def analyse(chunk):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02 * (5 - chunk))
+        running -= 1
+        if chunk == 9:
+            raise Exception("Session Error: broken")
+        return chunk * 2
+
+    assert await run_map(analyse, [1, 2, 3, 4], parallelism=2) == [2, 4, 6, 8]
+    assert peak == 2
+
+    with pytest.raises(Exception, match="broken"):
+        await run_map(analyse, [9, 1, 2], parallelism=3)
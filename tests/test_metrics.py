@@ -0,0 +1,90 @@
+import json
+from types import SimpleNamespace
+
+from copilot.generated.session_events import SessionEventType
+import pytest
+
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.metrics import MetricsSink, cache_read_ratio, cache_write_ratio
+
+
+def event(event_type, **data):
+    return SimpleNamespace(type=event_type, data=SimpleNamespace(**data))
+
+
+def usage(input_tokens, output_tokens, cache_read_tokens, cost):
+    return event(
+        SessionEventType.ASSISTANT_USAGE,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cache_read_tokens=cache_read_tokens,
+        cache_write_tokens=0,
+        cost=cost,
+        duration=1.5,
+    )
+
+
+def test_cache_read_ratio():
+    assert cache_read_ratio(300, 100) == 0.25
+    assert cache_read_ratio(0, 0) == 0.0
+    assert cache_write_ratio(300, 100, 200) == 0.5
+    assert cache_write_ratio(0, 0, 0) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_metrics_export(tmp_path):
+    sink = MetricsSink(tmp_path)
+    dispatcher = EventDispatcher([sink])
+    report, build = object(), object()
+
+    sink.begin(report, "scg_delta_report", "gpt-5.2-Codex")
+    sink.begin(build, "scg_build_uvm_tb", 'claude "sonnet"', "scg_build_uvm_tb@v2")
+    dispatcher.submit(report, event(SessionEventType.ASSISTANT_MESSAGE_DELTA, delta_content="#"))
+    dispatcher.submit(report, usage(300, 40, 100, 0.5))
+    dispatcher.submit(report, usage(100, 60, 300, 0.25))
+    dispatcher.submit(report, event(SessionEventType.SESSION_USAGE_INFO, current_tokens=900))
+    dispatcher.submit(build, usage(50, 10, 0, 0.125))
+    await dispatcher.drain()
+    first = sink.end(report)
+    sink.end(build, "error")
+
+    assert first.ttft is not None and first.ttft <= first.duration
+    assert first.requests == 2 and first.peak_context_tokens == 900
+    assert first.cache_read_ratio == 0.5
+
+    by_action = sink.summary()
+    assert by_action["scg_delta_report"]["output_tokens"] == 100
+    assert by_action["scg_delta_report"]["cost"] == 0.75
+    assert by_action["scg_build_uvm_tb"]["errors"] == 1
+    assert by_action["scg_build_uvm_tb"]["ttft_mean"] is None
+    assert set(sink.summary("model")) == {"gpt-5.2-Codex", 'claude "sonnet"'}
+    assert set(sink.summary("prompt")) == {"", "scg_build_uvm_tb@v2"}
+    with pytest.raises(ValueError):
+        sink.summary("day")
+
+    lines = (tmp_path / "sessions.jsonl").read_text().splitlines()
+    assert [json.loads(line)["status"] for line in lines] == ["ok", "error"]
+    assert sink.get_prom_path() == tmp_path / "scg.prom"
+    prom = sink.get_prom_path().read_text()
+    labels = 'action="scg_delta_report",model="gpt-5.2-Codex"'
+    assert f"scg_output_tokens_total{{{labels}}} 100" in prom
+    assert 'model="claude \\"sonnet\\""' in prom
+    assert "# TYPE scg_session_duration_seconds summary" in prom
+    assert f"scg_session_duration_seconds_count{{{labels}}} 1" in prom
+    assert f"scg_time_to_first_token_seconds_count{{{labels}}} 1" in prom
+    assert "counter" not in prom.split("# TYPE scg_session_duration_seconds")[1]
+
+    # Another process adds its sessions to the same textfile
+    other = MetricsSink(tmp_path)
+    other.begin(report, "scg_delta_report", "gpt-5.2-Codex")
+    other.end(report)
+    prom = other.get_prom_path().read_text()
+    assert f"scg_sessions_total{{{labels}}} 2" in prom
+    assert f"scg_output_tokens_total{{{labels}}} 100" in prom
+    assert list(tmp_path.glob("*.prom")) == [tmp_path / "scg.prom"]
+
+    # Events of sessions that are not being measured are not even queued
+    queued = dispatcher.get_stats()["queued"]
+    dispatcher.submit(report, usage(1, 1, 1, 1))
+    assert dispatcher.get_stats()["queued"] == queued
+    await dispatcher.close()
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from iraklis7_scg.cpw import CPW
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.policy import (
+    LatencyTracker,
+    RequestPolicy,
+    RequestStalled,
+    RequestTimeout,
+    SessionError,
+)
+from iraklis7_scg.replay import ReplayClient, synthetic_recording
+
+
+def test_deadline_follows_latency():
+    policy = RequestPolicy(min_timeout=10.0, min_samples=5)
+    tracker = LatencyTracker(window=10)
+    for seconds in (20.0, 30.0, 40.0, 50.0):
+        tracker.record("scg_map_uvm_tb", "gpt-5", seconds)
+    # Too little history, the caller's timeout stands
+    assert policy.deadline(tracker, "scg_map_uvm_tb", "gpt-5", 600.0) == 600.0
+    tracker.record("scg_map_uvm_tb", "gpt-5", 60.0)
+    assert policy.deadline(tracker, "scg_map_uvm_tb", "gpt-5", 600.0) == 120.0
+    assert policy.deadline(tracker, "scg_map_uvm_tb", "gpt-5", 100.0) == 100.0
+    for _ in range(10):
+        tracker.record("scg_map_uvm_tb", "gpt-5", 1.0)
+    # Old runs fall out of the window, min_timeout still applies
+    assert tracker.samples("scg_map_uvm_tb", "gpt-5") == [1.0] * 10
+    assert policy.deadline(tracker, "scg_map_uvm_tb", "gpt-5", 600.0) == 10.0
+    assert policy.hedge_delay(tracker, "scg_map_uvm_tb", "gpt-5") is None
+    hedged = RequestPolicy(hedge_percentile=0.9, min_samples=5)
+    assert hedged.hedge_delay(tracker, "scg_map_uvm_tb", "gpt-5") == 1.0
+    assert hedged.hedge_delay(tracker, "scg_triage", "gpt-5") is None
+
+
+def test_retry_delay():
+    policy = RequestPolicy(retries=2, backoff=2.0, backoff_max=3.0)
+    assert policy.retry_delay(0, RequestStalled("stalled"), rand=lambda: 1.0) == 2.0
+    assert policy.retry_delay(1, SessionError("overloaded"), rand=lambda: 1.0) == 3.0
+    assert policy.retry_delay(1, ConnectionError(), rand=lambda: 0.5) == 1.5
+    assert policy.retry_delay(2, RequestTimeout("late")) is None
+    assert policy.retry_delay(0, ValueError("bad spec")) is None
+    with pytest.raises(ValueError):
+        RequestPolicy(hedge_percentile=95)
+
+
+def test_latency_history(tmp_path):
+    path = tmp_path / "sessions.jsonl"
+    records = [
+        {"action": "scg_triage", "model": "gpt-5", "status": "ok", "duration": 2.0},
+        {"action": "scg_triage", "model": "gpt-5", "status": "error", "duration": 60.0},
+    ]
+    path.write_text("\n".join(json.dumps(r) for r in records) + "\n{truncated\n")
+    tracker = LatencyTracker()
+    assert tracker.load(path) == 1
+    assert tracker.samples("scg_triage", "gpt-5") == [2.0]
+    assert tracker.load(tmp_path / "missing.jsonl") == 0
+
+
+@pytest.mark.asyncio
+async def test_stalled_and_late_sends_are_aborted():
+    recording = synthetic_recording("gpt-5", text="UART report", chunk_chars=4)
+    # Nothing arrives for a second after the send
+    client = ReplayClient([recording], latency=1.0)
+    cpw = CPW(client=client, events=EventDispatcher([]))
+    await cpw.client_start()
+
+    for streaming in (True, False):
+        context = await cpw.create_session({"model": "gpt-5", "streaming": streaming})
+        started = time.perf_counter()
+        with pytest.raises(RequestStalled):
+            await cpw.client_send(streaming, {"prompt": "report"}, 5.0, context, 0.1)
+        assert time.perf_counter() - started < 0.5
+
+    context = await cpw.create_session({"model": "gpt-5", "streaming": True})
+    with pytest.raises(RequestTimeout):
+        await cpw.client_send(True, {"prompt": "report"}, 0.1, context)
+
+    # Cancelling the caller stops the session as well
+    context = await cpw.create_session({"model": "gpt-5", "streaming": True})
+    task = asyncio.ensure_future(cpw.client_send(True, {"prompt": "report"}, 5.0, context))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(1.0)
+    assert context.response is None
+    await cpw.client_stop()
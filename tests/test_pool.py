@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from iraklis7_scg.pool import SessionPool
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.destroyed = False
+
+    async def abort(self):
+        pass
+
+    async def destroy(self):
+        # Yields, as the SDK does, so other coroutines run meanwhile
+        await asyncio.sleep(0.01)
+        self.destroyed = True
+
+
+class FakeClient(object):
+    async def create_session(self, session_config):
+        await asyncio.sleep(0.01)
+        return FakeSession()
+
+
+SESSION_CONFIG = {"model": "gpt-5.2-Codex", "system_message": {"content": "x"}, "streaming": True}
+
+
+@pytest.mark.asyncio
+async def test_pool_prewarm_and_refill():
+    pool = SessionPool(FakeClient())
+    await pool.prewarm(SESSION_CONFIG, count=2)
+
+    first = await pool.acquire(SESSION_CONFIG)
+    await pool.release(first)
+    assert first.session.destroyed
+    await asyncio.sleep(0.05)
+
+    second = await pool.acquire(SESSION_CONFIG)
+    stats = pool.get_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 0
+    assert stats["idle"] == 1
+
+    other = await pool.acquire(dict(SESSION_CONFIG, model="claude-sonnet-4.6"))
+    assert pool.get_stats()["misses"] == 1
+    await pool.release(second)
+    await pool.release(other)
+    await pool.close()
+    assert pool.get_stats()["idle"] == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_reuse_and_expiry():
+    pool = SessionPool(FakeClient(), reuse=True, idle_timeout=0.02)
+    first = await pool.acquire(SESSION_CONFIG)
+    await pool.release(first)
+    again = await pool.acquire(SESSION_CONFIG)
+    assert again is first and not first.session.destroyed
+
+    await pool.release(again)
+    await asyncio.sleep(0.05)
+    fresh = await pool.acquire(SESSION_CONFIG)
+    assert fresh is not first and first.session.destroyed
+
+    await pool.release(fresh, healthy=False)
+    assert fresh.session.destroyed
+
+
+@pytest.mark.asyncio
+async def test_concurrent_acquire_after_expiry():
+    pool = SessionPool(FakeClient(), idle_timeout=0.02)
+    await pool.prewarm(SESSION_CONFIG, count=2)
+    await asyncio.sleep(0.05)
+    # Both prune the same expired sessions, each must be retired exactly once
+    leases = await asyncio.gather(
+        pool.acquire(SESSION_CONFIG),
+        pool.acquire(dict(SESSION_CONFIG, model="claude-sonnet-4.6")),
+        return_exceptions=True,
+    )
+    assert [type(lease).__name__ for lease in leases] == ["PooledSession"] * 2
+    assert pool.get_stats()["retired"] == 2
+    for lease in leases:
+        await pool.release(lease)
+    await pool.close()
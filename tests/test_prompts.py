@@ -0,0 +1,66 @@
+from iraklis7_scg.prompts import TASK_PROMPT, PromptTemplate, assemble, load_templates
+
+TEMPLATE = PromptTemplate("scg_delta_report", 2, "You are a verification engineer.", "Diff.")
+# Fingerprint of every SCG template at its current version. A template edited
+# without a version bump fails test_template_versions; after a bump, add its
+# new label and fingerprint here.
+FINGERPRINTS = {
+    "scg_build_uvm_tb@v1": "847b61e68348",
+    "scg_build_uvm_tb_mapped@v1": "e7d5074ea5c8",
+    "scg_delta_report@v1": "921d930f2c9c",
+    "scg_delta_report_diff@v1": "53702b1c3942",
+    "scg_map_delta_report@v1": "8196c37d7c40",
+    "scg_map_uvm_tb@v1": "d37d2f082e96",
+    "scg_reduce_delta_report@v1": "23ec0fb37074",
+    "scg_reduce_uvm_tb@v1": "305bd73a1564",
+    "scg_resume@v1": "dac39b79d257",
+    "scg_triage@v1": "1d64ff6a16be",
+    "scg_update_uvm_tb@v1": "c4055361115e",
+}
+
+
+def file(path):
+    return {"type": "file", "path": path}
+
+
+def test_template():
+    assert TEMPLATE.label == "scg_delta_report@v2"
+    assert TEMPLATE.system_message == "You are a verification engineer.\n\nDiff."
+    # Same text, same fingerprint, whatever the version says
+    assert PromptTemplate("x", 1, TEMPLATE.user, TEMPLATE.prompt).fingerprint == (
+        TEMPLATE.fingerprint
+    )
+    assert PromptTemplate("x", 2, TEMPLATE.user, "Diff!").fingerprint != TEMPLATE.fingerprint
+
+    templates = load_templates({"scg_resume": {"user": "", "prompt": "Resume."}})
+    assert templates["scg_resume"].label == "scg_resume@v1"
+
+
+def test_assemble_puts_stable_attachments_first():
+    rtl = {"type": "file", "path": "rtl_index.md", "displayName": "rtl_index.md"}
+    excerpt = file("excerpt.md")
+    first = assemble(TEMPLATE, [file("latest.pdf"), file("previous.pdf")], [rtl, excerpt])
+    second = assemble(TEMPLATE, [file("latest.pdf"), file("previous.pdf")], [excerpt, rtl])
+    assert first.attachments == second.attachments
+    assert [a["path"] for a in first.attachments] == [
+        "excerpt.md",
+        "rtl_index.md",
+        "latest.pdf",
+        "previous.pdf",
+    ]
+    assert first.system_message == TEMPLATE.system_message
+    assert first.prompt == TASK_PROMPT
+
+    resumed = assemble(TEMPLATE, [file("latest.pdf")], suffix="Continue from here.\n")
+    assert resumed.prompt == f"{TASK_PROMPT}\n\nContinue from here."
+
+
+def test_template_versions():
+    # Imported here, the SCG needs the Copilot SDK and the other tests do not
+    from iraklis7_scg.scg import SCG
+
+    for template in SCG().get_templates().values():
+        assert template.label in FINGERPRINTS, f"{template.label} is not recorded"
+        assert (
+            FINGERPRINTS[template.label] == template.fingerprint
+        ), f"{template.name} changed without a version bump"
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from iraklis7_scg.cpw import CPW
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.replay import (
+    RecordingClient,
+    ReplayClient,
+    load_recordings,
+    prompt_key,
+    synthetic_recording,
+)
+
+
+def config(model, streaming):
+    return {"model": model, "streaming": streaming}
+
+
+@pytest.mark.asyncio
+async def test_replay_through_cpw():
+    report = synthetic_recording("gpt-5", text="UART report", chunk_chars=4)
+    build = synthetic_recording("claude", text="uvm_tb", tools=0)
+    build["prompt_key"] = prompt_key("build it")
+    client = ReplayClient([report, build], latency=0.05)
+    cpw = CPW(client=client, events=EventDispatcher([]))
+    await cpw.client_start()
+
+    context = await cpw.create_session(config("gpt-5", True))
+    started = time.perf_counter()
+    assert await cpw.client_send(True, {"prompt": "report"}, 5.0, context) == "UART report"
+    assert time.perf_counter() - started >= 0.05
+
+    # The prompt picks its own recording, whatever the model
+    context = await cpw.create_session(config("gpt-5", False))
+    assert await cpw.client_send(False, {"prompt": "build it"}, 5.0, context) == "uvm_tb"
+    spans = {e["name"] for e in cpw.get_tracer().get_events()}
+    assert {"tool: view", "message streaming", "send"} <= spans
+    await cpw.client_stop()
+    # The session without streaming gets no deltas
+    assert client.stats == {"sessions": 2, "sends": 2, "events": 10 + 3}
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path):
+    source = ReplayClient([synthetic_recording("gpt-5", text="recorded", tools=1)])
+    cpw = CPW(client=RecordingClient(source, tmp_path), events=EventDispatcher([]))
+    await cpw.client_start()
+    context = await cpw.create_session(config("gpt-5", True))
+    assert await cpw.client_send(True, {"prompt": "report"}, 5.0, context) == "recorded"
+    await cpw.client_stop()
+
+    (recording,) = load_recordings(tmp_path)
+    assert recording["prompt_key"] == prompt_key("report")
+    assert [item["event"]["type"] for item in recording["events"]][:2] == [
+        "tool.execution_start",
+        "tool.execution_complete",
+    ]
+    replay = ReplayClient.from_dir(tmp_path, token_rate=1000)
+    session = await replay.create_session(config("other", False))
+    assert (await session.send_and_wait({"prompt": "report"})).data.content == "recorded"
+    with pytest.raises(ValueError):
+        load_recordings(tmp_path / "empty")
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from iraklis7_scg.reports import (
+    ReportStore,
+    match_expression,
+    parse_report,
+    report_versions,
+    version_key,
+)
+
+REPORT = """# UART Delta Report
+
+**Specification:** UART16550 IP Core Specification
+
+## 1. Specification Overview
+
+### Key features
+The core resets all registers on WB_RST_I.
+
+## 2. New Features
+
+### 2.1 Sampling Control Register
+
+#### Specification References
+- **Section 4.6:** "Sampling Control Register (SCR)"
+- **Figure 1 (Block Diagram):** new block
+
+**Development Effort Rating:** **MINOR**
+
+### 2.2 Parity
+
+Parity errors are flagged in LSR bit 2, see Section 4.7 and Table 3.
+
+```
+## not a heading
+```
+
+**Development Effort Rating:** Major
+
+## 3. Conclusion
+
+A major update.
+"""
+
+
+def test_parse_report():
+    assert report_versions("UART_v0.7_delta_v0.6_report.md") == ("UART", "0.7", "0.6")
+    assert report_versions("notes.md") is None
+    assert sorted(["0.10", "0.5b", "0.9", "0.5"], key=version_key) == [
+        "0.5",
+        "0.5b",
+        "0.9",
+        "0.10",
+    ]
+
+    report = parse_report(REPORT, "UART_0.6_delta_0.5b_report.md")
+    assert (report.spec, report.latest, report.previous) == ("UART", "0.6", "0.5b")
+    assert report.title == "UART Delta Report"
+    assert "resets all registers" in report.overview
+    assert report.conclusion == "A major update."
+    scr, parity = report.features
+    assert (scr.number, scr.title, scr.effort) == ("2.1", "Sampling Control Register", "Minor")
+    assert scr.references == ["Section 4.6", "Figure 1"]
+    assert parity.references == ["Section 4.7", "Table 3"]
+    assert "## not a heading" in parity.body
+    assert report.effort == "Major"
+
+
+def test_report_store(tmp_path):
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    (reports / "UART_0.6_delta_0.5b_report.md").write_text(REPORT)
+    (reports / "UART_v0.7_delta_v0.6_report.md").write_text(
+        "# UART v0.7\n\n## 2. New Features\n\n### 2.1 Debug\n\nResetting the debug "
+        "registers, see section 4.10.\n\nDevelopment effort rating: Minor\n"
+    )
+    (reports / "notes_report.md").write_text("# Not a delta report\n")
+    store = ReportStore(tmp_path / "index.db")
+    assert store.ingest(reports) == {"added": 2, "updated": 0, "removed": 0, "unchanged": 0}
+
+    # Stemmed: "reset" finds "resets" and "Resetting"
+    hits = store.search("reset")
+    assert {(h.latest, h.part) for h in hits} == {("0.6", "overview"), ("0.7", "feature")}
+    assert "[resets]" in next(h.snippet for h in hits if h.latest == "0.6")
+    assert [h.title for h in store.search("parity", effort="major")] == ["Parity"]
+    assert store.search("parity", spec="SPI") == []
+    assert [h.latest for h in store.features(section="4")] == ["0.6", "0.6", "0.7"]
+    assert [h.title for h in store.features(section="figure 1")] == ["Sampling Control Register"]
+    listed = store.reports()
+    assert [(r.latest, r.effort, len(r.features)) for r in listed] == [
+        ("0.6", "Major", 2),
+        ("0.7", "Minor", 1),
+    ]
+
+    # Only new and changed files are parsed again
+    path = reports / "UART_0.6_delta_0.5b_report.md"
+    os.utime(path, ns=(1, 1))
+    assert store.ingest(reports)["unchanged"] == 2
+    path.write_text(REPORT.replace("Parity", "Stick parity"))
+    (reports / "UART_v0.7_delta_v0.6_report.md").unlink()
+    assert store.ingest(reports) == {"added": 0, "updated": 1, "removed": 1, "unchanged": 0}
+    assert [h.title for h in store.search("stick")] == ["Stick parity"]
+    assert store.search("debug") == []
+
+    # Ingesting another directory leaves the first one's reports alone
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "SPI_1.1_delta_1.0_report.md").write_text("# SPI\n\n## 3. Conclusion\n\nSmall.\n")
+    assert store.ingest(other) == {"added": 1, "updated": 0, "removed": 0, "unchanged": 0}
+    assert [r.spec for r in store.reports()] == ["SPI", "UART"]
+    (other / "SPI_1.1_delta_1.0_report.md").unlink()
+    assert store.ingest(other)["removed"] == 1
+    assert [r.spec for r in store.reports()] == ["UART"]
+    with pytest.raises(ValueError):
+        store.features(effort="huge")
+    store.close()
+
+
+def test_match_expression():
+    assert match_expression("reset behaviour") == '"reset" "behaviour"'
+    assert match_expression("not-reset samp*") == '"not" "reset" "samp"*'
+    assert match_expression('"reset value" OR init') == '"reset value" OR init'
+    with pytest.raises(ValueError):
+        match_expression("--")
@@ -0,0 +1,77 @@
+import pytest
+
+import iraklis7_scg.config as config
+import iraklis7_scg.rtl as rtl
+from iraklis7_scg.rtl import RtlIndexStore, parse_source
+
+RTL_DIR = config.PROJ_ROOT / "ip/uart16550/rtl"
+
+ANSI = """
+`define BUS_REG_CTRL 4'h2 // Control
+`define BUS_CTRL_EN 0 // Enable
+/* `define IGNORED 1 */
+module bus #(parameter WIDTH = 8, DEPTH = 4) (
+  input  wire clk,
+  input  wire [WIDTH-1:0] data_i,
+`ifdef HAS_IRQ
+  output reg irq_o,
+`endif
+  output wire [WIDTH-1:0] data_o
+);
+  function [7:0] swap;
+    input [7:0] value;
+    swap = value;
+  endfunction
+  fifo #(.W(WIDTH)) u_fifo (.clk(clk));
+endmodule
+"""
+
+
+def test_parse_source():
+    parsed = parse_source(ANSI, "bus.v")
+    assert [d["name"] for d in parsed["defines"]] == ["BUS_REG_CTRL", "BUS_CTRL_EN"]
+    (module,) = parsed["modules"]
+    assert module["parameters"] == {"WIDTH": "8", "DEPTH": "4"}
+    ports = {p["name"]: p for p in module["ports"]}
+    # Task and function arguments are not ports
+    assert list(ports) == ["clk", "data_i", "irq_o", "data_o"]
+    assert ports["data_i"]["width"] == "[WIDTH-1:0]"
+    assert ports["irq_o"]["condition"] == "HAS_IRQ"
+    assert ports["data_o"]["condition"] == ""
+    assert module["instances"] == [("fifo", "u_fifo")]
+
+
+def test_index_and_diff(tmp_path, monkeypatch):
+    store = RtlIndexStore(tmp_path / "rtl")
+    index = store.get(RTL_DIR / "verilog")
+
+    top = index.get_module("uart_top")
+    ports = {p.name: p for p in top.ports}
+    assert ports["wb_clk_i"].direction == "input"
+    assert ports["baud_o"].condition == "UART_HAS_BAUDRATE_OUTPUT"
+    assert ("uart_regs", "regs") in top.instances
+    ier = index.get_register("IE")
+    assert ier.address == "1"
+    assert ("RDA", "0", "Received Data available interrupt") in ier.fields
+    assert ("BITS", "1:0", "bits in character") in index.get_register("LC").fields
+    digest = index.to_markdown()
+    assert "- output baud_o (if UART_HAS_BAUDRATE_OUTPUT)" in digest
+    assert len(digest) < sum(p.stat().st_size for p in (RTL_DIR / "verilog").glob("*.v")) / 5
+
+    diff = store.diff(RTL_DIR / "verilog-backup", RTL_DIR / "verilog")
+    assert diff.files_removed == ["uart_fifo.v"]
+    assert ("uart_fifo", "removed from uart_fifo.v") in diff.modules
+    assert ("uart_top", "port wb_sel_i added (input [3:0])") in diff.modules
+    assert ("SR", "added @7 Scratch register") in diff.registers
+    assert ("DL3", "removed @4") in diff.registers
+    assert ("UART_FIFO_REC_WIDTH", "10 -> 11") in diff.defines
+    assert store.diff(RTL_DIR / "verilog", RTL_DIR / "verilog").empty
+
+    # Parsed files are cached by contents, a fresh store parses nothing
+    def fail(text, file=""):
+        raise AssertionError(f"{file} parsed twice")
+
+    monkeypatch.setattr(rtl, "parse_source", fail)
+    assert RtlIndexStore(tmp_path / "rtl").get(RTL_DIR / "verilog") == index
+    with pytest.raises(ValueError):
+        store.get(tmp_path / "missing")
@@ -0,0 +1,91 @@
+import iraklis7_scg.config as config
+from iraklis7_scg.spec import (
+    SpecDocument,
+    delta_payload,
+    diff_documents,
+    normalise_rows,
+    normalise_text,
+    render_payload,
+    split_sections,
+    strip_furniture,
+)
+
+PREVIOUS = [
+    "UART IP Core\nRev. 0.6\nwww.opencores.org Rev 0.6 1",
+    "1\nIntroduction\nA serial core.\nwww.opencores.org Rev 0.6 2",
+    "4.1 Registers list\nLCR 3 8 RW\n5 RW Stick Parity bit.\nwww.opencores.org Rev 0.6 3",
+    "4.2 Modem Control Register (MCR)\nBit # Access\n0 W DTR\nwww.opencores.org Rev 0.6 4",
+]
+LATEST = [
+    "UART IP Core\nRev. 0.7\nwww.opencores.org Rev 0.6 1",
+    "1\nIntroduction\nA serial core.\nwww.opencores.org Rev 0.6 2",
+    "4.1 Registers list\nLCR 3 8 RW\n5 RW Stick Parity bit.\nwww.opencores.org Rev 0.6 3",
+    "4.2 Sampling Control Register (SCR)\n1-0 RW Sampler window\n"
+    "4.3 Modem Control Register (MCR)\nBit #Access\n0 W DTR\n1 W RTS\n"
+    "www.opencores.org Rev 0.6 4",
+]
+
+
+def document(name, pages):
+    pages = strip_furniture(pages)
+    return SpecDocument(name, pages, split_sections(pages))
+
+
+def test_split_sections():
+    doc = document("previous.pdf", PREVIOUS)
+    assert "www.opencores.org" not in "".join(doc.pages)
+    # The register bit row "5 RW ..." is not taken for chapter 5
+    assert [s.heading for s in doc.sections] == [
+        "Front matter",
+        "1 Introduction",
+        "4.1 Registers list",
+        "4.2 Modem Control Register (MCR)",
+    ]
+    assert doc.sections[2].text == "LCR 3 8 RW\n5 RW Stick Parity bit."
+
+
+def test_diff_documents():
+    previous = document("previous.pdf", PREVIOUS)
+    latest = document("latest.pdf", LATEST)
+    deltas = diff_documents(previous, latest)
+    status = {(d.new or d.old).title: d.status for d in deltas}
+    assert status == {
+        "Front matter": "changed",
+        "Introduction": "unchanged",
+        "Registers list": "unchanged",
+        "Sampling Control Register (SCR)": "added",
+        "Modem Control Register (MCR)": "changed",
+    }
+    mcr = deltas[-1]
+    assert mcr.old.number == "4.2" and mcr.new.number == "4.3"
+    # Spacing differences alone do not show up in the diff
+    assert "+1 W RTS" in mcr.diff and "-Bit" not in mcr.diff
+
+    payload = render_payload(latest, previous, deltas)
+    assert "- [unchanged] 1 Introduction (p. 2)" in payload
+    assert "### 4.2 Sampling Control Register (SCR) [added]" in payload
+    assert "A serial core." not in payload
+
+
+def test_delta_payload():
+    payload = delta_payload(
+        config.LATEST_SPEC, config.PROJ_ROOT / "ip/uart16550/doc/UART_spec.pdf"
+    )
+    assert payload is not None
+    assert "[added] 4.6 Sampling Control Register (SCR)" in payload
+    assert "[unchanged] 4.2 Interrupt Enable Register (IER)" in payload
+    assert delta_payload(config.LATEST_SPEC, config.LATEST_SPEC, max_ratio=0.0) is None
+
+
+def test_reordered_values_are_changes():
+    previous = document("previous.pdf", PREVIOUS)
+    latest = document("latest.pdf", PREVIOUS)
+    section = latest.sections[2]
+    # Rows may move, their content may not
+    section.text = "5 RW Stick Parity bit.\nLCR 3  8 RW"
+    assert diff_documents(previous, latest)[2].status == "unchanged"
+    # Same characters: swapped bit fields, a reset value of 01 -> 10
+    section.text = "LCR 3 8 RW\n5 RW Parity Stick bit."
+    assert diff_documents(previous, latest)[2].status == "changed"
+    assert normalise_rows("Reset 01") != normalise_rows("Reset 10")
+    assert normalise_text("Bit #Access\ufb01") == normalise_text("Bit # Access fi")
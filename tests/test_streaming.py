@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+from copilot.generated.session_events import SessionEventType
+import pytest
+
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.streaming import ReportStream, StreamSink
+
+
+def delta(text):
+    return SimpleNamespace(
+        type=SessionEventType.ASSISTANT_MESSAGE_DELTA,
+        data=SimpleNamespace(delta_content=text),
+    )
+
+
+def test_resume_from_checkpoint(tmp_path):
+    path = tmp_path / "create_report_0123.partial.md"
+    stream = ReportStream(path, "create_report", "gpt-5", checkpoint_bytes=8)
+    assert not stream.resumable
+    stream.open()
+    stream.write("# Delta report\n")
+    stream.maybe_checkpoint()
+    # Written after the last checkpoint, dropped when the run is resumed
+    with open(path, "ab") as f:
+        f.write(b"unflushed")
+
+    stream = ReportStream(path, "create_report", "gpt-5")
+    assert stream.resumable
+    assert stream.read_partial() == "# Delta report\n"
+    stream.open(resume=True)
+    assert stream.prefix == "# Delta report\n"
+    stream.write("## UART\n")
+    stream.close(complete=False)
+    assert path.read_text() == "# Delta report\n## UART\n"
+
+    stream = ReportStream(path, "create_report", "gpt-5")
+    assert stream.resumable
+    stream.open(resume=True)
+    assert stream.prefix == "# Delta report\n## UART\n"
+    stream.close(complete=True)
+    # Kept until the caller has the full text
+    assert path.exists() and not ReportStream(path, "create_report", "gpt-5").resumable
+    stream.discard()
+    assert not path.exists() and not stream.checkpoint_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_sink_streams_to_reader(tmp_path):
+    stream = ReportStream(tmp_path / "build_uvm_tb.partial.md", "build_uvm_tb", "gpt-5", 1)
+    stream.open()
+    sink = StreamSink()
+    dispatcher = EventDispatcher([sink])
+    context = object()
+    sink.attach(context, stream)
+
+    async def read():
+        return "".join([chunk async for chunk in stream.chunks()])
+
+    reader = asyncio.ensure_future(read())
+    # Multi-byte characters split across chunks must survive decoding
+    for chunk in ["uart_", "agent ", "✓"]:
+        dispatcher.submit(context, delta(chunk))
+        dispatcher.submit(object(), delta("other session"))
+        await dispatcher.drain()
+    assert not reader.done()
+    stream.close(complete=False)
+    sink.detach(context)
+    assert await reader == "uart_agent ✓"
+    assert not sink.wants(SessionEventType.ASSISTANT_MESSAGE_DELTA.value)
+    await dispatcher.close()
@@ -0,0 +1,82 @@
+import json
+from types import SimpleNamespace
+
+from copilot.generated.session_events import SessionEventType
+import pytest
+
+from iraklis7_scg.events import EventDispatcher
+from iraklis7_scg.tracing import CLIENT_LANE, Tracer, TraceSink
+
+
+def event(event_type, **data):
+    return SimpleNamespace(type=event_type, data=SimpleNamespace(**data))
+
+
+def test_tracer_export(tmp_path):
+    tracer = Tracer(max_events=3)
+    session = object()
+    with tracer.span("client start", "client"):
+        pass
+    with pytest.raises(RuntimeError):
+        with tracer.span("send", "session", session, streaming=True):
+            raise RuntimeError("timeout")
+    tracer.lane(session, "session gpt-5")
+    for _ in range(2):
+        tracer.instant("message", "stream", 0.0, session)
+    assert tracer.get_stats()["dropped"] == 1
+
+    tracer.export(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    names = {e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "thread_name"}
+    assert names == {"client", "session gpt-5"}
+    send = next(e for e in trace["traceEvents"] if e["name"] == "send")
+    assert send["tid"] != CLIENT_LANE and send["dur"] >= 0
+    assert send["args"] == {"streaming": True, "error": "RuntimeError: timeout"}
+
+
+@pytest.mark.asyncio
+async def test_trace_sink_spans():
+    tracer = Tracer()
+    dispatcher = EventDispatcher([TraceSink(tracer)])
+    context = SimpleNamespace(session=object())
+    for item in [
+        event(SessionEventType.ASSISTANT_REASONING_DELTA, delta_content="think"),
+        event(SessionEventType.TOOL_EXECUTION_START, tool_call_id="t1", tool_name="view"),
+        event(SessionEventType.TOOL_EXECUTION_START, tool_call_id="t2", tool_name="create"),
+        event(SessionEventType.TOOL_EXECUTION_COMPLETE, tool_call_id="t2", success=True),
+        event(SessionEventType.TOOL_EXECUTION_COMPLETE, tool_call_id="t1", success=False),
+        event(SessionEventType.ASSISTANT_MESSAGE_DELTA, delta_content="Done"),
+        event(SessionEventType.ASSISTANT_MESSAGE, content="Done"),
+        event(SessionEventType.ASSISTANT_MESSAGE, content="Again"),
+    ]:
+        dispatcher.submit(context, item)
+    await dispatcher.drain()
+    await dispatcher.close()
+
+    spans = [(e["name"], e["ph"]) for e in tracer.get_events()]
+    assert spans == [
+        ("tool: create", "X"),
+        ("tool: view", "X"),
+        ("reasoning streaming", "X"),
+        ("message streaming", "X"),
+        ("message", "i"),
+    ]
+    view = tracer.get_events()[1]
+    assert view["args"] == {"tool_call_id": "t1", "success": False}
+    assert {e["tid"] for e in tracer.get_events()} == {tracer.lane(context.session)}
+
+
+def test_retire_drops_session_state():
+    tracer = Tracer()
+    session, other = object(), object()
+    lane = tracer.lane(session, "session gpt-5")
+    tracer.mark(session, ("tool", "t1"), (0.0, "view"))
+    tracer.mark(session, "message", 1.0)
+    tracer.mark(session, "message", 2.0)
+    assert tracer.unmark(session, "message") == 1.0
+    tracer.retire(session)
+    # Nothing is left open, and lanes are never handed out twice
+    assert tracer.unmark(session, ("tool", "t1")) is None
+    assert tracer.lane(other) != lane
+    assert tracer.lane(session) not in (lane, tracer.lane(other))
+    tracer.retire(object())
@@ -0,0 +1,37 @@
+import time
+
+import iraklis7_scg.config as config
+from iraklis7_scg.triage import check_pair, compare_versions, identify, triage_pair
+
+
+def test_compare_versions():
+    assert compare_versions("0.7", "0.6") == 1
+    assert compare_versions("0.5b", "0.6") == -1
+    assert compare_versions("0.6a", "0.6") == 1
+    assert compare_versions("1.0", "1") == 0
+
+
+def test_check_pair():
+    latest = identify(
+        "UART_v0.7.pdf", "UART IP Core\nSpeciﬁcation\nAuthor: Jacob Gorban\nRev. 0.7"
+    )
+    assert (latest.title, latest.version) == ("UART IP Core Specification", "0.7")
+    previous = identify("UART_spec.pdf", "UART IP Core\nSpecification\nRev. 0.6")
+    other = identify("SPI_v1.2.pdf", "SPI Master Controller\nDatasheet")
+    unnumbered = identify("UART_spec.pdf", "UART IP Core\nSpecification")
+
+    assert check_pair(latest, previous).ok
+    assert check_pair(previous, latest).rejected
+    assert check_pair(latest, other).rejected
+    assert other.version == "1.2"
+    assert check_pair(latest, unnumbered).status == "unknown"
+
+
+def test_triage_pair():
+    started = time.perf_counter()
+    result = triage_pair(
+        config.SPECS_DIR / "UART_current.pdf", config.SPECS_DIR / "UART_latest.pdf"
+    )
+    assert result.rejected and "0.5b" in result.reason
+    assert triage_pair(config.LATEST_SPEC, config.SPECS_DIR / "UART_latest.pdf").ok
+    assert time.perf_counter() - started < 1.0